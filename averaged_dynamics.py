@@ -0,0 +1,225 @@
+import sys
+import numpy as np
+from . import initialization
+from . import trajectory_store
+
+
+def get_occupancy(rat, occupancy='uniform'):
+    """
+    Returns the probability of the rat to be at each position of the table
+
+    The positions are the positions of the discretized input rates, see
+    `Rat.get_flat_input_rates`.
+
+    Parameters
+    ----------
+    rat : Rat
+    occupancy : str
+        'uniform': Every position within the box is visited equally often
+        'sargolini_data': Histogram of the concatenated trajectories of
+            the Sargolini data. Only in two dimensions.
+
+    Returns
+    -------
+    occupancy : ndarray of shape (n_positions, )
+        Normalized to 1
+    """
+    if occupancy == 'uniform':
+        positions = rat.positions_input_space.reshape(-1, rat.dimensions)
+        if rat.boxtype == 'circular':
+            inside = np.sum(positions**2, axis=1) <= rat.radius_sq
+        else:
+            inside = np.all(np.abs(positions) <= rat.radius, axis=1)
+        histogram = inside.astype(np.float64)
+    elif occupancy == 'sargolini_data':
+        if rat.dimensions != 2:
+            sys.exit('ERROR: The occupancy of the Sargolini data is only '
+                     'defined in two dimensions')
+        positions, _ = trajectory_store.load(
+            getattr(rat, 'trajectory_store', ''))
+        rows = rat.get_input_rates_flat_index(positions)
+        histogram = np.bincount(
+            rows, minlength=rat.get_flat_input_rates()['exc'].shape[0]
+        ).astype(np.float64)
+    else:
+        sys.exit('ERROR: Occupancy {0} is not defined'.format(occupancy))
+    return histogram / np.sum(histogram)
+
+
+class AveragedRat:
+    """
+    Deterministic weight dynamics averaged over the positions of the rat
+
+    For slow learning the weights change little during the time the rat
+    needs to explore the arena. The weight changes of many time steps
+    can then be replaced by their average over the occupancy of the rat.
+    This dynamics is integrated with the Euler method with a time step
+    of 'averaged_time_step' simulation steps.
+
+    Two modes are available:
+
+    'rectified':
+        The output rates are computed and rectified at every occupied
+        position of the input rates table. This is the exact average of
+        the learning rules for the given occupancy.
+    'linear':
+        The output rate is not rectified. The averaged dynamics is then
+        determined by the occupancy weighted correlation matrices of the
+        inputs, which are computed only once. Faster if the number of
+        inputs is smaller than the number of occupied positions.
+
+    The raw data has the same layout as the raw data of `Rat.run`. The
+    trajectory dependent entries 'positions', 'phi' and 'output_rates'
+    are NaN. The occupancy is stored in rawdata['occupancy'].
+
+    Example
+    -------
+    rawdata = AveragedRat(parameters.params_test_2d).run()
+
+    Parameters
+    ----------
+    params : dict
+        Dictionary with simulation parameters. The parameters
+        'averaged_occupancy', 'averaged_mode' and 'averaged_time_step'
+        in params['sim'] specify the averaged dynamics.
+    """
+    def __init__(self, params):
+        self.rat = initialization.Rat(params)
+        self.populations = self.rat.populations
+        self.occupancy_type = getattr(self.rat, 'averaged_occupancy',
+                                      'uniform')
+        self.mode = getattr(self.rat, 'averaged_mode', 'rectified')
+        self.time_step = getattr(self.rat, 'averaged_time_step', 100)
+        self.check_compatibility()
+
+        self.occupancy = get_occupancy(self.rat, self.occupancy_type)
+        # Only positions that are visited contribute
+        self.occupied = np.flatnonzero(self.occupancy)
+        flat_input_rates = self.rat.get_flat_input_rates()
+        self.rates = {p: flat_input_rates[p][self.occupied]
+                      for p in self.populations}
+        self.weights = {p: self.rat.synapses[p].weights
+                        for p in self.populations}
+        self.eta_dt = {p: self.rat.synapses[p].eta_dt
+                       for p in self.populations}
+        self.mean_rates = {
+            p: np.dot(self.occupancy[self.occupied], self.rates[p])
+            for p in self.populations}
+        if self.mode == 'linear':
+            self.set_correlation_matrices()
+
+    def check_compatibility(self):
+        """
+        Exit if the averaged dynamics is not defined for the parameters
+        """
+        rat = self.rat
+        if not rat.discretize_space:
+            sys.exit('ERROR: The averaged dynamics requires discretize_space')
+        if rat.lateral_inhibition:
+            sys.exit('ERROR: The averaged dynamics is not implemented for '
+                     'lateral inhibition')
+        if (rat.room_switch_time or rat.boxside_switch_time
+                or rat.explore_all_time):
+            sys.exit('ERROR: The averaged dynamics is not implemented for '
+                     'room or boxside switches')
+        if getattr(rat, 'sparse_input_rates', False):
+            sys.exit('ERROR: The averaged dynamics is not implemented for '
+                     'sparse input rates')
+        if rat.normalization == 'linear_substractive':
+            sys.exit('ERROR: The averaged dynamics is not implemented for '
+                     'linear_substractive normalization')
+        if self.mode not in ['rectified', 'linear']:
+            sys.exit('ERROR: Averaged mode {0} is not defined'.format(
+                self.mode))
+
+    def set_correlation_matrices(self):
+        """
+        Occupancy weighted correlations of the input rates
+
+        corr[p, q] has shape (N_p, N_q).
+        """
+        occupancy = self.occupancy[self.occupied]
+        self.corr = {}
+        for p in self.populations:
+            weighted = self.rates[p] * occupancy[:, np.newaxis]
+            for q in self.populations:
+                self.corr[p, q] = np.dot(weighted.T, self.rates[q])
+
+    def get_weight_changes_rectified(self):
+        """
+        Averaged weight changes per time step with rectified output rates
+        """
+        output_rates = (np.dot(self.rates['exc'], self.weights['exc'].T)
+                        - np.dot(self.rates['inh'], self.weights['inh'].T))
+        output_rates[output_rates < 0] = 0
+        weighted = output_rates * self.occupancy[self.occupied, np.newaxis]
+        d_exc = self.eta_dt['exc'] * np.dot(weighted.T, self.rates['exc'])
+        d_inh = self.eta_dt['inh'] * (
+            np.dot(weighted.T, self.rates['inh'])
+            - self.rat.target_rate * self.mean_rates['inh'])
+        return d_exc, d_inh
+
+    def get_weight_changes_linear(self):
+        """
+        Averaged weight changes per time step with linear output rates
+        """
+        d_exc = self.eta_dt['exc'] * (
+            np.dot(self.weights['exc'], self.corr['exc', 'exc'])
+            - np.dot(self.weights['inh'], self.corr['inh', 'exc']))
+        d_inh = self.eta_dt['inh'] * (
+            np.dot(self.weights['exc'], self.corr['exc', 'inh'])
+            - np.dot(self.weights['inh'], self.corr['inh', 'inh'])
+            - self.rat.target_rate * self.mean_rates['inh'])
+        return d_exc, d_inh
+
+    def _store_weights(self, rawdata, index):
+        rat = self.rat
+        for p in self.populations:
+            rawdata[p]['weights'][index] = self.weights[p].copy()
+        rawdata['output_rate_grid'][index] = rat.get_output_rates_from_equation(
+            frame=index, rawdata=rawdata, spacing=rat.spacing,
+            positions_grid=rat.positions_grid,
+            input_rates=rat.input_rates_low_resolution,
+            equilibration_steps=rat.equilibration_steps)
+
+    def run(self):
+        """
+        Integrate the averaged dynamics and store the raw data
+
+        Returns
+        -------
+        rawdata : dict
+            Same layout as the rawdata of `Rat.run`
+        """
+        rat = self.rat
+        print('Averaged dynamics with {0} occupancy in {1} mode'.format(
+            self.occupancy_type, self.mode))
+        normalize_exc_weights = getattr(
+            rat, 'normalize_exc_weights_' + rat.normalization)
+        get_weight_changes = getattr(self,
+                                     'get_weight_changes_' + self.mode)
+        rat.boxside = rat.boxside_initial_side
+        rawdata = rat._prepare_rawdata()
+        for key in ['positions', 'output_rates', 'phi']:
+            if key in rawdata:
+                rawdata[key][:] = np.nan
+        rawdata['occupancy'] = self.occupancy.reshape(
+            rat.input_rates['exc'].shape[:-1])
+
+        time = 0.
+        for index in np.arange(1, len(rawdata['exc']['weights'])):
+            # Weights are stored at multiples of every_nth_step_weights
+            duration = index * rat.every_nth_step_weights - time
+            n_steps = int(np.ceil(duration / self.time_step))
+            for _ in np.arange(n_steps):
+                d_exc, d_inh = get_weight_changes()
+                self.weights['exc'] += (duration / n_steps) * d_exc
+                self.weights['inh'] += (duration / n_steps) * d_inh
+                self.weights['exc'][self.weights['exc'] < 0] = 0.
+                self.weights['inh'][self.weights['inh'] < 0] = 0.
+                normalize_exc_weights()
+            time += duration
+            print('Current step: %i' % time)
+            self._store_weights(rawdata, index)
+        print('Simulation finished')
+        return rat._finish_rawdata(rawdata)
@@ -0,0 +1,503 @@
+import copy
+import sys
+import numpy as np
+from . import initialization
+from . import trajectories
+from . import random_streams
+from . import input_rates_cache
+from .parameters import modify_parameters
+
+
+def get_params_for_seeds(params, seeds,
+                         seed_names=('seed_centers', 'seed_init_weights',
+                                     'seed_motion')):
+    """
+    Returns a list of parameter dictionaries that differ only in the seeds
+
+    Mirrors the linking of seeds in `JobInfoExperiment._prepare_tasks`,
+    where 'seed_centers', 'seed_init_weights' and 'seed_motion' are varied
+    together.
+
+    Parameters
+    ----------
+    params : dict
+        Dictionary with simulation parameters
+    seeds : array_like
+        One seed value for each replica
+    seed_names : tuple
+        Names of the seed parameters in params['sim'] that are set to
+        the seed value of each replica
+
+    Returns
+    -------
+    params_list : list of dict
+    """
+    params_list = []
+    for seed in seeds:
+        params_list.append(modify_parameters(
+            params, [('sim', name, int(seed)) for name in seed_names]))
+    return params_list
+
+
+def get_params_for_learning_rates(params, eta_exc, eta_inh):
+    """
+    Returns a list of parameter dictionaries that differ only in 'eta'
+
+    Parameters
+    ----------
+    params : dict
+        Dictionary with simulation parameters
+    eta_exc, eta_inh : array_like
+        The excitatory and inhibitory learning rate of each variant
+
+    Returns
+    -------
+    params_list : list of dict
+    """
+    if len(eta_exc) != len(eta_inh):
+        sys.exit('ERROR: The same number of excitatory and inhibitory '
+                 'learning rates is needed')
+    params_list = []
+    for e, i in zip(eta_exc, eta_inh):
+        params_list.append(modify_parameters(
+            params, [('exc', 'eta', float(e)), ('inh', 'eta', float(i))]))
+    return params_list
+
+
+class RatEnsemble:
+    """
+    Several replicas of Rat that are advanced in one vectorized loop
+
+    All replicas must share the same parameters except for the seeds.
+    The weights of the K replicas are stacked into arrays of shape
+    (K, output_neurons, N). The weights of each Rat instance are views
+    into these arrays, so that the rawdata of each replica can still be
+    stored with `Rat._add_to_rawdata`.
+
+    The trajectory of each replica is identical to the trajectory of a
+    single simulation with the same 'seed_motion', because the state of
+    the random number generator is stored for each replica individually.
+
+    Example
+    -------
+    params_list = get_params_for_seeds(parameters.params_test_2d, range(8))
+    rawdata_list = RatEnsemble(params_list).run()
+
+    Parameters
+    ----------
+    params_list : list of dict
+        One parameter dictionary for each replica. See
+        `get_params_for_seeds`.
+    """
+    def __init__(self, params_list):
+        self.populations = ['exc', 'inh']
+        self.rats = []
+        self.input_rates = {}
+        for k, params in enumerate(params_list):
+            rat = initialization.Rat(params)
+            # Stack the input rates of each replica right away, to keep
+            # only a single copy of each lookup table in memory.
+            if rat.discretize_space:
+                for p in self.populations:
+                    if k == 0:
+                        self.input_rates[p] = np.empty(
+                            (len(params_list), ) + rat.input_rates[p].shape)
+                    self.input_rates[p][k] = rat.input_rates[p]
+                    rat.input_rates[p] = self.input_rates[p][k]
+            self.rats.append(rat)
+        self.n_replicas = len(self.rats)
+        self.rat = self.rats[0]
+        # Views of shape (K, n_positions, N), see `Rat.get_flat_input_rates`
+        self.flat_input_rates = {
+            p: self.input_rates[p].reshape(
+                self.n_replicas, -1, self.input_rates[p].shape[-1])
+            for p in self.input_rates
+        }
+        self.check_compatibility()
+        self._stack_weights()
+
+    def _stack_weights(self):
+        """
+        Stacks the weights and learning rates of all replicas
+        """
+        self.weights = {}
+        for p in self.populations:
+            self.weights[p] = np.stack(
+                [rat.synapses[p].weights for rat in self.rats])
+            for k, rat in enumerate(self.rats):
+                rat.synapses[p].weights = self.weights[p][k]
+        # Learning rates of shape (K, 1, 1) to broadcast with the weights
+        self.eta_dt = {
+            p: np.array([rat.synapses[p].eta_dt for rat in self.rats]
+                        ).reshape(self.n_replicas, 1, 1)
+            for p in self.populations
+        }
+        self.initial_weight_sum = np.array(
+            [rat.synapses['exc'].initial_weight_sum for rat in self.rats])
+        self.initial_squared_weight_sum = np.array(
+            [rat.synapses['exc'].initial_squared_weight_sum
+             for rat in self.rats])
+        self.output_rate = np.zeros(
+            (self.n_replicas, self.rat.output_neurons))
+
+    def check_compatibility(self):
+        """
+        Exit if the replicas cannot be simulated together
+        """
+        for rat in self.rats:
+            for p in self.populations:
+                if rat.synapses[p].number != self.rat.synapses[p].number:
+                    sys.exit('ERROR: All replicas of an ensemble need the '
+                             'same number of inputs')
+        if self.rat.boxside_switch_time or self.rat.explore_all_time:
+            sys.exit('ERROR: Boxside switch experiments are not '
+                     'implemented for ensembles')
+        if getattr(self.rat, 'early_stopping', ''):
+            sys.exit('ERROR: Early stopping is not implemented for ensembles')
+        if int(getattr(self.rat, 'checkpoint_interval', 0)):
+            sys.exit('ERROR: Checkpoints are not implemented for ensembles')
+        if int(getattr(self.rat, 'learning_batch_size', 1)) > 1:
+            sys.exit('ERROR: Learning in mini batches is not implemented '
+                     'for ensembles')
+        if getattr(self.rat, 'sparse_input_rates', False):
+            sys.exit('ERROR: Sparse input rates are not implemented for '
+                     'ensembles')
+        if self.rat.normalization not in ['quadratic_multiplicative',
+                                          'linear_multiplicative',
+                                          'inactive']:
+            sys.exit('ERROR: Normalization {0} is not implemented for '
+                     'ensembles'.format(self.rat.normalization))
+
+    def get_trajectories(self, trajectory_list, random_states, steps):
+        """
+        Moves each replica with its own random number generator state
+
+        The replicas are moved one after another for all `steps`, so that
+        the state of the random number generator needs to be exchanged
+        only once per block of steps and not in every step.
+
+        Returns
+        -------
+        block : ndarray of shape (len(steps), K, 5)
+            The values of x, y, z, phi and theta in each step
+        """
+        block = np.empty((len(steps), self.n_replicas, 5))
+        for k, trajectory in enumerate(trajectory_list):
+            rng = trajectory.rat.rng_motion
+            random_streams.set_state(rng, random_states[k])
+            block[:, k] = trajectory.get_block(steps)
+            random_states[k] = random_streams.get_state(rng)
+        return block
+
+    def _set_replica_states(self, step, row):
+        """
+        Sets step, position, heading and output rate of each replica
+
+        Parameters
+        ----------
+        step : float
+        row : ndarray of shape (K, 5)
+            A row of the block, see `get_trajectories`
+        """
+        for k, rat in enumerate(self.rats):
+            rat.step = step
+            rat.x, rat.y, rat.z, rat.phi, rat.theta = row[k]
+            rat.output_rate = self.output_rate[k]
+
+    def get_input_rates_flat_index(self, positions):
+        """
+        Rows of the positions of a block, see `get_trajectories`
+        """
+        return self.rat.get_input_rates_flat_index(positions)
+
+    def get_current_input_rates(self, positions, rows=None):
+        """
+        Returns the input rates of all replicas at their current positions
+
+        Parameters
+        ----------
+        positions : ndarray of shape (K, dimensions)
+        rows : ndarray of shape (K, ), optional
+            Rows of the positions in the flattened input rates, see
+            `Rat.get_input_rates_flat_index`. Faster than indexing with
+            the positions.
+
+        Returns
+        -------
+        rates : dict
+            For each population an array of shape (K, N)
+        """
+        replicas = np.arange(self.n_replicas)
+        if rows is not None:
+            return {p: self.flat_input_rates[p][replicas, rows]
+                    for p in self.populations}
+        elif self.rat.discretize_space:
+            index = self.rat.get_input_rates_index(positions)
+            return {p: self.input_rates[p][(replicas, ) + index]
+                    for p in self.populations}
+        else:
+            return {p: np.array(
+                        [rat.get_rates_at_single_position[p](
+                            pos if rat.dimensions > 1 else pos[0])
+                         for rat, pos in zip(self.rats, positions)])
+                    for p in self.populations}
+
+    def set_current_output_rate(self, rates):
+        """
+        Same as `Rat.set_current_output_rate` for all replicas
+        """
+        rate = (
+            np.matmul(self.weights['exc'], rates['exc'][..., np.newaxis])
+            - np.matmul(self.weights['inh'], rates['inh'][..., np.newaxis])
+        )[..., 0]
+        rate[rate < 0] = 0
+        self.output_rate = rate
+
+    def set_current_output_rate_lateral_inhibition(self, rates):
+        """
+        Same as `Rat.set_current_output_rate_lateral_inhibition`
+        for all replicas
+        """
+        dt_tau = self.rat.dt_tau
+        rate = (
+            self.output_rate * (1 - dt_tau)
+            + dt_tau * ((
+                np.matmul(self.weights['exc'],
+                          rates['exc'][..., np.newaxis])
+                - np.matmul(self.weights['inh'],
+                            rates['inh'][..., np.newaxis])
+                )[..., 0]
+                - self.rat.weight_lateral
+                * (np.sum(self.output_rate, axis=1, keepdims=True)
+                   - self.output_rate)
+            )
+        )
+        rate[rate < 0] = 0
+        self.output_rate = rate
+
+    def update_weights(self, rates):
+        """
+        Same as `Rat.update_weights` for all replicas
+        """
+        self.weights['exc'] += (
+            (rates['exc'][:, np.newaxis, :] * self.eta_dt['exc'])
+            * self.output_rate[..., np.newaxis]
+        )
+        self.weights['inh'] += (
+            rates['inh'][:, np.newaxis, :] *
+            ((self.output_rate[..., np.newaxis] - self.rat.target_rate)
+             * self.eta_dt['inh'])
+        )
+
+    def normalize_exc_weights_quadratic_multiplicative(self):
+        factor = np.sqrt(
+            self.initial_squared_weight_sum
+            / np.einsum('...j,...j->...', self.weights['exc'],
+                        self.weights['exc']))
+        self.weights['exc'] *= factor[..., np.newaxis]
+
+    def normalize_exc_weights_linear_multiplicative(self):
+        factor = (self.initial_weight_sum
+                  / np.sum(self.weights['exc'], axis=(1, 2))[:, np.newaxis])
+        self.weights['exc'] *= factor[..., np.newaxis]
+
+    def normalize_exc_weights_inactive(self):
+        pass
+
+    def _room_switch(self):
+        for rat in self.rats:
+            rat._room_switch()
+        if self.rat.discretize_space:
+            for p in self.populations:
+                for k, rat in enumerate(self.rats):
+                    self.input_rates[p][k] = rat.input_rates[p]
+                    rat.input_rates[p] = self.input_rates[p][k]
+
+    def run(self):
+        """
+        Let all replicas move and learn and store their raw data.
+
+        Returns
+        -------
+        rawdata_list : list of dict
+            The rawdata of each replica, as returned by `Rat.run`
+        """
+        print('Number of replicas: {0}'.format(self.n_replicas))
+        trajectory_list = []
+        for rat in self.rats:
+            trajectory_list.append(trajectories.Trajectory(
+                rat, rat.get_move_function(),
+                mode=getattr(rat, 'trajectory_mode', 'reproducible')))
+            rat.set_boundary_conditions()
+        normalize_exc_weights = getattr(
+            self, 'normalize_exc_weights_' + self.rat.normalization)
+        if self.rat.lateral_inhibition:
+            set_output_rate = self.set_current_output_rate_lateral_inhibition
+        else:
+            set_output_rate = self.set_current_output_rate
+
+        rawdata_list = [rat._prepare_rawdata() for rat in self.rats]
+
+        random_states = []
+        for rat in self.rats:
+            rat.rng_motion = random_streams.get_rng(
+                rat.params['sim']['seed_motion'], 'motion', rat.rng_mode)
+            random_states.append(random_streams.get_state(rat.rng_motion))
+            rat.boxside = rat.boxside_initial_side
+        room_switch_time = self.rat.params['sim']['room_switch_time']
+
+        for steps in self.rat._get_step_blocks():
+            if room_switch_time:
+                if steps[0] == room_switch_time + 1:
+                    print(('Room switch at step: {0}'.format(steps[0])))
+                    self._room_switch()
+            block = self.get_trajectories(
+                trajectory_list, random_states, steps)
+            positions = block[..., :self.rat.dimensions]
+            if self.rat.discretize_space:
+                rows = self.get_input_rates_flat_index(positions)
+            else:
+                rows = [None] * len(steps)
+            for n, step in enumerate(steps):
+                rates = self.get_current_input_rates(positions[n], rows[n])
+                set_output_rate(rates)
+                self.update_weights(rates)
+                for p in self.populations:
+                    self.weights[p][self.weights[p] < 0] = 0.
+                normalize_exc_weights()
+
+                # The replicas are only updated when they store rawdata
+                if (step % self.rat.every_nth_step == 0
+                        or step % self.rat.every_nth_step_weights == 0):
+                    self._set_replica_states(step, block[n])
+                    for k, rat in enumerate(self.rats):
+                        rat._add_to_rawdata(rawdata_list[k], step)
+            self._set_replica_states(steps[-1], block[-1])
+
+        print('Simulation finished')
+        return [rat._finish_rawdata(rawdata)
+                for rat, rawdata in zip(self.rats, rawdata_list)]
+
+
+class LearningRateSweep(RatEnsemble):
+    """
+    Several learning rates simulated with a single trajectory
+
+    One Rat instance is created and moved. Each pair of excitatory and
+    inhibitory learning rates is a variant with its own weights, output
+    rate and normalization, which are stacked like the replicas of
+    `RatEnsemble`. The motion and the lookup of the input rates are
+    thus computed once for all learning rates, and the lookup tables
+    exist only once.
+
+    The rawdata of each variant is identical to the rawdata of a single
+    simulation with the same parameters.
+
+    Example
+    -------
+    params_list = get_params_for_learning_rates(
+        parameters.params_test_2d, eta_exc * factors, eta_inh * factors)
+    rawdata_list = LearningRateSweep(params_list).run()
+
+    Parameters
+    ----------
+    params_list : list of dict
+        One parameter dictionary for each variant. They must differ only
+        in the learning rates. See `get_params_for_learning_rates`.
+    """
+    def __init__(self, params_list):
+        self.populations = ['exc', 'inh']
+        keys = [self.get_key_without_learning_rates(params)
+                for params in params_list]
+        if len(set(keys)) > 1:
+            sys.exit('ERROR: The variants of a learning rate sweep may '
+                     'only differ in the learning rates')
+        self.rat = initialization.Rat(params_list[0])
+        self.rats = [self.rat] + [self.get_variant(params)
+                                  for params in params_list[1:]]
+        self.n_replicas = len(self.rats)
+        if self.rat.discretize_space:
+            self.flat_input_rates = self.rat.get_flat_input_rates()
+        self.check_compatibility()
+        self._stack_weights()
+
+    def get_key_without_learning_rates(self, params):
+        """
+        Returns a hash of all parameters except for 'eta'
+        """
+        return input_rates_cache.get_key({
+            p: ({k: v for k, v in params[p].items() if k != 'eta'}
+                if p in self.populations else params[p])
+            for p in params})
+
+    def get_variant(self, params):
+        """
+        Returns a shallow copy of `self.rat` with other learning rates
+
+        The copy shares the input rates with `self.rat`, but has its own
+        synapses, whose weights are replaced by views into the stacked
+        weights.
+        """
+        rat = copy.copy(self.rat)
+        rat.params = params
+        rat.synapses = {}
+        for p in self.populations:
+            synapses = copy.copy(self.rat.synapses[p])
+            synapses.eta = params[p]['eta']
+            synapses.eta_dt = synapses.dtype.type(
+                synapses.eta * synapses.dt)
+            synapses.weights = self.rat.synapses[p].weights.copy()
+            rat.synapses[p] = synapses
+        return rat
+
+    def get_trajectories(self, trajectory_list, random_states, steps):
+        """
+        Moves only `self.rat`
+
+        Returns
+        -------
+        block : ndarray of shape (len(steps), K, 5)
+            A read only view in which all variants share the trajectory
+        """
+        rng = self.rat.rng_motion
+        random_streams.set_state(rng, random_states[0])
+        block = trajectory_list[0].get_block(steps)
+        random_states[0] = random_streams.get_state(rng)
+        return np.broadcast_to(block[:, np.newaxis],
+                               (len(steps), self.n_replicas, 5))
+
+    def get_input_rates_flat_index(self, positions):
+        return self.rat.get_input_rates_flat_index(positions[:, 0])
+
+    def get_current_input_rates(self, positions, rows=None):
+        """
+        Returns the input rates at the position of all variants
+
+        Returns
+        -------
+        rates : dict
+            For each population an array of shape (1, N), which
+            broadcasts with the stacked weights
+        """
+        if rows is not None:
+            return {p: self.flat_input_rates[p][rows][np.newaxis]
+                    for p in self.populations}
+        elif self.rat.discretize_space:
+            index = self.rat.get_input_rates_index(positions[0])
+            return {p: self.rat.input_rates[p][index][np.newaxis]
+                    for p in self.populations}
+        else:
+            position = positions[0] if self.rat.dimensions > 1 \
+                else positions[0, 0]
+            return {p: self.rat.get_rates_at_single_position[p](
+                        position)[np.newaxis]
+                    for p in self.populations}
+
+    def _room_switch(self):
+        # The input rates are shared, so they are only switched once
+        self.rat._room_switch()
+        for rat in self.rats[1:]:
+            for p in self.populations:
+                rat.synapses[p].in_room2 = True
+        if self.rat.discretize_space:
+            self.flat_input_rates = self.rat.get_flat_input_rates()
@@ -11,6 +11,8 @@ from .snep.experiment import Experiment
 
 mpl.use('Agg')
 from . import initialization
+from . import input_rates_cache
+from . import averaged_dynamics
 import matplotlib.pyplot as plt
 from . import plotting
 from . import add_computed
@@ -78,8 +80,18 @@ def run_task_sleep(params, taskdir, tempdir):
     # The code should return all the rawdata as a nested dictionary whose
     # final leaves are arrays
     # See initialization.py for the run function
-    rat = initialization.Rat(params)
-    rawdata = rat.run()
+    if params['sim'].get('engine', 'stochastic') == 'averaged':
+        simulation = averaged_dynamics.AveragedRat(params)
+        rat = simulation.rat
+    else:
+        simulation = rat = initialization.Rat(params)
+    # Streamed rawdata is written to the tempdir of the task, see
+    # rawdata_store.py
+    if not params['sim'].get('rawdata_directory'):
+        rat.rawdata_directory = tempdir
+    if not params['sim'].get('checkpoint_directory'):
+        rat.checkpoint_directory = taskdir
+    rawdata = simulation.run()
     # rawdata is a dictionary of dictionaries (arbitrarily nested) with
     # keys (strings) and values (arrays or deeper dictionaries)
     # snep creates a group for each dictionary key and finally an array for
@@ -581,6 +593,20 @@ class JobInfoExperiment(Experiment):
                     'save_n_input_rates': 3,
                     'gaussian_process': gaussian_process,
                     'gaussian_process_rescale': 'fixed_mean',
+                    'gaussian_process_mode': 'batched',
+                    'gaussian_process_batch_size': 32,
+                    'dtype': 'float64',
+                    'rng_mode': 'legacy',
+                    'sparse_input_rates': False,
+                    'sparse_input_rates_tolerance': 1e-6,
+                    'incremental_normalization': False,
+                    'normalization_resync_interval': 1000,
+                    'input_rates_cache': '',
+                    'input_rates_cache_size': 1e10,
+                    'input_rates_shared_memory': False,
+                    'trajectory_store': '',
+                    'trajectory_frame_dt': 0,
+                    'trajectory_speed_factor': 1.0,
                     'take_fixed_point_weights': True,
                     'discretize_space': True,
                     # Take something smaller than the smallest
@@ -597,6 +623,7 @@ class JobInfoExperiment(Experiment):
                     'output_neurons': 1,
                     'weight_lateral': 0.0,
                     'tau': 10.,
+                    'lateral_inhibition_solver': 'vectorized',
                     'symmetric_centers': symmetric_centers,
                     'store_twoSigma2': False,
                     'dimensions': dimensions,
@@ -621,6 +648,27 @@ class JobInfoExperiment(Experiment):
                     'velocity': velocity,
                     'persistence_length': radius,
                     'motion': motion,
+                    # 'trajectory_mode': 'vectorized',
+                    'trajectory_mode': 'reproducible',
+                    'trajectory_block_size': 1e5,
+                    'learning_batch_size': 1,
+                    'mini_batch_reference': False,
+                    # 'engine': 'averaged',
+                    'engine': 'stochastic',
+                    'averaged_occupancy': 'uniform',
+                    'averaged_mode': 'rectified',
+                    'averaged_time_step': 100,
+                    # Streamed rawdata is stored in the tempdir of the task
+                    'stream_rawdata': False,
+                    # Checkpoints are stored in the taskdir, such that an
+                    # interrupted task resumes when it is run again
+                    'checkpoint_interval': 0,
+                    'output_rate_grid_workers': 0,
+                    # 'early_stopping': 'rate_map_correlation',
+                    'early_stopping': '',
+                    'early_stopping_threshold': 1e-2,
+                    'early_stopping_patience': 3,
+                    'profile': False,
                     'fixed_convolution_dx': False,
                     # 'boundary_conditions': 'periodic',
                 },
@@ -762,3 +810,8 @@ if __name__ == '__main__':
     # delete_tmp should be True to delete all temporary files and save storage
     job_info = run(JobInfoExperiment, ji_kwargs, job_time=timeout,
                    mem_per_task=6, delete_tmp=True)
+    # Free the shared memory of the input rates that are not used anymore
+    shared_memory_directory = input_rates_cache.get_shared_memory_directory()
+    if os.path.exists(shared_memory_directory):
+        input_rates_cache.InputRatesCache(
+            shared_memory_directory).remove_unused()
@@ -1,4 +1,9 @@
 # import pdb
+import os
+import sys
+import time
+import pickle
+import shutil
 import numpy as np
 import scipy.special as sps
 # from memory_profiler import profile
@@ -10,51 +15,63 @@ from scipy import signal
 import scipy
 from scipy.integrate import dblquad
 from . import utils
+from . import observables
+from . import trajectories
+from . import rawdata_store
+from . import profiling
+from . import input_rates_cache
+from . import trajectory_store
+from . import random_streams
 import functools
+from concurrent.futures import ThreadPoolExecutor
 # from . import gridscore.artificial_ratemaps as gs_artifical_ratemaps
 from gridscore import artificial_ratemaps as gs_artifical_ratemaps
 
-def get_gaussian_process(radius, sigma, linspace, dimensions=1, rescale='stretch',
-                         stretch_factor=1.0, extremum='none', untuned=False,
-                         fixed_convolution_dx=False):
+# Parameters that do not change the input rates tables. All other
+# parameters are part of the key of the input rates cache.
+INPUT_RATES_INDEPENDENT_SIM_PARAMETERS = [
+    'seed_motion', 'seed_init_weights', 'simulation_time', 'every_nth_step',
+    'every_nth_step_weights', 'motion', 'persistence_length', 'diff_const',
+    'initial_x', 'initial_y', 'initial_z', 'stationary_rat', 'tau',
+    'output_neurons', 'lateral_inhibition', 'lateral_inhibition_solver',
+    'weight_lateral', 'take_fixed_point_weights',
+    'scale_exc_weights_with_input_rate_variance', 'equilibration_steps',
+    'engine', 'averaged_occupancy', 'averaged_mode', 'averaged_time_step',
+    'trajectory_mode', 'trajectory_block_size', 'learning_batch_size',
+    'mini_batch_reference',
+    'checkpoint_interval', 'checkpoint_directory', 'early_stopping',
+    'early_stopping_threshold', 'early_stopping_patience', 'profile',
+    'stream_rawdata', 'rawdata_directory', 'output_rate_grid_workers',
+    'save_n_input_rates', 'store_twoSigma2', 'input_rates_cache',
+    'input_rates_cache_size', 'input_rates_shared_memory',
+    'incremental_normalization', 'normalization_resync_interval',
+    'trajectory_store', 'trajectory_frame_dt', 'trajectory_speed_factor',
+]
+INPUT_RATES_INDEPENDENT_TYPE_PARAMETERS = [
+    'eta', 'init_weight', 'init_weight_spreading', 'init_weight_distribution',
+    'save_n_input_rates', 'weight_factor',
+]
+
+def _get_gaussian_process_discretization(radius, sigma, dimensions=1,
+                                         fixed_convolution_dx=False):
     """
-    Returns function with autocorrelation length sqrt(2)*sigma
-
-    So the returned function has the same autocorrelation length like a
-    gaussian of standard deviation sigma.
+    Returns the discretization of the convolution of a Gaussian process
 
-    See also note in Evernote: 'Convolution to get gaussian process inputs'
+    See get_gaussian_process for the parameters.
 
-    Parameters
-    ----------
-    radius : float
-    sigma : float or ndarray
-        The autocorrelation length of the resulting function will be the
-        same as of a Gaussian with standard deviation of `sigma`
-    linspace : ndarray
-        Linear space on which the returned function should lie.
-        Typically (-limit, limit, spacing), where `limit` either equals
-        `radius` or is slightly larger if there's a chance that the
-        rat moves outside the box. Typically limit = 1.1 * radius.
-        Note: The limit must be <= 2*radius. If you ever want to change this,
-        make the value of agp larger than 2.
-    dimensions : int
-        Number of dimensions of the gaussian process function
-    rescale : str
-        If 'stretch' the final function is scaled between 0 and 1
-        If 'fixed_mean', the mean of the final function is set to
-        a desired value (currently 0.5)
-    untuned : bool
-        If True, than independent of the sigma value the input will have
-        no spatial tuning and will fire at the desired mean value everywhere.
-    Return
-    ------
-    output : ndarray
-        An interpolation of a random function with the same autocorrelation
-        length as a Gaussian of std = sigma, interpolated to the
-        discretization defined given in `linspace`.
+    Returns
+    -------
+    white_noise_shape : tuple of int
+    gaussian : ndarray
+        The convolution kernel, with the axes in the order of the
+        white noise
+    conv_spaces : list of ndarray
+        Positions of the valid convolution along each axis
+    dx : float or ndarray
+        The bin width
     """
     if dimensions == 1:
+        sigma = np.squeeze(sigma)
         if fixed_convolution_dx:
             dx = fixed_convolution_dx
             agauss = 1.0
@@ -87,18 +104,114 @@ def get_gaussian_process(radius, sigma, linspace, dimensions=1, rescale='stretch
         # We take the white noise on a larger array
         bins_wn = (agauss + agp) * bins_per_radius
         bins_gp = agp * bins_per_radius
-        # White noise between -0.5 and 0.5 (zero mean)
-        # Note: The range doesn't matter.
-        white_noise = np.random.random(2*bins_wn.astype(np.int64)) - 0.5
+        white_noise_shape = (int(2*bins_wn),)
         gauss_limit = agauss*radius
-        gauss_space = np.linspace(-gauss_limit, gauss_limit, 2*bins_gauss)
+        gauss_space = np.linspace(-gauss_limit, gauss_limit,
+                                  int(2*bins_gauss))
         conv_limit = agp*radius
         # Note: you need to add +1 to the number of bins
-        conv_space = np.linspace(-conv_limit, conv_limit, 2*bins_gp + 1)
+        conv_space = np.linspace(-conv_limit, conv_limit, int(2*bins_gp) + 1)
         # Centered Gaussian on gauss_space
         # gaussian = np.sqrt(2 * np.pi * sigma**2) * stats.norm(loc=0.0,
         # 					scale=sigma).pdf(gauss_space)
         gaussian = stats.norm(loc=0.0, scale=sigma).pdf(gauss_space)
+        return white_noise_shape, gaussian, [conv_space], dx
+
+    elif dimensions == 2:
+        # Works like in 1D but we take a larger dx, for faster initialization
+        dx = sigma / 10.
+        # We choose 1.0 as the standard
+        agauss = np.array([1.0, 1.0])
+        # Only in the dimensions where sigma>radius/8 we change it
+        agauss[sigma>radius/8.] = np.ceil(8*sigma)[sigma>radius/8.]
+        # Change dx as in 1D case (unchanged values will just be divided by 1)
+        dx /= agauss
+        agp = np.array([2, 2])
+        # The number of bins for each ocurring array
+        bins_per_radius = np.ceil(radius / dx)
+        bins_wn = (agauss + agp) * bins_per_radius
+        bins_gauss = agauss * bins_per_radius
+        bins_gp = agp * bins_per_radius
+        white_noise_shape = tuple((2*bins_wn).astype(np.int64))
+        # Now we need to differentiate between x and y
+        gauss_limit = agauss*radius
+        gauss_space_x = np.linspace(-gauss_limit[0], gauss_limit[0],
+                                    int(2*bins_gauss[0]))
+        gauss_space_y = np.linspace(-gauss_limit[1], gauss_limit[1],
+                                    int(2*bins_gauss[1]))
+        conv_limit = agp*radius
+        conv_space_x = np.linspace(-conv_limit[0], conv_limit[0],
+                                   int(2*bins_gp[0]) + 1)
+        conv_space_y = np.linspace(-conv_limit[1], conv_limit[1],
+                                   int(2*bins_gp[1]) + 1)
+        # Note: meshgrid leads to shape (len(gauss_space_y), len(gauss_space_x))
+        X_gauss, Y_gauss = np.meshgrid(gauss_space_x, gauss_space_y)
+        pos = np.empty(X_gauss.shape + (2,))
+        pos[:, :, 0] = X_gauss
+        pos[:, :, 1] = Y_gauss
+        gaussian = ((2*np.pi*sigma[0]**1) *
+                    stats.multivariate_normal(
+                        None,
+                        [[sigma[0]**2, 0.0], [0.0, sigma[1]**2]]).pdf(pos))
+        # Since gaussian now has switched x and y we transpose it to make
+        # it fit the shape of the white noise.
+        # Note: now plotting the result with plt.contour shows switched x and y
+        return white_noise_shape, gaussian.T, [conv_space_x, conv_space_y], dx
+
+
+def get_gaussian_process(radius, sigma, linspace, dimensions=1, rescale='stretch',
+                         stretch_factor=1.0, extremum='none', untuned=False,
+                         fixed_convolution_dx=False, rng=None):
+    """
+    Returns function with autocorrelation length sqrt(2)*sigma
+
+    So the returned function has the same autocorrelation length like a
+    gaussian of standard deviation sigma.
+
+    See also note in Evernote: 'Convolution to get gaussian process inputs'
+
+    Parameters
+    ----------
+    radius : float
+    sigma : float or ndarray
+        The autocorrelation length of the resulting function will be the
+        same as of a Gaussian with standard deviation of `sigma`
+    linspace : ndarray
+        Linear space on which the returned function should lie.
+        Typically (-limit, limit, spacing), where `limit` either equals
+        `radius` or is slightly larger if there's a chance that the
+        rat moves outside the box. Typically limit = 1.1 * radius.
+        Note: The limit must be <= 2*radius. If you ever want to change this,
+        make the value of agp larger than 2.
+    dimensions : int
+        Number of dimensions of the gaussian process function
+    rescale : str
+        If 'stretch' the final function is scaled between 0 and 1
+        If 'fixed_mean', the mean of the final function is set to
+        a desired value (currently 0.5)
+    untuned : bool
+        If True, than independent of the sigma value the input will have
+        no spatial tuning and will fire at the desired mean value everywhere.
+    rng : random number generator, optional
+        Of the white noise, see random_streams.get_rng. Default: the
+        global random state of numpy.
+    Return
+    ------
+    output : ndarray
+        An interpolation of a random function with the same autocorrelation
+        length as a Gaussian of std = sigma, interpolated to the
+        discretization defined given in `linspace`.
+    """
+    white_noise_shape, gaussian, conv_spaces, dx = \
+        _get_gaussian_process_discretization(
+            radius, sigma, dimensions, fixed_convolution_dx)
+    if rng is None:
+        rng = np.random
+    if dimensions == 1:
+        conv_space = conv_spaces[0]
+        # White noise between -0.5 and 0.5 (zero mean)
+        # Note: The range doesn't matter.
+        white_noise = rng.random(white_noise_shape) - 0.5
         # Convolve the Gaussian with the white_noise
         # Note: in fft convolve the larger array must be the first argument
         convolution = signal.fftconvolve(white_noise, gaussian, mode='valid')
@@ -132,41 +245,9 @@ def get_gaussian_process(radius, sigma, linspace, dimensions=1, rescale='stretch
         return gp, gp_min, gp_max
 
     elif dimensions == 2:
-        # Works like in 1D but we take a larger dx, for faster initialization
-        dx = sigma / 10.
-        # We choose 1.0 as the standard
-        agauss = np.array([1.0, 1.0])
-        # Only in the dimensions where sigma>radius/8 we change it
-        agauss[sigma>radius/8.] = np.ceil(8*sigma)[sigma>radius/8.]
-        # Change dx as in 1D case (unchanged values will just be divided by 1)
-        dx /= agauss
-        agp = np.array([2, 2])
-        # The number of bins for each ocurring array
-        bins_per_radius = np.ceil(radius / dx)
-        bins_wn = (agauss + agp) * bins_per_radius
-        bins_gauss = agauss * bins_per_radius
-        bins_gp = agp * bins_per_radius
-        white_noise = np.random.random(2*bins_wn)
-        # Now we need to differentiate between x and y
-        gauss_limit = agauss*radius
-        gauss_space_x = np.linspace(-gauss_limit[0], gauss_limit[0], 2*bins_gauss[0])
-        gauss_space_y = np.linspace(-gauss_limit[1], gauss_limit[1], 2*bins_gauss[1])
-        conv_limit = agp*radius
-        conv_space_x = np.linspace(-conv_limit[0], conv_limit[0], 2*bins_gp[0] + 1)
-        conv_space_y = np.linspace(-conv_limit[1], conv_limit[1], 2*bins_gp[1] + 1)
-        # Note: meshgrid leads to shape (len(gauss_space_y), len(gauss_space_x))
-        X_gauss, Y_gauss = np.meshgrid(gauss_space_x, gauss_space_y)
-        pos = np.empty(X_gauss.shape + (2,))
-        pos[:, :, 0] = X_gauss
-        pos[:, :, 1] = Y_gauss
-        gaussian = ((2*np.pi*sigma[0]**1) *
-                    stats.multivariate_normal(
-                        None,
-                        [[sigma[0]**2, 0.0], [0.0, sigma[1]**2]]).pdf(pos))
-        # Since gaussian now has switched x and y we transpose it to make
-        # it fit the shape of the white noise.
-        # Note: now plotting the result with plt.contour shows switched x and y
-        convolution = signal.fftconvolve(white_noise, gaussian.T, mode='valid')
+        conv_space_x, conv_space_y = conv_spaces
+        white_noise = rng.random(white_noise_shape)
+        convolution = signal.fftconvolve(white_noise, gaussian, mode='valid')
         # Interpolate, i.e. only look at the gp in the region of interest
         gp = scipy.interpolate.RectBivariateSpline(
                     conv_space_x, conv_space_y, convolution)(linspace, linspace)
@@ -186,6 +267,173 @@ def get_gaussian_process(radius, sigma, linspace, dimensions=1, rescale='stretch
             sys.exit()
         return gp
 
+
+def get_linear_interpolation_weights(xp, x):
+    """
+    Returns indices and weights of the linear interpolation from `xp` to `x`
+
+    The interpolation of data `fp` along its first axis is
+    (1 - w) * fp[j] + w * fp[j + 1], which equals np.interp(x, xp, fp),
+    up to round off, also for an array `fp` of several functions.
+
+    Parameters
+    ----------
+    xp : ndarray of shape (m, )
+        Increasing positions of the data
+    x : ndarray of shape (n, )
+        Positions at which the data is interpolated
+
+    Returns
+    -------
+    j : ndarray of shape (n, ) of int
+    w : ndarray of shape (n, )
+    """
+    j = np.clip(np.searchsorted(xp, x, side='right') - 1, 0, len(xp) - 2)
+    w = np.clip((x - xp[j]) / (xp[j + 1] - xp[j]), 0., 1.)
+    return j, w
+
+
+def get_linear_interpolation_matrix(xp, x):
+    """
+    Returns the matrix of the linear interpolation from `xp` to `x`
+
+    np.dot(matrix, fp) is the interpolation of `fp` along its first axis.
+    See get_linear_interpolation_weights.
+
+    Returns
+    -------
+    matrix : ndarray of shape (n, m)
+    """
+    j, w = get_linear_interpolation_weights(xp, x)
+    matrix = np.zeros((len(x), len(xp)))
+    rows = np.arange(len(x))
+    matrix[rows, j] = 1. - w
+    matrix[rows, j + 1] += w
+    return matrix
+
+
+def get_spline_interpolation_matrix(xp, x):
+    """
+    Returns the matrix of the cubic spline interpolation from `xp` to `x`
+
+    Interpolating splines are linear in the data, so the interpolation
+    of data on a rectangular grid, as done by
+    scipy.interpolate.RectBivariateSpline, is a product of such matrices
+    along each axis.
+
+    Parameters as in get_linear_interpolation_weights
+
+    Returns
+    -------
+    matrix : ndarray of shape (n, m)
+    """
+    return scipy.interpolate.make_interp_spline(xp, np.eye(len(xp)), k=3)(x)
+
+
+def get_gaussian_processes(radius, sigma, linspace, n, dimensions=1,
+                           rescale='stretch', stretch_factor=1.0,
+                           extremum='none', untuned=False,
+                           fixed_convolution_dx=False, batch_size=32,
+                           dtype=np.float64, rng=None):
+    """
+    Returns `n` Gaussian processes at once
+
+    Like `n` calls of get_gaussian_process, but the kernel spectrum and
+    the interpolation matrices are computed only once. The white noise
+    of `batch_size` functions is convolved in a single real FFT.
+
+    The white noise is drawn function by function in the same order as
+    in `n` calls of get_gaussian_process, so the random stream is the
+    same and the functions agree up to floating point round off.
+
+    Parameters
+    ----------
+    n : int
+        Number of functions
+    batch_size : int
+        Number of functions that are convolved together. In 2D each
+        function needs a few MB during the convolution.
+    dtype : numpy dtype
+        Of the returned functions. They are computed in double precision.
+    See get_gaussian_process for the other parameters, including `rng`.
+
+    Returns
+    -------
+    gps : ndarray
+        Shape (len(linspace), n) in 1D and
+        (len(linspace), len(linspace), n) in 2D
+    gp_min, gp_max : ndarray of shape (n, )
+        As in get_gaussian_process. In 2D also for rescale 'stretch'.
+    """
+    if dimensions not in [1, 2]:
+        sys.exit('ERROR: Gaussian processes are only implemented in 1 and '
+                 '2 dimensions')
+    if dimensions == 2 and rescale not in ['stretch', 'fixed_mean']:
+        print("The proper scaling is not yet implemented in 2D")
+        sys.exit()
+    white_noise_shape, gaussian, conv_spaces, dx = \
+        _get_gaussian_process_discretization(
+            radius, sigma, dimensions, fixed_convolution_dx)
+    if rng is None:
+        rng = np.random
+    axes = tuple(np.arange(-dimensions, 0))
+    # The circular convolution of length >= len(white_noise) agrees with
+    # the linear convolution in the valid region
+    fft_shape = [scipy.fft.next_fast_len(int(s), real=True)
+                 for s in white_noise_shape]
+    kernel_spectrum = scipy.fft.rfftn(gaussian, fft_shape)
+    valid = (Ellipsis,) + tuple(
+        slice(k - 1, w) for k, w in zip(gaussian.shape, white_noise_shape))
+    if dimensions == 1:
+        j, w = get_linear_interpolation_weights(conv_spaces[0], linspace)
+    else:
+        interpolation_x, interpolation_y = [
+            get_spline_interpolation_matrix(conv_space, linspace)
+            for conv_space in conv_spaces]
+    reduce_axes = tuple(np.arange(1, dimensions + 1))
+    expand = (slice(None),) + (np.newaxis,) * dimensions
+
+    gps = np.empty((len(linspace),) * dimensions + (n,), dtype=dtype)
+    gp_min, gp_max = np.empty(n), np.empty(n)
+    for start in np.arange(0, n, batch_size):
+        stop = min(start + batch_size, n)
+        print('Creating Gaussian random fields: ', start)
+        white_noise = rng.random((stop - start,) + white_noise_shape)
+        if dimensions == 1:
+            # White noise between -0.5 and 0.5, like in get_gaussian_process
+            white_noise -= 0.5
+        convolution = scipy.fft.irfftn(
+            scipy.fft.rfftn(white_noise, fft_shape, axes=axes)
+            * kernel_spectrum, fft_shape, axes=axes)[valid]
+        if dimensions == 1:
+            gp = ((1. - w) * convolution[:, j] + w * convolution[:, j + 1]) * dx
+        else:
+            gp = np.matmul(np.matmul(interpolation_x, convolution),
+                           interpolation_y.T)
+
+        if dimensions == 1 and extremum != 'none':
+            batch_min = np.full(stop - start, extremum[0], dtype=np.float64)
+            batch_max = np.full(stop - start, extremum[1], dtype=np.float64)
+        else:
+            batch_min = np.amin(gp, axis=reduce_axes)
+            batch_max = np.amax(gp, axis=reduce_axes)
+        if rescale == 'stretch':
+            gp = (stretch_factor * (gp - batch_min[expand])
+                  / (batch_max - batch_min)[expand])
+            if dimensions == 1:
+                gp[gp < 0.] = 0.
+        elif rescale == 'fixed_mean':
+            desired_mean = 0.5
+            batch_min = np.amin(gp, axis=reduce_axes)
+            batch_max = np.mean(gp - batch_min[expand], axis=reduce_axes)
+            gp = desired_mean * (gp - batch_min[expand]) / batch_max[expand]
+            if untuned:
+                gp[:] = desired_mean
+        gp_min[start:stop], gp_max[start:stop] = batch_min, batch_max
+        gps[..., start:stop] = np.moveaxis(gp, 0, -1)
+    return gps, gp_min, gp_max
+
+
 def get_input_tuning_mass(sigma, tuning_function, limit,
                           integrate_within_limits=False, dimensions=1,
                           loc=None, gaussian_height=1,
@@ -377,7 +625,8 @@ def get_fixed_point_initial_weights(dimensions, radius, center_overlap_exc,
         init_weight_inh = 0.
     return init_weight_inh
 
-def get_equidistant_positions(r, n, boxtype='linear', distortion=0., on_boundary=False):
+def get_equidistant_positions(r, n, boxtype='linear', distortion=0., on_boundary=False,
+                              rng=None):
     """Returns equidistant, symmetrically distributed coordinates
 
     Works in dimensions higher than One.
@@ -406,6 +655,9 @@ def get_equidistant_positions(r, n, boxtype='linear', distortion=0., on_boundary
             two points along a perfectly symmetric lattice (along each dimension)
     on_boundary : bool
         If True, positions can also lie on the system boundaries
+    rng : random number generator, optional
+        Of the distortion, see random_streams.get_rng. Default: the
+        global random state of numpy.
     Returns
     -------
     (ndarray) of shape (m, len(n)), where m < np.prod(n) for boxtype
@@ -436,10 +688,12 @@ def get_equidistant_positions(r, n, boxtype='linear', distortion=0., on_boundary
     # Remove any subarray which contains at least one NaN
     # You do this by keeping only those that do not contain NaN (negation: ~)
     positions = positions[~np.isnan(positions).any(axis=1)]
-    dist = 2*distortion * np.random.random_sample(positions.shape) - distortion
+    if rng is None:
+        rng = np.random
+    dist = 2*distortion * rng.random(positions.shape) - distortion
     return positions + dist
 
-def get_random_positions_within_circle(n, r, multiplicator=10):
+def get_random_positions_within_circle(n, r, multiplicator=10, rng=None):
     """Returns n random 2 D positions within radius (rejection sampling)
 
     Parameters
@@ -448,13 +702,16 @@ def get_random_positions_within_circle(n, r, multiplicator=10):
     r: radius
     multiplicator: to ensure that the rejection doesn't reduce the
                     positions below n
+    rng: random number generator, default: global random state of numpy
     Returns
     -------
     ndarray of shape (n, 2)
     """
     # random coords shape (n, 2)
     # random_nrs = 2*r * np.random.random_sample((multiplicator * n, 2)) - r
-    random_nrs = np.random.uniform(-r, r, (multiplicator * n, 2))
+    if rng is None:
+        rng = np.random
+    random_nrs = rng.uniform(-r, r, (multiplicator * n, 2))
     # difference squared
     ds = np.sum(np.power(random_nrs, 2), axis=1)
     # boolean arra
@@ -464,7 +721,8 @@ def get_random_positions_within_circle(n, r, multiplicator=10):
     # slice the survivors to keep only n
     return survivors[:n]
 
-def get_random_numbers(n, mean, spreading, distribution, selected_weight=0):
+def get_random_numbers(n, mean, spreading, distribution, selected_weight=0,
+                       rng=None):
     """Returns random numbers with specified distribution
 
     Parameters
@@ -480,27 +738,30 @@ def get_random_numbers(n, mean, spreading, distribution, selected_weight=0):
         - gaussian_peak: Does not create random numbers, but a gaussian shaped
             weight profile for symmetric centers. Works only with one
             output neuron.
+    rng: random number generator, default: global random state of numpy
 
     Returns
     -------
     rns : ndarray of shape (n_output_neurons, n_weights_per_output_neuron)
     """
+    if rng is None:
+        rng = np.random
 
     if distribution == 'uniform':
-        rns = np.random.uniform(mean * (1. - spreading), mean * (1. + spreading), n)
+        rns = rng.uniform(mean * (1. - spreading), mean * (1. + spreading), n)
 
     # elif distribution == 'factor':
     # 	rns = np.random.uniform(mean / spreading, mean * spreading, n)
 
     elif distribution == 'cut_off_gaussian':
         # Draw 100 times more numbers, because those outside the range are thrown away
-        rns = np.random.normal(mean, spreading['stdev'], 100*n)
+        rns = rng.normal(mean, spreading['stdev'], 100*n)
         rns = rns[rns>spreading['left']]
         rns = rns[rns<spreading['right']]
         rns = rns[:n]
 
     elif distribution == 'cut_off_gaussian_with_standard_limits':
-        rns = np.random.normal(mean, spreading, 100*n)
+        rns = rng.normal(mean, spreading, 100*n)
         left = 0.001
         right = 2 * mean - left
         rns = rns[rns>left]
@@ -510,12 +771,12 @@ def get_random_numbers(n, mean, spreading, distribution, selected_weight=0):
     elif distribution == 'gamma':
         k = (mean/spreading)**2
         theta = spreading**2 / mean
-        rns = np.random.gamma(k, theta, n)
+        rns = rng.gamma(k, theta, n)
 
     elif distribution == 'gamma_with_cut_off':
         k = (mean/spreading)**2
         theta = spreading**2 / mean
-        rns = np.random.gamma(k, theta, n)
+        rns = rng.gamma(k, theta, n)
         rns[rns<0.01] = 0.01
 
     elif distribution == 'gaussian_peak':
@@ -540,10 +801,16 @@ class Synapses(utils.Utilities):
 
     Parameters
     ----------
-    positions : ndarray
+    positions : ndarray or None
         Positions on which the firing rate of each input neuron should be
-        defined in the case of gaussian process inputs.
+        defined in the case of gaussian process inputs. If None, the
+        gaussian process rates are not created, e.g. because they are
+        taken from the input rates cache.
     """
+    # Random number generator of the centers, see random_streams.py. Set
+    # in __init__, the global random state of numpy by default.
+    rng_centers = np.random
+
     def __init__(self, sim_params, type_params, seed_centers, seed_init_weights,
                     seed_sigmas, positions=None):
         # self.input_tuning = utils.InputTuning()
@@ -552,6 +819,9 @@ class Synapses(utils.Utilities):
 
         for k, v in list(type_params.items()):
             setattr(self, k, v)
+        self.dtype = np.dtype(getattr(self, 'dtype', 'float64'))
+        # 'legacy' or 'streams', see random_streams.py
+        self.rng_mode = getattr(self, 'rng_mode', 'legacy')
 
         self.n_total = np.prod(self.number_per_dimension)
         # Since you double the inputs, for boxside switch experiments,
@@ -562,7 +832,8 @@ class Synapses(utils.Utilities):
         ##############################
         ##########	centers	##########
         ##############################
-        np.random.seed(int(seed_centers))
+        self.rng_centers = random_streams.get_rng(seed_centers, 'centers',
+                                                  self.rng_mode)
         limit = self.radius + self.center_overlap
         if self.boxside_independent_centers and self.boxside_switch_time:
             centers1 = self.get_centers(limit)
@@ -596,13 +867,18 @@ class Synapses(utils.Utilities):
         ##########################################################
         #################### Gasssian Process ####################
         ##########################################################
-        if self.gaussian_process:
+        # In legacy mode the Gaussian processes continue the stream of
+        # the centers
+        self.rng_gaussian_process = random_streams.get_rng(
+            seed_centers, 'gaussian_process', self.rng_mode,
+            legacy_seed=False)
+        if self.gaussian_process and positions is not None:
             self.set_gaussian_process_rates(positions)
 
         ##############################
         ##########	sigmas	##########
         ##############################
-        np.random.seed(int(seed_sigmas))
+        rng = random_streams.get_rng(seed_sigmas, 'sigmas', self.rng_mode)
         # This is necessary so that the loop below works for 1 dimension
         self.sigma, self.sigma_spreading, self.sigma_distribution = np.atleast_1d(
             self.sigma, self.sigma_spreading, self.sigma_distribution)
@@ -618,7 +894,8 @@ class Synapses(utils.Utilities):
             self.sigmas[..., i] = get_random_numbers(
                     self.number*fps,
                     self.sigma[i], self.sigma_spreading[i],
-                    self.sigma_distribution[i]).reshape(self.number, fps)
+                    self.sigma_distribution[i],
+                    rng=rng).reshape(self.number, fps)
         if self.dimensions == 1:
             self.sigmas.shape = (self.number, fps)
 
@@ -644,23 +921,32 @@ class Synapses(utils.Utilities):
         self.pi_over_r = np.array([np.pi / limit[-1]])
         self.norm_von_mises = 1 / np.exp(self.scaled_kappas)
 
-        self.eta_dt = self.eta * self.dt
+        # Of the same type as the weights, so that the weight update
+        # is not promoted to double precision
+        self.eta_dt = self.dtype.type(self.eta * self.dt)
 
         # self.set_initial_weights(seed_init_weights=seed_init_weights)
 
 
     def set_initial_weights(self, seed_init_weights, scale_weights_exc=False):
         # Create weights array adding some noise to the init weights
-        np.random.seed(int(seed_init_weights))
+        rng = random_streams.get_rng(seed_init_weights, 'init_weights',
+                                     self.rng_mode)
         if self.init_weight_distribution == 'single_weight':
-            selected_weight = np.random.randint(0, self.number, 1)[0]
+            selected_weight = random_streams.get_integers(
+                rng, 0, self.number, 1)[0]
         else:
             selected_weight = 0
 
         self.weights = get_random_numbers((self.output_neurons, self.number),
             self.init_weight, self.init_weight_spreading,
             self.init_weight_distribution,
-            selected_weight=selected_weight)
+            selected_weight=selected_weight,
+            rng=rng).astype(self.dtype, copy=False)
+        # Work buffers of the weight update, see
+        # Rat.update_exc_weights
+        self.weights_buffer = np.empty_like(self.weights)
+        self.rates_buffer = np.empty(self.number, dtype=self.weights.dtype)
         # Later in the normalization we keep the initial weight sum
         # constant for each output neuron indivdually
         self.initial_weight_sum = np.sum(self.weights, axis=1)
@@ -683,16 +969,39 @@ class Synapses(utils.Utilities):
         position in `positions`. So this defines all of the input
         tuning.
 
+        With 'gaussian_process_mode' 'batched' all inputs are created
+        with get_gaussian_processes, with 'loop' one after the other
+        with get_gaussian_process. Both use the same random numbers.
+
         Parameters
         ----------
         positions : ndarray
             Positions on which inputs should be defined (high resolution)
         """
         n = np.prod(self.number_per_dimension[:self.dimensions])
+        mode = getattr(self, 'gaussian_process_mode', 'batched')
+        if mode == 'batched':
+            linspace = positions if self.dimensions == 1 else positions[0,:,0]
+            self.gaussian_process_rates, self.gp_min, self.gp_max = \
+                get_gaussian_processes(
+                    self.radius, self.sigma, linspace, n,
+                    dimensions=self.dimensions,
+                    rescale=self.gaussian_process_rescale,
+                    stretch_factor=self.gp_stretch_factor,
+                    extremum=self.gp_extremum,
+                    untuned=self.untuned,
+                    fixed_convolution_dx=self.fixed_convolution_dx,
+                    batch_size=getattr(self, 'gaussian_process_batch_size',
+                                       32),
+                    dtype=self.dtype, rng=self.rng_gaussian_process)
+            return
+        elif mode != 'loop':
+            sys.exit('ERROR: Gaussian process mode {0} is not defined'.format(
+                mode))
         self.gp_min, self.gp_max = np.empty(n), np.empty(n)
         if self.dimensions == 1:
             shape = (len(positions), n)
-            self.gaussian_process_rates = np.empty(shape)
+            self.gaussian_process_rates = np.empty(shape, dtype=self.dtype)
             for i in np.arange(n):
                 if i % 100 == 0:
                     print('Creating Gaussian random field: ', i)
@@ -704,11 +1013,12 @@ class Synapses(utils.Utilities):
                     stretch_factor=self.gp_stretch_factor,
                     extremum=self.gp_extremum,
                     untuned=self.untuned,
-                    fixed_convolution_dx=self.fixed_convolution_dx)
+                    fixed_convolution_dx=self.fixed_convolution_dx,
+                    rng=self.rng_gaussian_process)
         elif self.dimensions == 2:
             linspace = positions[0,:,0]
             shape = (linspace.shape[0], linspace.shape[0], n)
-            self.gaussian_process_rates = np.empty(shape)
+            self.gaussian_process_rates = np.empty(shape, dtype=self.dtype)
             for i in np.arange(n):
                 print('Creating Gaussian random field: ', i)
                 # white_noise = np.random.random((1e3, 1e3))
@@ -719,7 +1029,8 @@ class Synapses(utils.Utilities):
                     stretch_factor=self.gp_stretch_factor,
                     extremum=self.gp_extremum,
                     untuned=self.untuned,
-                    fixed_convolution_dx=self.fixed_convolution_dx
+                    fixed_convolution_dx=self.fixed_convolution_dx,
+                    rng=self.rng_gaussian_process
                 )
 
 
@@ -759,7 +1070,7 @@ class Synapses(utils.Utilities):
         spacing_std = gridspacing / 4
         # Changing the grid spacing of every neuron to something close to
         # spacing
-        spacing_with_noise = np.random.randn(n_neurons)*spacing_std+gridspacing
+        spacing_with_noise = self.rng_centers.standard_normal(n_neurons)*spacing_std+gridspacing
         fields = spacing_with_noise[:, np.newaxis] * fields_linspace
         # # Add noise on the location of each field center
         # noise_std = spacing / 1
@@ -802,11 +1113,12 @@ class Synapses(utils.Utilities):
         fields = []
         for center in centers:
             # Add noise to the grid spacing of this particular grid cell
-            spacing_with_noise = np.random.randn() * spacing_std + gridspacing
+            spacing_with_noise = (self.rng_centers.standard_normal() * spacing_std
+                                  + gridspacing)
             if spacing_with_noise <= 0:
                 spacing_with_noise = gridspacing
             # Draw a random orientation
-            orientation = (60 * np.random.random_sample() - 30)
+            orientation = (60 * self.rng_centers.random() - 30)
             art_rm = gs_artifical_ratemaps.ArtificialRatemaps(
                 gridspacing=spacing_with_noise,
                 orientation=orientation,
@@ -837,7 +1149,7 @@ class Synapses(utils.Utilities):
                 # centers = np.linspace(-limit[0], limit[0], self.number_per_dimension[0])
                 centers = get_equidistant_positions(limit,
                                 self.number_per_dimension, self.boxtype,
-                                    self.distortion)
+                                    self.distortion, rng=self.rng_centers)
                 if self.tuning_function == 'grid':
                     # This creates centers arrays with shape (n_neurons,
                     # n_grid_fields_per_neuron)
@@ -862,15 +1174,16 @@ class Synapses(utils.Utilities):
                             b = get_equidistant_positions(limit,
                                                       self.number_per_dimension,
                                                       self.boxtype,
-                                                      self.distortion)
+                                                      self.distortion,
+                                                      rng=self.rng_centers)
                             centers = np.concatenate((centers, b), axis=0)
-                        centers = np.random.permutation(centers)
+                        centers = self.rng_centers.permutation(centers)
                     # We want the shape (n_neurons, n_fields_per_neuron,
                     # n_dimensions)
                     centers = centers.reshape(N, fps, self.dimensions)
 
             else:
-                centers = np.random.uniform(
+                centers = self.rng_centers.uniform(
                     -limit, limit,
                     (self.number_per_dimension[0], self.fields_per_synapse)).reshape(
                         self.number_per_dimension[0], self.fields_per_synapse)
@@ -878,22 +1191,23 @@ class Synapses(utils.Utilities):
 
         if self.dimensions >= 2:
             if self.boxtype == 'linear' and not self.symmetric_centers:
-                centers_x = np.random.uniform(-limit[0], limit[0],
+                centers_x = self.rng_centers.uniform(-limit[0], limit[0],
                             (self.n_total, self.fields_per_synapse))
-                centers_y = np.random.uniform(-limit[1], limit[1],
+                centers_y = self.rng_centers.uniform(-limit[1], limit[1],
                             (self.n_total, self.fields_per_synapse))
                 centers = np.dstack((centers_x, centers_y))
             elif self.boxtype == 'circular' and not self.symmetric_centers:
                 limit = self.radius + self.center_overlap
                 random_positions_within_circle = get_random_positions_within_circle(
-                        self.n_total*self.fields_per_synapse, limit[0])
+                        self.n_total*self.fields_per_synapse, limit[0],
+                        rng=self.rng_centers)
                 centers = random_positions_within_circle.reshape(
                             (self.n_total, self.fields_per_synapse, 2))
             elif self.symmetric_centers:
                 n_per_dimension = self.number_per_dimension
                 centers = get_equidistant_positions(limit,
                                     n_per_dimension, self.boxtype,
-                                    self.distortion)
+                                    self.distortion, rng=self.rng_centers)
                 if self.tuning_function == 'grid':
                     centers = self.centers2gridcenters_2d(
                         centers, gridspacing=6*self.sigma[0])
@@ -910,9 +1224,9 @@ class Synapses(utils.Utilities):
                         for i in np.arange(fps-1):
                             b = get_equidistant_positions(limit,
                                     n_per_dimension, self.boxtype,
-                                        self.distortion)
+                                        self.distortion, rng=self.rng_centers)
                             centers = np.concatenate((centers, b), axis=0)
-                    centers = np.random.permutation(centers)
+                    centers = self.rng_centers.permutation(centers)
                     centers = centers.reshape(N, fps, self.dimensions)
         return centers
 
@@ -954,7 +1268,8 @@ class Synapses(utils.Utilities):
             idx_change = idx
         else:
             # Draw random indices into the centers1 array
-            idx_change = np.random.choice(n_inputs, n_changed, replace=False)
+            idx_change = self.rng_centers.choice(n_inputs, n_changed,
+                                                 replace=False)
         # Replace the entries. NB: Since centers1 and centers2 are
         # independent and shuffled, we can use the same index without loss of
         # generality.
@@ -1012,7 +1327,7 @@ class Synapses(utils.Utilities):
             idx_change = idx
         else:
             # Draw random indices into the centers1 array
-            idx_change = np.random.choice(n_f, n_changed, replace=False)
+            idx_change = self.rng_centers.choice(n_f, n_changed, replace=False)
         # Replace the entries. NB: Since centers1 and centers2 are
         # independent and shuffled, we can use the same index everywhere,
         # without loss of generality
@@ -1023,12 +1338,23 @@ class Rat(utils.Utilities):
     """
     The class of the rat
     """
+    # Random number generator of the motion, see random_streams.py. Set
+    # in run, the global random state of numpy by default.
+    rng_motion = np.random
+
     def __init__(self, params):
         self.params = params
         for k, v in list(params['sim'].items()):
             setattr(self, k, v)
         for k, v in list(params['out'].items()):
             setattr(self, k, v)
+        # Floating point type of the input rates, weights and rates
+        self.dtype = np.dtype(getattr(self, 'dtype', 'float64'))
+        # 'legacy' or 'streams', see random_streams.py
+        self.rng_mode = getattr(self, 'rng_mode', 'legacy')
+        if getattr(self, 'profile', False):
+            self.profiler = profiling.Profile()
+            init_start = time.perf_counter()
         self.set_initial_position()
         self.set_parameters()
 
@@ -1045,15 +1371,30 @@ class Rat(utils.Utilities):
                                 self.radius, self.dimensions, self.spacing)
 
         self.input_rates = {}
-        self.instantiate_synapses()
+        self._timed(self.instantiate_synapses, 'instantiate_synapses')()
         self.special_center_cases()
+        if getattr(self, 'profiler', None):
+            self.profiler.add('init', time.perf_counter() - init_start)
+
+    def _timed(self, function, phase):
+        """
+        Returns the function, timed in the profile if 'profile' is True
+
+        See `profiling.Profile`
+        """
+        profiler = getattr(self, 'profiler', None)
+        if profiler:
+            return profiler.wrap(function, phase)
+        return function
 
     def set_parameters(self):
         """
         Set parameters for later convenience
         """
-        self.phi = np.random.random_sample() * 2. * np.pi
-        self.theta = 2 * np.pi * np.random.random_sample() - np.pi
+        rng = random_streams.get_rng(self.seed_motion, 'initial_direction',
+                                     self.rng_mode, legacy_seed=False)
+        self.phi = rng.random() * 2. * np.pi
+        self.theta = 2 * np.pi * rng.random() - np.pi
         self.move_right = True
         self.turning_probability = self.dt * self.velocity / self.persistence_length
         self.angular_sigma = np.sqrt(2.*self.velocity*self.dt/self.persistence_length)
@@ -1077,6 +1418,10 @@ class Rat(utils.Utilities):
                                     self.limit, self.dimensions,
                                     resolution=self.input_space_resolution,
                                     return_discretization=True)
+        sparse_input_rates = getattr(self, 'sparse_input_rates', False)
+        if sparse_input_rates:
+            self._check_sparse_input_rates()
+            self.input_rates_sparse = {}
 
 
         if self.boxside_switch_time:
@@ -1086,66 +1431,45 @@ class Rat(utils.Utilities):
         # if self.take_fixed_point_weights:
         #  self.set_fixed_point_initial_weights()
 
+        cache = None
+        cache_directory = getattr(self, 'input_rates_cache', '')
+        if (not cache_directory
+                and getattr(self, 'input_rates_shared_memory', False)):
+            cache_directory = input_rates_cache.get_shared_memory_directory()
+        # Open files that mark the cache entries as used by this rat
+        self._input_rates_cache_attachments = []
+        if cache_directory:
+            if self.discretize_space and not self.boxside_switch_time:
+                cache = input_rates_cache.InputRatesCache(
+                    cache_directory,
+                    max_size=getattr(self, 'input_rates_cache_size', 1e10))
+            else:
+                print('The input rates cache requires discretize_space and '
+                      'no boxside switch. The input rates are not cached.')
+
         seed_init_weights_list = []
         for n, p in enumerate(self.populations):
             seed_centers, seed_init_weights, seed_sigmas = self._get_seeds(n)
             seed_init_weights_list.append(seed_init_weights)
 
-            self.synapses[p] = Synapses(self.params['sim'], self.params[p],
-                seed_centers=seed_centers, seed_init_weights=seed_init_weights,
-                seed_sigmas=seed_sigmas, positions=np.squeeze(
-                    self.positions_input_space))
-
-            if self.gaussian_process:
-                # Here we set the high resolution input rates grid
-                # Note: it already has the correct precision, because
-                # `positions` is the desired discretization
-                self.input_rates[p] = self.synapses[
-                            p].gaussian_process_rates
-                # Set the min and max of unscaled gp inputs to find
-                # their distribution
-                # self.gp_min[p] = self.synapses[p].gp_min
-                # self.gp_max[p] = self.synapses[p].gp_max
-                # Here we set the low resolution input rates grid
-                self.set_input_rates_low_resolution(p,
-                                                    self.positions_input_space)
-                self.synapses[p].input_norm = np.array([1])
-                self.synapses[p].input_rate_variance = np.mean(
-                    self.variance_of_rates_of_each_input_neuron(
-                        input_norm=1,
-                        input_rates=self.input_rates[p],
-                        dimensions=self.dimensions)
-                )
-            else:
-                self.set_input_norm(positions=self.positions_grid, syn_type=p)
-
-                # Here we set the low resolution input rates grid
-                self.input_rates_low_resolution[p] = \
-                    self.get_input_rates_grid(self.positions_grid,
-                                              self.synapses[p])
-
-                if self.discretize_space:
-                    print('Creating the large input rates grid')
-                    self.input_rates[p] = self.get_input_rates_grid(
-                        self.positions_input_space, self.synapses[p])
-
-                    if self.boxside_switch_time:
-                        self.input_rates_low_resolution_without_cutoff[p] = \
-                            self.input_rates_low_resolution[p].copy()
-                        self.input_rates_without_cutoff[p] = self.input_rates[
-                            p].copy()
-                        # self._cut_off_in_boxside_experiments(p,
-                        # 				current_side=self.boxside_initial_side)
-                        if self.boxside_independent_centers:
-                            self._set_inputs_from_other_boxside_to_zero(p,
-                                        current_side=self.boxside_initial_side)
-
-                else:
-                    # Here we create a function that returns the firing rate
-                    # of each input neuron at a single position
-                    self.get_rates_at_single_position[p] = \
-                        self.synapses[p].get_rates_function(
-                                position=self.position, data=False)
+            if cache is None:
+                self.instantiate_population(p, seed_centers,
+                                            seed_init_weights, seed_sigmas,
+                                            sparse_input_rates)
+                continue
+            key = self.get_input_rates_cache_key(p, n)
+            with cache.lock(key):
+                # Attach before loading, so that the entry is not evicted
+                # in between by another worker
+                self._input_rates_cache_attachments.append(cache.attach(key))
+                cached = cache.load(key)
+                self.instantiate_population(p, seed_centers,
+                                            seed_init_weights, seed_sigmas,
+                                            sparse_input_rates, cached=cached)
+                if not cached:
+                    cache.store(key, self.get_input_rates_to_cache(p))
+                    # Free the private tables in favor of the shared ones
+                    self.set_cached_input_rates(p, cache.load(key))
 
         # Modify the initial weights, to get a good target norm
         prms = self.params
@@ -1183,44 +1507,213 @@ class Rat(utils.Utilities):
                 seed_init_weights=seed_init_weights_list[n])
 
 
-    def _cut_off_in_boxside_experiments(self, population, current_side):
+    def instantiate_population(self, p, seed_centers, seed_init_weights,
+                               seed_sigmas, sparse_input_rates, cached=None):
         """
-
-        NB: Only works for simulations with discretized space.
+        Creates the synapses and the input rates of population `p`
 
         Parameters
         ----------
+        p : str
+            'exc' or 'inh'
+        seed_centers, seed_init_weights, seed_sigmas : int
+            See `_get_seeds`
+        sparse_input_rates : bool
+        cached : dict or None
+            Arrays from the input rates cache, see
+            `get_input_rates_to_cache`. If None, the input rates are
+            computed.
+        """
+        # Gaussian random fields are only created if they are not cached
+        positions = None if cached else np.squeeze(self.positions_input_space)
+        self.synapses[p] = Synapses(self.params['sim'], self.params[p],
+            seed_centers=seed_centers, seed_init_weights=seed_init_weights,
+            seed_sigmas=seed_sigmas, positions=positions)
+
+        if cached:
+            self.set_cached_input_rates(p, cached)
+        elif self.gaussian_process:
+            # Here we set the high resolution input rates grid
+            # Note: it already has the correct precision, because
+            # `positions` is the desired discretization
+            self.input_rates[p] = self.synapses[
+                        p].gaussian_process_rates
+            # Set the min and max of unscaled gp inputs to find
+            # their distribution
+            # self.gp_min[p] = self.synapses[p].gp_min
+            # self.gp_max[p] = self.synapses[p].gp_max
+            # Here we set the low resolution input rates grid
+            self.set_input_rates_low_resolution(p,
+                                                self.positions_input_space)
+            self.input_rates_low_resolution[p] = \
+                self.input_rates_low_resolution[p].astype(self.dtype,
+                                                          copy=False)
+            self.synapses[p].input_norm = np.array([1])
+            self.synapses[p].input_rate_variance = np.mean(
+                self.variance_of_rates_of_each_input_neuron(
+                    input_norm=1,
+                    input_rates=self.input_rates[p],
+                    dimensions=self.dimensions)
+            )
+            if sparse_input_rates:
+                self.input_rates_sparse[p] = self.get_sparse_input_rates(
+                    self.input_rates.pop(p))
+                del self.synapses[p].gaussian_process_rates
+        else:
+            self.set_input_norm(positions=self.positions_grid, syn_type=p)
 
+            # Here we set the low resolution input rates grid
+            self.input_rates_low_resolution[p] = \
+                self.get_input_rates_grid(self.positions_grid,
+                                          self.synapses[p], dtype=self.dtype)
 
+            if sparse_input_rates:
+                print('Creating the large sparse input rates grid')
+                self.input_rates_sparse[p] = \
+                    self.get_sparse_input_rates_grid(
+                        self.positions_input_space, self.synapses[p])
+            elif self.discretize_space:
+                print('Creating the large input rates grid')
+                self.input_rates[p] = self.get_input_rates_grid(
+                    self.positions_input_space, self.synapses[p],
+                    dtype=self.dtype)
+
+                if self.boxside_switch_time:
+                    self.input_rates_low_resolution_without_cutoff[p] = \
+                        self.input_rates_low_resolution[p].copy()
+                    self.input_rates_without_cutoff[p] = self.input_rates[
+                        p].copy()
+                    # self._cut_off_in_boxside_experiments(p,
+                    # 				current_side=self.boxside_initial_side)
+                    if self.boxside_independent_centers:
+                        self._set_inputs_from_other_boxside_to_zero(p,
+                                    current_side=self.boxside_initial_side)
 
-        Returns
-        -------
-        """
-        x_limit = 0.
-        # Make sure that the rate maps are complete and not cut off already
-        self.input_rates_low_resolution[population] = \
-            self.input_rates_low_resolution_without_cutoff[population].copy()
-        self.input_rates[population] = self.input_rates_without_cutoff[
-            population].copy()
-        # Do it for the low and high resolution grids
-        p_grids = [self.positions_grid,
-                    self.positions_input_space]
-        i_rates = [self.input_rates_low_resolution[population],
-                    self.input_rates[population]]
-        for pg, ir in zip(p_grids, i_rates):
-            boolian = utils.get_boolian_of_positions_in_subsquare(
-                positions=pg[:, :, 0, :], x_limit=x_limit,
-                y_limit=None)
-            if current_side == 'left':
-                # Use negated boolian for cut off on the right side
-                boolian = ~boolian
             else:
-                pass
-            ir[boolian] = 0.
+                # Here we create a function that returns the firing rate
+                # of each input neuron at a single position
+                self.get_rates_at_single_position[p] = \
+                    self.synapses[p].get_rates_function(
+                            position=self.position, data=False)
 
-    def _set_inputs_from_other_boxside_to_zero(self, population, current_side):
-        """
-        replace_parameters
+    def get_input_rates_cache_key(self, p, n):
+        """
+        Returns the key of the input rates of population `p` in the cache
+
+        The key is a hash of all parameters except those that are known
+        not to change the input rates, like the motion, the learning
+        rates and the initial weights. Parameters that are added later
+        are part of the key, so that the cache can only miss but never
+        return wrong input rates.
+
+        Parameters
+        ----------
+        p : str
+        n : int
+            Index of the population, see `_get_seeds`
+
+        Returns
+        -------
+        key : str
+        """
+        sim_params = {k: v for k, v in self.params['sim'].items()
+                      if k not in INPUT_RATES_INDEPENDENT_SIM_PARAMETERS}
+        type_params = {k: v for k, v in self.params[p].items()
+                       if k not in INPUT_RATES_INDEPENDENT_TYPE_PARAMETERS}
+        return input_rates_cache.get_key(sim_params, type_params, p, n)
+
+    def get_input_rates_to_cache(self, p):
+        """
+        Returns everything that `set_cached_input_rates` needs as arrays
+        """
+        syn = self.synapses[p]
+        arrays = {
+            'input_rates_low_resolution': self.input_rates_low_resolution[p],
+            'input_norm': np.asarray(syn.input_norm),
+            'input_rate_variance': np.asarray(syn.input_rate_variance),
+        }
+        if self.gaussian_process:
+            # Stored in the rawdata, but not recomputed on a cache hit
+            arrays['gp_min'] = syn.gp_min
+            arrays['gp_max'] = syn.gp_max
+        if getattr(self, 'sparse_input_rates', False):
+            table = self.input_rates_sparse[p]
+            arrays.update({
+                'sparse_data': table.data,
+                'sparse_indices': table.indices,
+                'sparse_indptr': table.indptr,
+                'sparse_shape': np.array(table.shape),
+            })
+        else:
+            arrays['input_rates'] = self.input_rates[p]
+        return arrays
+
+    def set_cached_input_rates(self, p, cached):
+        """
+        Sets the input rates of population `p` from the cache
+
+        The large tables remain read only memory maps.
+
+        Parameters
+        ----------
+        p : str
+        cached : dict
+            See `get_input_rates_to_cache`
+        """
+        syn = self.synapses[p]
+        syn.input_norm = np.array(cached['input_norm'])
+        syn.input_rate_variance = np.float64(cached['input_rate_variance'])
+        if 'gp_min' in cached:
+            syn.gp_min = np.array(cached['gp_min'])
+            syn.gp_max = np.array(cached['gp_max'])
+        self.input_rates_low_resolution[p] = \
+            cached['input_rates_low_resolution']
+        if 'sparse_data' in cached:
+            self.input_rates_sparse[p] = scipy.sparse.csr_matrix(
+                (cached['sparse_data'], cached['sparse_indices'],
+                 cached['sparse_indptr']),
+                shape=tuple(cached['sparse_shape']))
+        else:
+            self.input_rates[p] = cached['input_rates']
+
+    def _cut_off_in_boxside_experiments(self, population, current_side):
+        """
+
+        NB: Only works for simulations with discretized space.
+
+        Parameters
+        ----------
+
+
+
+        Returns
+        -------
+        """
+        x_limit = 0.
+        # Make sure that the rate maps are complete and not cut off already
+        self.input_rates_low_resolution[population] = \
+            self.input_rates_low_resolution_without_cutoff[population].copy()
+        self.input_rates[population] = self.input_rates_without_cutoff[
+            population].copy()
+        # Do it for the low and high resolution grids
+        p_grids = [self.positions_grid,
+                    self.positions_input_space]
+        i_rates = [self.input_rates_low_resolution[population],
+                    self.input_rates[population]]
+        for pg, ir in zip(p_grids, i_rates):
+            boolian = utils.get_boolian_of_positions_in_subsquare(
+                positions=pg[:, :, 0, :], x_limit=x_limit,
+                y_limit=None)
+            if current_side == 'left':
+                # Use negated boolian for cut off on the right side
+                boolian = ~boolian
+            else:
+                pass
+            ir[boolian] = 0.
+
+    def _set_inputs_from_other_boxside_to_zero(self, population, current_side):
+        """
+        replace_parameters
         """
         # When you create the inputs for the two rooms, you sum up two center
         # arrays, so n_total now corresponds to only hafl the number of
@@ -1288,12 +1781,15 @@ class Rat(utils.Utilities):
             if not self.seed_motion:
                 order = np.arange(61)
             else:
-                np.random.seed(self.seed_motion)
-                order = np.random.permutation(61)
+                order = random_streams.get_rng(
+                    self.seed_motion, 'trajectory_order',
+                    self.rng_mode).permutation(61)
             # load_string = 'data/sargolini_trajectories_610min.npy'
-            self.sargolini_data = utils.get_concatenated_10_minute_trajectories(
-                order=order
-            )
+            # The chunks in this order, without copying them
+            self.sargolini_data = trajectory_store.ConcatenatedTrajectory(
+                *trajectory_store.load(getattr(self, 'trajectory_store', ''),
+                                       self.get_trajectory_resampling()),
+                order=order)
 
             # self.sargolini_data = np.load(load_string)
             self.x, self.y = self.sargolini_data[0]
@@ -1456,8 +1952,9 @@ class Rat(utils.Utilities):
         """
         Interpolate input_rates towards smaller resolution for each input cell
 
-        Interpolation needs to be done on each input individually so we
-        have to loop over the total number of input neurons.
+        The linear interpolation is the same for all input cells, so it is
+        done for all of them at once. In 2D the bilinear interpolation is
+        separable and an interpolation matrix is applied along each axis.
 
         Note: Only needed for Gaussian process input.
         For normal input we make use of get_rates_function.
@@ -1472,29 +1969,27 @@ class Rat(utils.Utilities):
             Positions on which the high resultion input rates are defined
         """
         if self.dimensions  == 1:
-            self.input_rates_low_resolution[syn_type] = np.empty(
-                                (self.spacing, self.synapses[syn_type].n_total))
-            for i in np.arange(self.synapses[syn_type].n_total):
-                self.input_rates_low_resolution[syn_type][:,i] = np.interp(
-                    np.squeeze(self.positions_grid),
-                    np.squeeze(positions),
-                    self.input_rates[syn_type][:,i])
+            j, w = get_linear_interpolation_weights(
+                np.squeeze(positions), np.squeeze(self.positions_grid))
+            w = w[:, np.newaxis]
+            input_rates = self.input_rates[syn_type]
+            self.input_rates_low_resolution[syn_type] = (
+                (1. - w) * input_rates[j] + w * input_rates[j + 1])
 
         elif self.dimensions == 2:
             linspace_low_resolution = np.linspace(-self.radius, self.radius, self.spacing)
             linspace = np.squeeze(positions)[0,:,0]
-            self.input_rates_low_resolution[syn_type] = np.empty(
-                                (self.spacing, self.spacing,
-                                 self.synapses[syn_type].n_total))
-            for i in np.arange(self.synapses[syn_type].n_total):
-                self.input_rates_low_resolution[syn_type][...,i] = scipy.interpolate.interp2d(
-                    linspace,
-                    linspace,
-                    self.input_rates[syn_type][...,i])(linspace_low_resolution,
-                                                     linspace_low_resolution)
+            interpolation = get_linear_interpolation_matrix(
+                linspace, linspace_low_resolution)
+            # Along the first axis, then along the second axis
+            # for each position on the first axis
+            self.input_rates_low_resolution[syn_type] = np.matmul(
+                interpolation,
+                np.tensordot(interpolation, self.input_rates[syn_type],
+                             axes=(1, 0)))
 
 
-    def get_input_rates_grid(self, positions, synapses):
+    def get_input_rates_grid(self, positions, synapses, dtype=None):
         """
         Returns input_rates of synapses at positions
 
@@ -1504,13 +1999,56 @@ class Rat(utils.Utilities):
             Positions grid as defined in get_positions
         synapses : class
             See Synapses class
+        dtype : numpy dtype or None
+            If given and not float64, the rates are computed in double
+            precision for a few rows of positions at a time and stored
+            with this dtype, so that the double precision table is never
+            kept in memory.
         Returns
         -------
         ret : ndarray
             See above
         """
-        rates_function = synapses.get_rates_function(positions, data=False)
-        return rates_function(positions)
+        if dtype is None or np.dtype(dtype) == np.float64:
+            rates_function = synapses.get_rates_function(positions,
+                                                         data=False)
+            return rates_function(positions)
+        input_rates = None
+        # The far tails of the tuning curves are set to zero. Otherwise
+        # their products in the weight update, e.g. with the learning
+        # rate, are subnormal numbers, and arithmetic with those is very
+        # slow. Compared to rates of order 1 they are below round off.
+        tiny = np.sqrt(np.finfo(dtype).tiny)
+        for rows, rates in self._get_input_rates_grid_chunks(positions,
+                                                             synapses):
+            if input_rates is None:
+                input_rates = np.empty(
+                    (positions.shape[0],) + rates.shape[1:], dtype=dtype)
+            rates[np.abs(rates) < tiny] = 0.
+            input_rates[rows] = rates
+        return input_rates
+
+    def _get_input_rates_grid_chunks(self, positions, synapses):
+        """
+        Yields the input rates for a few rows of positions at a time
+
+        Yields
+        ------
+        rows : slice
+            Rows along the first axis of `positions`
+        rates : ndarray
+            `get_input_rates_grid` of these rows
+        """
+        # Roughly 64 MB of rates at a time. At least 3 rows, because
+        # the rate functions distinguish grids from single positions by
+        # their length.
+        row_size = np.prod(positions.shape[1:self.dimensions],
+                           dtype=np.int64) * synapses.number * 8
+        rows_per_chunk = max(3, int(2**26 // row_size))
+        n_chunks = max(1, positions.shape[0] // rows_per_chunk)
+        for chunk in np.array_split(np.arange(positions.shape[0]), n_chunks):
+            rows = slice(chunk[0], chunk[-1] + 1)
+            yield rows, self.get_input_rates_grid(positions[rows], synapses)
 
     def get_positions(self, limit, dimensions, spacing=None, resolution=None,
                       return_discretization=False):
@@ -1605,10 +2143,10 @@ class Rat(utils.Utilities):
         Update position of rat by number drawn from gauss with stdev = dspace
         """
         if self.dimensions == 1:
-            self.x += self.dspace*np.random.randn()
+            self.x += self.dspace*self.rng_motion.standard_normal()
         if self.dimensions == 2:
-            self.x += self.dspace*np.random.randn()
-            self.y += self.dspace*np.random.randn()
+            self.x += self.dspace*self.rng_motion.standard_normal()
+            self.y += self.dspace*self.rng_motion.standard_normal()
 
     def dont_move(self):
         pass
@@ -1625,7 +2163,7 @@ class Rat(utils.Utilities):
             too_what = (pos > self.radius) * 1 - (pos < -self.radius) * 1
             self.x -= 2* self.radius * too_what[0]
             self.y -= 2* self.radius * too_what[1]
-            self.phi += self.angular_sigma * np.random.randn()
+            self.phi += self.angular_sigma * self.rng_motion.standard_normal()
             self.x += self.velocity_dt * np.cos(self.phi)
             self.y += self.velocity_dt * np.sin(self.phi)
 
@@ -1666,7 +2204,7 @@ class Rat(utils.Utilities):
                 self.y += self.velocity_dt * np.sin(self.phi)
             # Normal move without reflection
             else:
-                self.phi += self.angular_sigma * np.random.randn()
+                self.phi += self.angular_sigma * self.rng_motion.standard_normal()
                 self.x += self.velocity_dt * np.cos(self.phi)
                 self.y += self.velocity_dt * np.sin(self.phi)
 
@@ -1715,8 +2253,8 @@ class Rat(utils.Utilities):
                 z += 2 * r
             # Normal move without reflection
             else:
-                phi += angular_sigma * np.random.randn()
-                theta += angular_sigma * np.random.randn()
+                phi += angular_sigma * self.rng_motion.standard_normal()
+                theta += angular_sigma * self.rng_motion.standard_normal()
                 z += 0.5*velocity_dt * np.cos(theta)
             x += velocity_dt * np.cos(phi) * np.sin(theta)
             y += velocity_dt * np.sin(phi) * np.sin(theta)
@@ -1726,16 +2264,29 @@ class Rat(utils.Utilities):
     # 	for pos in sargolini_data:
     # 		yield pos
 
+    def get_trajectory_resampling(self):
+        """
+        Returns the number of recorded frames per time step
+
+        A recorded frame lasts 'trajectory_frame_dt' (0: one frame per
+        time step) and the recording is played 'trajectory_speed_factor'
+        times faster. See trajectory_store.resample.
+        """
+        frame_dt = getattr(self, 'trajectory_frame_dt', 0) or self.dt
+        return (self.dt * getattr(self, 'trajectory_speed_factor', 1.)
+                / frame_dt)
+
     def move_sargolini_data(self):
         # Ensure that you dont run out of data an loop backt to the beginning
-        # 1829127 is the length of the 610 minutes data array
-        step = int(self.step % 1829126)
+        # For 610 minutes of data at the recorded frame rate the length of
+        # the data array is 1829127
+        step = int(self.step % (len(self.sargolini_data) - 1))
         self.x, self.y = self.sargolini_data[step]
         if self.dimensions == 3:
             x_future, y_future = self.sargolini_data[step + 1]
             # Get phi as direction of motion and add noise
             phi = np.arctan2(y_future - self.y,
-                             x_future - self.x) + np.random.randn() * self.head_direction_sigma
+                             x_future - self.x) + self.rng_motion.standard_normal() * self.head_direction_sigma
             # Ensure that phi is in [-pi, pi]
             phi = (phi + np.pi) % (2 * np.pi) - np.pi
             self.z = phi * self.radius / np.pi
@@ -1754,7 +2305,7 @@ class Rat(utils.Utilities):
                 self.move_right = False
             elif self.x < -self.radius:
                 self.move_right = True
-            elif np.random.random() < self.turning_probability:
+            elif self.rng_motion.random() < self.turning_probability:
                 self.move_right = not self.move_right
 
             if self.move_right:
@@ -1779,7 +2330,7 @@ class Rat(utils.Utilities):
                 self.phi = -self.phi
             # Normal move without reflection
             else:
-                self.phi += self.angular_sigma * np.random.randn()
+                self.phi += self.angular_sigma * self.rng_motion.standard_normal()
             self.x += self.velocity_dt * np.cos(self.phi)
             self.y += self.velocity_dt * np.sin(self.phi)
 
@@ -1809,8 +2360,8 @@ class Rat(utils.Utilities):
                 self.theta = np.pi - self.theta
             # Normal move without reflection
             else:
-                self.phi += self.angular_sigma * np.random.randn()
-                self.theta += self.angular_sigma * np.random.randn()
+                self.phi += self.angular_sigma * self.rng_motion.standard_normal()
+                self.theta += self.angular_sigma * self.rng_motion.standard_normal()
             self.x += self.velocity_dt * np.cos(self.phi) * np.sin(self.theta)
             self.y += self.velocity_dt * np.sin(self.phi) * np.sin(self.theta)
             # This 0.5 is not understood
@@ -1849,7 +2400,7 @@ class Rat(utils.Utilities):
             self.phi = -self.phi
         # Normal move without reflection
         else:
-            self.phi += self.angular_sigma * np.random.randn()
+            self.phi += self.angular_sigma * self.rng_motion.standard_normal()
         self.x += self.velocity_dt * np.cos(self.phi)
         self.y += self.velocity_dt * np.sin(self.phi)
 
@@ -1877,7 +2428,7 @@ class Rat(utils.Utilities):
             # self.y += self.velocity_dt * np.sin(self.phi)
         # Normal move without reflection
         else:
-            self.phi += self.angular_sigma * np.random.randn()
+            self.phi += self.angular_sigma * self.rng_motion.standard_normal()
             self.x += self.velocity_dt * np.cos(self.phi)
             self.y += self.velocity_dt * np.sin(self.phi)
 
@@ -1933,9 +2484,12 @@ class Rat(utils.Utilities):
         """
         Sums exc_weights * exc_rates and substracts inh_weights * inh_rates
         """
+        rates_inh = self.rates['inh']
+        if inh_rates_factor != 1:
+            rates_inh = inh_rates_factor * rates_inh
         rate = (
             np.dot(self.synapses['exc'].weights, self.rates['exc']) -
-            np.dot(self.synapses['inh'].weights, inh_rates_factor*self.rates['inh'])
+            np.dot(self.synapses['inh'].weights, rates_inh)
         )
 
         rate[rate < 0] = 0
@@ -1997,18 +2551,94 @@ class Rat(utils.Utilities):
                 self.rates = {p: self.get_rates_at_single_position[p](position)
                                         for p in self.populations}
 
+    def get_input_rates_index(self, positions):
+        """
+        Returns the index into the discretized input rates of many positions
+
+        Vectorized version of the indexing in `set_current_input_rates`.
+
+        Parameters
+        ----------
+        positions : ndarray of shape (..., dimensions)
+
+        Returns
+        -------
+        index : tuple of ndarrays
+            Each of shape positions.shape[:-1], such that
+            self.input_rates[p][index] has shape
+            positions.shape[:-1] + (n_inputs, )
+        """
+        if self.dimensions == 1:
+            index_float = ((positions + self.limit)
+                           / self.input_space_resolution - 1)
+            return (index_float[..., 0].astype(np.int64), )
+        else:
+            r = self.limit
+            n = self.n_discretize
+            index_float = np.ceil((positions + r)*n/(2*r)) - 1
+            index = index_float.astype(np.int64)
+            if self.dimensions == 2:
+                return (index[..., 1], index[..., 0])
+            elif self.dimensions == 3:
+                return (index[..., 1], index[..., 0], index[..., 2])
+
+    def get_input_rates_flat_index(self, positions):
+        """
+        Returns the row of many positions in the flattened input rates
+
+        The flattened input rates are obtained with `get_flat_input_rates`.
+        Computing the rows for an entire trajectory block at once avoids
+        the creation of index arrays in every time step.
+
+        Parameters
+        ----------
+        positions : ndarray of shape (..., dimensions)
+
+        Returns
+        -------
+        rows : ndarray of shape positions.shape[:-1]
+        """
+        return np.ravel_multi_index(
+            self.get_input_rates_index(positions),
+            self.positions_input_space.shape[:self.dimensions])
+
+    def get_flat_input_rates(self):
+        """
+        Returns the input rates as arrays of shape (n_positions, n_inputs)
+
+        The arrays are views on `self.input_rates`, so they need to be
+        obtained again whenever the input rates are replaced, e.g. after
+        a room switch.
+        """
+        return {p: self.input_rates[p].reshape(
+                        -1, self.input_rates[p].shape[-1])
+                for p in self.populations}
 
     def update_exc_weights(self):
-        self.synapses['exc'].weights += (
-            (self.rates['exc'] * self.synapses['exc'].eta_dt) * self.output_rate[:, np.newaxis]
-        )
+        """
+        Hebbian update of the excitatory weights
+
+        The weight change is computed in the work buffers of the synapses,
+        so that no arrays are allocated.
+        """
+        syn = self.synapses['exc']
+        np.multiply(self.rates['exc'], syn.eta_dt, out=syn.rates_buffer)
+        np.multiply(syn.rates_buffer, self.output_rate[:, np.newaxis],
+                    out=syn.weights_buffer)
+        syn.weights += syn.weights_buffer
 
     def update_inh_weights(self, inh_eta_factor=1):
-        self.synapses['inh'].weights += (
-            self.rates['inh'] *
-                ((self.output_rate[:, np.newaxis] - self.target_rate)
-                * self.synapses['inh'].eta_dt * inh_eta_factor)
-        )
+        """
+        Update of the inhibitory weights towards the target rate
+
+        See `update_exc_weights`.
+        """
+        syn = self.synapses['inh']
+        np.multiply(self.rates['inh'],
+                    ((self.output_rate[:, np.newaxis] - self.target_rate)
+                     * syn.eta_dt * inh_eta_factor),
+                    out=syn.weights_buffer)
+        syn.weights += syn.weights_buffer
         # self.synapses['inh'].weights += (
         # 	np.outer((self.output_rate - self.target_rate), self.rates['inh']) * self.synapses['inh'].eta_dt
         # )
@@ -2019,6 +2649,23 @@ class Rat(utils.Utilities):
         self.update_exc_weights()
         self.update_inh_weights(inh_eta_factor=inh_eta_factor)
 
+    def clip_weights(self):
+        """
+        Set negative weights to zero
+        """
+        self.synapses['exc'].weights[self.synapses['exc'].weights<0] = 0.
+        self.synapses['inh'].weights[self.synapses['inh'].weights<0] = 0.
+
+    def set_current_input_rates_from_row(self, flat_input_rates, row):
+        """
+        Set the rates of the input neurons from a row of the input rates
+
+        Faster than `set_current_input_rates`, see `get_flat_input_rates`
+        and `get_input_rates_flat_index`.
+        """
+        for p in self.populations:
+            self.rates[p] = flat_input_rates[p][row]
+
     def normalize_exc_weights_linear_substractive(self):
         """Normalize substractively, keeping the linear sum constant"""
         # Get a vector with entries of ones and zeroes
@@ -2092,6 +2739,245 @@ class Rat(utils.Utilities):
                             weights, weights))
         self.synapses['exc'].weights[0, slce] *= factor
 
+    def _check_incremental_normalization(self):
+        """
+        Exit if incrementally maintained norms are not possible
+        """
+        if not self.discretize_space:
+            sys.exit('ERROR: Incremental normalization requires '
+                     'discretize_space')
+        if self.lateral_inhibition:
+            sys.exit('ERROR: Incremental normalization is not implemented '
+                     'for lateral inhibition')
+        if self.normalization not in ['quadratic_multiplicative',
+                                      'linear_multiplicative',
+                                      'quadratic_multiplicative_boxside']:
+            sys.exit('ERROR: Incremental normalization is not implemented '
+                     'for {0} normalization'.format(self.normalization))
+        if int(getattr(self, 'learning_batch_size', 1)) > 1:
+            sys.exit('ERROR: Incremental normalization is not implemented '
+                     'for learning in mini batches')
+
+    def _get_exc_weight_segments(self):
+        """
+        Parts of the excitatory weights whose norms are tracked separately
+
+        In the boxside normalization the two sides are normalized
+        independently.
+        """
+        if self.normalization == 'quadratic_multiplicative_boxside':
+            n = self.synapses['exc'].n_side
+            return [np.s_[:n], np.s_[n:]]
+        return [np.s_[:]]
+
+    def _set_input_rates_norms(self, flat_input_rates):
+        """
+        Sets the sum and squared sum of the input rates at each position
+
+        Shape (n_positions, n_segments), for each segment of
+        `_get_exc_weight_segments`. They are only computed anew if the
+        input rates changed, e.g. after a room or boxside switch.
+        """
+        if getattr(self, '_input_rates_norms_source', None) \
+                is self.input_rates['exc']:
+            return
+        rates = flat_input_rates['exc']
+        segments = self._exc_weight_segments
+        self._input_rates_squared_sums = np.stack(
+            [np.einsum('ij,ij->i', rates[:, s], rates[:, s],
+                       dtype=np.float64) for s in segments], axis=1)
+        self._input_rates_sums = np.stack(
+            [np.sum(rates[:, s], axis=1, dtype=np.float64)
+             for s in segments], axis=1)
+        self._input_rates_norms_source = self.input_rates['exc']
+
+    def _resync_exc_weight_norms(self):
+        """
+        Applies the normalization factors and computes the norms anew
+
+        In the incremental normalization the stored excitatory weights
+        are multiplied with `_exc_weight_scale`, shape
+        (n_segments, output_neurons), to obtain the actual weights. Here
+        the factors are applied, so that the stored weights are the
+        actual weights, and the sum and squared sum of the weights, same
+        shape, are computed from all weights. This bounds the
+        accumulation of round off errors, see `_update_exc_weight_norms`.
+        """
+        weights = self.synapses['exc'].weights
+        segments = self._exc_weight_segments
+        scale = getattr(self, '_exc_weight_scale', None)
+        if scale is not None:
+            for s, f in zip(segments, scale):
+                weights[:, s] *= f[:, np.newaxis]
+        self._exc_weight_scale = np.ones((len(segments), weights.shape[0]))
+        self._exc_squared_weight_sum = np.array(
+            [np.einsum('...j,...j->...', weights[:, s], weights[:, s])
+             for s in segments], dtype=np.float64)
+        self._exc_weight_sum = np.array(
+            [np.sum(weights[:, s], axis=1) for s in segments],
+            dtype=np.float64)
+        self._exc_weight_norms_valid = True
+
+    def set_current_input_rates_incremental(self, flat_input_rates, row):
+        """
+        Like `set_current_input_rates_from_row`, also keeps the row
+
+        The norms of the current input rates are needed in
+        `_update_exc_weight_norms`.
+        """
+        self.set_current_input_rates_from_row(flat_input_rates, row)
+        self._row = row
+
+    def set_current_output_rate_incremental(self, inh_rates_factor=1):
+        """
+        Like `set_current_output_rate` with the scaled excitatory weights
+
+        The drive w.r of each segment of `_get_exc_weight_segments` is
+        kept for `_update_exc_weight_norms`.
+        """
+        weights = self.synapses['exc'].weights
+        rates = self.rates['exc']
+        segments = self._exc_weight_segments
+        if len(segments) == 1:
+            drive = self._exc_weight_scale[0] * np.dot(weights, rates)
+            self._exc_drive = drive[np.newaxis]
+        else:
+            self._exc_drive = self._exc_weight_scale * np.array(
+                [np.dot(weights[:, s], rates[s]) for s in segments])
+            drive = np.sum(self._exc_drive, axis=0)
+        rates_inh = self.rates['inh']
+        if inh_rates_factor != 1:
+            rates_inh = inh_rates_factor * rates_inh
+        rate = drive - np.dot(self.synapses['inh'].weights, rates_inh)
+        rate[rate < 0] = 0
+        self.output_rate = rate
+
+    def update_weights_incremental(self, inh_eta_factor=1):
+        """
+        Like `update_weights` for the scaled excitatory weights
+
+        The weight change of the actual weights is divided by the
+        normalization factor, see `_resync_exc_weight_norms`.
+        """
+        syn = self.synapses['exc']
+        np.multiply(self.rates['exc'], syn.eta_dt, out=syn.rates_buffer)
+        for s, f in zip(self._exc_weight_segments, self._exc_weight_scale):
+            np.multiply(syn.rates_buffer[s],
+                        (self.output_rate / f)[:, np.newaxis],
+                        out=syn.weights_buffer[:, s])
+        syn.weights += syn.weights_buffer
+        self.update_inh_weights(inh_eta_factor=inh_eta_factor)
+
+    def clip_weights_incremental(self):
+        """
+        Like `clip_weights`
+
+        Clipped excitatory weights are not part of the rank-1 update, so
+        the norms are then computed anew.
+        """
+        weights = self.synapses['exc'].weights
+        negative = weights < 0
+        if negative.any():
+            weights[negative] = 0.
+            self._exc_weight_norms_valid = False
+        self.synapses['inh'].weights[self.synapses['inh'].weights<0] = 0.
+
+    def _update_exc_weight_norms(self):
+        """
+        Updates the sum and squared sum of the weights after the update
+
+        The Hebbian update of output neuron i is d * r with
+        d = eta_dt * output_rate[i], so for the weights w before the
+        update
+
+            |w + d r|^2 = |w|^2 + 2 d w.r + d^2 |r|^2
+            sum(w + d r) = sum(w) + d sum(r)
+
+        where w.r is the drive kept by `set_current_output_rate_incremental`
+        and |r|^2 and sum(r) are taken from the tables of
+        `_set_input_rates_norms`. Every 'normalization_resync_interval'
+        steps, and after weights have been clipped, the norms are
+        computed anew.
+        """
+        interval = int(getattr(self, 'normalization_resync_interval', 1000))
+        if not self._exc_weight_norms_valid or self.step % interval == 0:
+            self._resync_exc_weight_norms()
+            return
+        d = self.output_rate * float(self.synapses['exc'].eta_dt)
+        self._exc_squared_weight_sum += d * (
+            2 * self._exc_drive
+            + d * self._input_rates_squared_sums[self._row][:, np.newaxis])
+        self._exc_weight_sum += (
+            d * self._input_rates_sums[self._row][:, np.newaxis])
+
+    def _scale_exc_weights(self, factor, segments=np.s_[:]):
+        """
+        Multiplies the actual weights of `segments` with `factor`
+
+        Only the normalization factors and the norms are changed, not
+        the stored weights.
+        """
+        self._exc_weight_scale[segments] *= factor
+        self._exc_squared_weight_sum[segments] *= factor**2
+        self._exc_weight_sum[segments] *= factor
+
+    def normalize_exc_weights_incremental_quadratic_multiplicative(self):
+        """
+        Like `normalize_exc_weights_quadratic_multiplicative`
+
+        The squared sum is maintained incrementally instead of being
+        computed from all weights, see `_update_exc_weight_norms`, and
+        the weights are multiplied lazily, see `_resync_exc_weight_norms`.
+        """
+        self._update_exc_weight_norms()
+        self._scale_exc_weights(np.sqrt(
+            self.synapses['exc'].initial_squared_weight_sum
+            / self._exc_squared_weight_sum[0]))
+
+    def normalize_exc_weights_incremental_linear_multiplicative(self):
+        """
+        Like `normalize_exc_weights_linear_multiplicative`
+
+        See `normalize_exc_weights_incremental_quadratic_multiplicative`.
+        """
+        self._update_exc_weight_norms()
+        self._scale_exc_weights(self.synapses['exc'].initial_weight_sum
+                                / np.sum(self._exc_weight_sum))
+
+    def normalize_exc_weights_incremental_quadratic_multiplicative_boxside(
+            self):
+        """
+        Like `normalize_exc_weights_quadratic_multiplicative_boxside`
+
+        The squared sums of both sides are maintained incrementally, see
+        `normalize_exc_weights_incremental_quadratic_multiplicative`.
+        Only for one output neuron.
+        """
+        self._update_exc_weight_norms()
+        if self.boxside == 'left':
+            sides = np.s_[:1]
+            init_weight_sum = self.synapses[
+                'exc'].initial_squared_weight_sum_left
+        elif self.boxside == 'right':
+            sides = np.s_[1:]
+            init_weight_sum = self.synapses[
+                'exc'].initial_squared_weight_sum_right
+        elif self.boxside == 'both':
+            sides = np.s_[:]
+            init_weight_sum = self.synapses[
+                'exc'].initial_squared_weight_sum
+        self._scale_exc_weights(
+            np.sqrt(init_weight_sum
+                    / np.sum(self._exc_squared_weight_sum[sides, 0])),
+            sides)
+
+    def _add_to_rawdata_incremental(self, rawdata, step):
+        """
+        Like `_add_to_rawdata`, the weights are scaled before they are stored
+        """
+        if step % self.every_nth_step_weights == 0:
+            self._resync_exc_weight_norms()
+        self._add_to_rawdata(rawdata, step)
 
     def get_move_function(self):
         d = {
@@ -2157,14 +3043,38 @@ class Rat(utils.Utilities):
             # Changing the actual input rates (discretized) for the
             # simulations
             self.input_rates[p] = self.get_input_rates_grid(
-                self.positions_input_space, self.synapses[p])
+                self.positions_input_space, self.synapses[p],
+                dtype=self.dtype)
             # Changing the low resolution input rates array for plotting
             self.input_rates_low_resolution[p] = \
                 self.get_input_rates_grid(self.positions_grid,
-                                          self.synapses[p])
+                                          self.synapses[p], dtype=self.dtype)
+
+    def _empty_rawdata_array(self, shape, name, dtype=np.float64):
+        """
+        Like np.empty, but on disk if the rawdata is streamed
+
+        See `rawdata_store.RawdataStore`
+        """
+        if getattr(self, 'stream_rawdata', False):
+            return self.rawdata_store.empty(shape, name, dtype=dtype)
+        else:
+            return np.empty(shape, dtype=dtype)
+
+    def _finish_rawdata(self, rawdata):
+        """
+        Makes the rawdata readable after the simulation
+        """
+        if getattr(self, 'stream_rawdata', False):
+            print('Rawdata stored in: ' + self.rawdata_store.directory)
+            return self.rawdata_store.finish(rawdata)
+        return rawdata
 
     def _prepare_rawdata(self):
         rawdata = {'exc': {}, 'inh': {}}
+        if getattr(self, 'stream_rawdata', False):
+            self.rawdata_store = rawdata_store.RawdataStore(
+                getattr(self, 'rawdata_directory', '') or None)
 
         n_time_steps = 1 + self.simulation_time / self.dt
         time_shape = int(np.ceil(n_time_steps / self.every_nth_step))
@@ -2205,7 +3115,8 @@ class Rat(utils.Utilities):
             rawdata[p]['number'] = np.array([self.synapses[p].number])
             weights_shape = (time_shape_weights, self.output_neurons,
                                                 self.synapses[p].number)
-            rawdata[p]['weights'] = np.empty(weights_shape)
+            rawdata[p]['weights'] = self._empty_rawdata_array(
+                weights_shape, p + '/weights', dtype=self.dtype)
             rawdata[p]['weights'][0] = self.synapses[p].weights.copy()
             if self.save_n_input_rates:
                 rawdata[p]['input_rates'] = self.input_rates_low_resolution[p][
@@ -2214,9 +3125,11 @@ class Rat(utils.Utilities):
                 rawdata[p]['input_rates'] = self.input_rates_low_resolution[p][
                                     ..., :self.synapses[p].save_n_input_rates]
 
-        rawdata['positions'] = np.empty((time_shape, 3))
+        rawdata['positions'] = self._empty_rawdata_array((time_shape, 3),
+                                                         'positions')
         if 'persistent' in self.params['sim']['motion']:
-            rawdata['phi'] = np.empty(time_shape)
+            rawdata['phi'] = self._empty_rawdata_array((time_shape, ),
+                                                       'phi')
 
         rawdata['positions_grid'] = np.squeeze(self.positions_grid)
 
@@ -2225,14 +3138,17 @@ class Rat(utils.Utilities):
                                             np.arange(self.dimensions)])
         output_rate_grid_shape += (self.output_neurons, )
 
-        rawdata['output_rate_grid'] = np.empty(output_rate_grid_shape)
+        rawdata['output_rate_grid'] = self._empty_rawdata_array(
+            output_rate_grid_shape, 'output_rate_grid', dtype=self.dtype)
         rawdata['output_rate_grid'][0] = self.get_output_rates_from_equation(
                         frame=0, rawdata=rawdata, spacing=self.spacing,
                         positions_grid=self.positions_grid,
                         input_rates=self.input_rates_low_resolution,
                             equilibration_steps=self.equilibration_steps)
 
-        rawdata['output_rates'] = np.empty((time_shape, self.output_neurons))
+        rawdata['output_rates'] = self._empty_rawdata_array(
+            (time_shape, self.output_neurons), 'output_rates',
+            dtype=self.dtype)
 
         if 'persistent' in self.params['sim']['motion']:
             rawdata['phi'][0] = self.phi
@@ -2246,9 +3162,9 @@ class Rat(utils.Utilities):
         if step % self.every_nth_step == 0:
             index = int(self.step / self.every_nth_step)
             # Store Positions
-            rawdata['positions'][index] = np.array([self.x, self.y, self.z])
+            rawdata['positions'][index] = self.x, self.y, self.z
             if 'persistent' in self.params['sim']['motion']:
-                rawdata['phi'][index] = np.array(self.phi)
+                rawdata['phi'][index] = self.phi
             rawdata['output_rates'][index] = self.output_rate
 
         if step % self.every_nth_step_weights == 0:
@@ -2258,12 +3174,767 @@ class Rat(utils.Utilities):
                 'exc'].weights.copy()
             rawdata['inh']['weights'][index] = self.synapses[
                 'inh'].weights.copy()
+            self._set_output_rate_grid(rawdata, index)
+            if getattr(self, 'early_stopping', '') and index > 0:
+                if self._check_convergence(rawdata, index):
+                    print('Converged at step: %i' % step)
+                    self.stop_step = step
+
+    def _set_output_rate_grid(self, rawdata, index):
+        """
+        Computes the output rate map of the stored weights at `index`
+
+        If 'output_rate_grid_workers' is larger than 0, the rate map is
+        computed in a background thread and the simulation continues.
+        The results are written into the rawdata by
+        `_collect_output_rate_grids`.
+        """
+        kwargs = dict(
+            frame=index, rawdata=rawdata, spacing=self.spacing,
+            positions_grid=self.positions_grid,
+            # A copy of the dictionary, because the input rates are
+            # replaced by room and boxside switches
+            input_rates=dict(self.input_rates_low_resolution),
+            equilibration_steps=self.equilibration_steps)
+        executor = getattr(self, '_output_rate_grid_executor', None)
+        if executor is None:
             rawdata['output_rate_grid'][
-                index] = self.get_output_rates_from_equation(
-                frame=index, rawdata=rawdata, spacing=self.spacing,
-                positions_grid=self.positions_grid,
-                input_rates=self.input_rates_low_resolution,
-                equilibration_steps=self.equilibration_steps)
+                index] = self.get_output_rates_from_equation(**kwargs)
+        else:
+            self._output_rate_grid_futures.append(
+                (index, executor.submit(self.get_output_rates_from_equation,
+                                        **kwargs)))
+            # Limit the number of rate maps that are kept in memory
+            n_max = 2 * int(self.output_rate_grid_workers)
+            if len(self._output_rate_grid_futures) > n_max:
+                self._collect_output_rate_grids(
+                    rawdata, n=len(self._output_rate_grid_futures) - n_max)
+
+    def _collect_output_rate_grids(self, rawdata, n=None):
+        """
+        Waits for the rate maps computed in the background
+
+        Parameters
+        ----------
+        rawdata : dict
+        n : int or None
+            Only wait for the n oldest rate maps. If None, for all.
+        """
+        futures = getattr(self, '_output_rate_grid_futures', [])
+        if n is None:
+            n = len(futures)
+        for index, future in futures[:n]:
+            rawdata['output_rate_grid'][index] = future.result()
+        self._output_rate_grid_futures = futures[n:]
+
+    def _get_convergence_measure(self, rawdata, index):
+        """
+        Change between the stored weights at index - 1 and index
+
+        Parameters
+        ----------
+        rawdata : dict
+        index : int
+            Index of the weight snapshot
+
+        Returns
+        -------
+        measure : float
+            For early_stopping 'weight_change': the squared change of the
+            excitatory weights relative to their squared sum.
+            For early_stopping 'rate_map_correlation': 1 minus the
+            correlation of the output rate maps.
+        """
+        if self.early_stopping == 'weight_change':
+            old = rawdata['exc']['weights'][index - 1]
+            new = rawdata['exc']['weights'][index]
+            return (observables.sum_difference_squared(old, new)
+                    / np.sum(np.square(new)))
+        elif self.early_stopping == 'rate_map_correlation':
+            self._collect_output_rate_grids(rawdata)
+            old = rawdata['output_rate_grid'][index - 1].flatten()
+            new = rawdata['output_rate_grid'][index].flatten()
+            return 1 - np.corrcoef(old, new)[0, 1]
+        else:
+            sys.exit('ERROR: Early stopping {0} is not defined'.format(
+                self.early_stopping))
+
+    def _check_convergence(self, rawdata, index):
+        """
+        True if the convergence measure stayed below the threshold
+
+        The measure must be below 'early_stopping_threshold' for
+        'early_stopping_patience' consecutive weight snapshots.
+        """
+        measure = self._get_convergence_measure(rawdata, index)
+        if measure < getattr(self, 'early_stopping_threshold', 1e-2):
+            self._n_converged_snapshots += 1
+        else:
+            self._n_converged_snapshots = 0
+        return self._n_converged_snapshots >= int(
+            getattr(self, 'early_stopping_patience', 3))
+
+    def _truncate_rawdata(self, rawdata, step):
+        """
+        Removes the entries of the rawdata after `step`
+
+        The step at which the simulation stopped is stored in
+        rawdata['stop_step'].
+        """
+        n = int(step / self.every_nth_step) + 1
+        n_weights = int(step / self.every_nth_step_weights) + 1
+        for key in ['positions', 'phi', 'output_rates']:
+            if key in rawdata:
+                rawdata[key] = rawdata[key][:n]
+        for p in self.populations:
+            rawdata[p]['weights'] = rawdata[p]['weights'][:n_weights]
+        for key in ['output_rate_grid', 'mini_batch_deviation',
+                    'mini_batch_weight_deviation']:
+            if key in rawdata:
+                rawdata[key] = rawdata[key][:n_weights]
+        rawdata['stop_step'] = np.array([step])
+
+    def _get_step_blocks(self):
+        """
+        Splits the simulation steps into blocks for the trajectory
+
+        Blocks have at most 'trajectory_block_size' steps. A new block
+        is also started at each step at which the room or the box side is
+        switched, because the motion of the rat can change at these steps,
+        and after each checkpoint.
+
+        Returns
+        -------
+        blocks : list of ndarrays
+        """
+        block_size = int(getattr(self, 'trajectory_block_size', 1e5))
+        boundaries = set(np.arange(0, len(self.steps), block_size))
+        boundaries.update(np.searchsorted(self.steps,
+                                          self._get_switch_steps()))
+        checkpoint_interval = int(getattr(self, 'checkpoint_interval', 0))
+        if checkpoint_interval:
+            boundaries.update(np.arange(0, len(self.steps),
+                                        checkpoint_interval))
+        boundaries = sorted(boundaries) + [len(self.steps)]
+        return [self.steps[a:b] for a, b in zip(boundaries[:-1],
+                                                boundaries[1:]) if b > a]
+
+    def _get_switch_steps(self):
+        """
+        Sorted steps at which the room or the box side is switched
+        """
+        return sorted(set([t + 1 for t in [
+            self.params['sim']['room_switch_time'],
+            self.params['sim']['boxside_switch_time'],
+            self.params['sim']['explore_all_time']] if t]))
+
+    def _get_checkpoint_path(self):
+        """
+        Path of the checkpoint of a simulation with these parameters
+
+        The name contains a hash of the parameters, so that a checkpoint
+        is never loaded into a simulation with other parameters.
+        """
+        return os.path.join(
+            getattr(self, 'checkpoint_directory', '') or os.getcwd(),
+            'checkpoint_{0}.p'.format(
+                input_rates_cache.get_key(self.params)[:16]))
+
+    def _save_checkpoint(self, rawdata, step):
+        """
+        Stores everything that is needed to continue the simulation
+
+        The checkpoint is first written to a temporary file, so that an
+        interruption during writing does not destroy the last checkpoint.
+
+        Parameters
+        ----------
+        rawdata : dict
+        step : int
+            The last step that has been simulated
+        """
+        checkpoint = {
+            'step': step,
+            'weights': {p: self.synapses[p].weights
+                        for p in self.populations},
+            'position': (self.x, self.y, self.z, self.phi, self.theta),
+            'move_right': getattr(self, 'move_right', None),
+            'output_rate': self.output_rate,
+            'boxside': self.boxside,
+            'random_state': random_streams.get_state(self.rng_motion),
+            'mini_batch_counts': getattr(self, '_mini_batch_counts', None),
+            'n_converged_snapshots': self._n_converged_snapshots,
+            'rawdata': self._get_rawdata_to_checkpoint(rawdata, step),
+        }
+        path = self._get_checkpoint_path()
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump(checkpoint, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+        # The new checkpoint no longer refers to the rawdata of the
+        # interrupted simulation
+        self._remove_resumed_rawdata()
+        print('Checkpoint at step: %i' % step)
+
+    def _get_filled_snapshots(self, rawdata, step):
+        """
+        Number of snapshots of each time series after `step`
+
+        Returns
+        -------
+        filled : dict
+            Number of filled snapshots by name of the array, e.g.
+            'exc/weights', see `_empty_rawdata_array`
+        """
+        n = int(step // self.every_nth_step) + 1
+        n_weights = int(step // self.every_nth_step_weights) + 1
+        filled = {'positions': n, 'output_rates': n,
+                  'output_rate_grid': n_weights}
+        if 'phi' in rawdata:
+            filled['phi'] = n
+        for p in self.populations:
+            filled[p + '/weights'] = n_weights
+        return filled
+
+    @staticmethod
+    def _get_rawdata_array(rawdata, name):
+        for key in name.split('/'):
+            rawdata = rawdata[key]
+        return rawdata
+
+    def _get_rawdata_to_checkpoint(self, rawdata, step):
+        """
+        Returns the part of the rawdata that a checkpoint needs
+
+        Everything else is created again by `_prepare_rawdata`. Of the
+        time series only the filled snapshots are stored. Streamed
+        rawdata is flushed and only its directory is stored, so that the
+        size of a checkpoint does not grow with the simulation time.
+        """
+        filled = self._get_filled_snapshots(rawdata, step)
+        streamed = getattr(self, 'stream_rawdata', False)
+        snapshots = {}
+        for name, n in filled.items():
+            array = self._get_rawdata_array(rawdata, name)
+            if streamed:
+                array.flush()
+            else:
+                snapshots[name] = array[:n]
+        return {
+            'filled': filled,
+            'snapshots': snapshots,
+            'directory': (self.rawdata_store.directory if streamed
+                          else None),
+            'mini_batch_deviation': rawdata.get('mini_batch_deviation'),
+            'mini_batch_weight_deviation': rawdata.get(
+                'mini_batch_weight_deviation'),
+        }
+
+    def _remove_resumed_rawdata(self):
+        """
+        Removes the streamed rawdata of the simulation that was resumed
+        """
+        directory = getattr(self, '_resumed_rawdata_directory', None)
+        if directory:
+            shutil.rmtree(directory, ignore_errors=True)
+            self._resumed_rawdata_directory = None
+
+    def _load_checkpoint(self, rawdata, trajectory):
+        """
+        Restores the state of the simulation from the latest checkpoint
+
+        Room and boxside switches before the checkpoint are applied again,
+        because they change the input rates and the motion.
+
+        Parameters
+        ----------
+        rawdata : dict
+            The prepared rawdata, which is overwritten in place
+        trajectory : trajectories.Trajectory
+
+        Returns
+        -------
+        step : int
+            The last step that has been simulated before the checkpoint
+        """
+        with open(self._get_checkpoint_path(), 'rb') as f:
+            checkpoint = pickle.load(f)
+        step = checkpoint['step']
+        print('Resume from checkpoint at step: %i' % step)
+        for switch_step in self._get_switch_steps():
+            if switch_step <= step:
+                self._switch_rooms_and_boxsides(switch_step, trajectory)
+        for p in self.populations:
+            self.synapses[p].weights[...] = checkpoint['weights'][p]
+        self.x, self.y, self.z, self.phi, self.theta = checkpoint['position']
+        if checkpoint['move_right'] is not None:
+            self.move_right = checkpoint['move_right']
+        self.output_rate = checkpoint['output_rate']
+        self.boxside = checkpoint['boxside']
+        if checkpoint['mini_batch_counts'] is not None:
+            self._mini_batch_counts[:] = checkpoint['mini_batch_counts']
+        self._n_converged_snapshots = checkpoint['n_converged_snapshots']
+        self._restore_rawdata(rawdata, checkpoint['rawdata'])
+        random_streams.set_state(self.rng_motion, checkpoint['random_state'])
+        return step
+
+    def _restore_rawdata(self, rawdata, stored):
+        """
+        Writes the stored rawdata into the (possibly streamed) rawdata
+
+        Parameters
+        ----------
+        rawdata : dict
+        stored : dict
+            See `_get_rawdata_to_checkpoint`
+        """
+        directory = stored['directory']
+        for name, n in stored['filled'].items():
+            if directory:
+                source = np.load(rawdata_store.get_path(directory, name),
+                                 mmap_mode='r')
+            else:
+                source = stored['snapshots'][name]
+            self._get_rawdata_array(rawdata, name)[:n] = source[:n]
+        for key in ['mini_batch_deviation', 'mini_batch_weight_deviation']:
+            if stored.get(key) is not None:
+                rawdata[key][...] = stored[key]
+        # Removed after the next checkpoint or at the end
+        self._resumed_rawdata_directory = directory
+
+    def _switch_rooms_and_boxsides(self, step, trajectory):
+        """
+        Room and boxside switches that happen before the move at `step`
+
+        Parameters
+        ----------
+        step : int
+        trajectory : trajectories.Trajectory
+            Its move function is changed if the rat is constrained to
+            a different part of the arena.
+        """
+        room_switch_time = self.params['sim']['room_switch_time']
+        boxside_switch_time = self.params['sim']['boxside_switch_time']
+        explore_all_time = self.params['sim']['explore_all_time']
+        ###############################################
+        ############### Room switching ###############
+        ###############################################
+        if room_switch_time:
+            if step == room_switch_time + 1:
+                print(('Room switch at step: {0}'.format(step)))
+                self._room_switch()
+
+        if boxside_switch_time:
+            if step == boxside_switch_time + 1:
+                print(('Switch to right side at step: {0}'.format(step)))
+                if self.boxside_initial_side == 'left':
+                    new_side = 'right'
+                    # Place rat in right side of the arena
+                    self.x = self.radius / 2.
+                    self.y = self.radius / 2.
+                else:
+                    new_side = 'left'
+                    # Place rat in left side of arena
+                    self.x = - self.radius / 2.
+                    self.y = - self.radius / 2.
+                self.boxside = new_side
+
+                # Constrain motion to new side
+                trajectory.move = functools.partial(
+                    self.move_persistently_in_half_of_arena,
+                    side=new_side)
+                # Set input from the other side to 0
+                for p in self.populations:
+                    # self._cut_off_in_boxside_experiments(p,
+                    # 							current_side=new_side)
+                    if self.boxside_independent_centers:
+                        self._set_inputs_from_other_boxside_to_zero(p,
+                                                    current_side=new_side)
+
+        if explore_all_time:
+            if step == explore_all_time + 1:
+                print(('Switch to full room at step: {0}'.format(step)))
+                trajectory.move = self.move_persistently
+                self.input_rates_low_resolution =\
+                    self.input_rates_low_resolution_without_cutoff
+                self.input_rates = self.input_rates_without_cutoff
+                self.boxside = 'both'
+
+    def _check_sparse_input_rates(self):
+        """
+        Exit if sparse input rates are not possible
+        """
+        if not self.discretize_space:
+            sys.exit('ERROR: Sparse input rates require discretize_space')
+        if self.lateral_inhibition:
+            sys.exit('ERROR: Sparse input rates are not implemented for '
+                     'lateral inhibition')
+        if (self.room_switch_time or self.boxside_switch_time
+                or self.explore_all_time):
+            sys.exit('ERROR: Sparse input rates are not implemented for '
+                     'room or boxside switches')
+        if self.normalization not in ['quadratic_multiplicative',
+                                      'linear_multiplicative', 'inactive']:
+            sys.exit('ERROR: Sparse input rates are not implemented for '
+                     '{0} normalization'.format(self.normalization))
+        if int(getattr(self, 'learning_batch_size', 1)) > 1:
+            sys.exit('ERROR: Sparse input rates are not implemented for '
+                     'learning in mini batches')
+
+    def get_sparse_input_rates(self, input_rates):
+        """
+        Returns input rates as sparse matrix of shape (n_positions, n_inputs)
+
+        Rates below 'sparse_input_rates_tolerance' are neglected. For
+        Gaussian fields of height 1 and tolerance tol, each position
+        keeps the inputs whose centers are within
+        sqrt(2 * ln(1 / tol)) sigma, e.g. 5.3 sigma for tol = 1e-6.
+
+        Parameters
+        ----------
+        input_rates : ndarray
+            Input rates with the inputs along the last axis
+
+        Returns
+        -------
+        input_rates_sparse : scipy.sparse.csr_matrix
+            The rows are the positions in the order of
+            `get_input_rates_flat_index`
+        """
+        tolerance = getattr(self, 'sparse_input_rates_tolerance', 1e-6)
+        input_rates = input_rates.reshape(-1, input_rates.shape[-1])
+        n_positions, n_inputs = input_rates.shape
+        active = np.flatnonzero(np.abs(input_rates) >= tolerance)
+        indptr = np.searchsorted(active, np.arange(n_positions + 1) * n_inputs)
+        return scipy.sparse.csr_matrix(
+            (input_rates.ravel()[active].astype(self.dtype, copy=False),
+             active % n_inputs, indptr),
+            shape=input_rates.shape)
+
+    def get_sparse_input_rates_grid(self, positions, synapses):
+        """
+        Returns the input rates on `positions` as sparse matrix
+
+        Like `get_input_rates_grid` followed by `get_sparse_input_rates`,
+        but the dense rates are only computed for a few rows of positions
+        at a time, so that the dense table is never kept in memory.
+
+        Parameters
+        ----------
+        positions : ndarray
+            Positions grid as defined in get_positions
+        synapses : Synapses
+
+        Returns
+        -------
+        input_rates_sparse : scipy.sparse.csr_matrix
+        """
+        return scipy.sparse.vstack(
+            [self.get_sparse_input_rates(rates) for _, rates in
+             self._get_input_rates_grid_chunks(positions, synapses)],
+            format='csr')
+
+    def set_current_input_rates_sparse(self, input_rates_sparse, row):
+        """
+        Set the indices and rates of the active inputs at a row
+
+        Like `set_current_input_rates_from_row` for the sparse tables.
+        """
+        self.active_rates = {}
+        for p in self.populations:
+            table = input_rates_sparse[p]
+            active = slice(table.indptr[row], table.indptr[row + 1])
+            self.active_rates[p] = (table.indices[active],
+                                    table.data[active])
+
+    def set_current_output_rate_sparse(self, inh_rates_factor=1):
+        """
+        Like `set_current_output_rate` but only with the active inputs
+
+        The weights of the active inputs are kept in `active_weights`
+        for the weight update. The stored excitatory weights are
+        multiplied with the normalization factor `_exc_weight_scale`,
+        see `normalize_exc_weights_sparse_quadratic_multiplicative`.
+        """
+        self.active_weights = {
+            p: np.take(self.synapses[p].weights, self.active_rates[p][0],
+                       axis=1)
+            for p in self.populations}
+        rate = (
+            self._exc_weight_scale
+            * np.dot(self.active_weights['exc'], self.active_rates['exc'][1])
+            - np.dot(self.active_weights['inh'],
+                     inh_rates_factor * self.active_rates['inh'][1])
+        )
+        rate[rate < 0] = 0
+        self.output_rate = rate
+
+    def update_weights_sparse(self, inh_eta_factor=1):
+        """
+        Like `update_weights` but only for the active inputs
+
+        The previous active excitatory weights are kept for the
+        normalization.
+        """
+        self._previous_active_exc_weights = self.active_weights['exc']
+        rates = self.active_rates['exc'][1]
+        self.active_weights['exc'] = (
+            self._previous_active_exc_weights
+            + (rates * self.synapses['exc'].eta_dt)
+            * (self.output_rate / self._exc_weight_scale)[:, np.newaxis]
+        )
+        rates = self.active_rates['inh'][1]
+        self.active_weights['inh'] = self.active_weights['inh'] + (
+            rates * ((self.output_rate[:, np.newaxis] - self.target_rate)
+                     * self.synapses['inh'].eta_dt * inh_eta_factor)
+        )
+        for p in self.populations:
+            self.synapses[p].weights[:, self.active_rates[p][0]] = \
+                self.active_weights[p]
+
+    def clip_weights_sparse(self):
+        """
+        Set negative weights of the active inputs to zero
+        """
+        for p in self.populations:
+            weights = self.active_weights[p]
+            if np.any(weights < 0):
+                np.maximum(weights, 0., out=weights)
+                self.synapses[p].weights[:, self.active_rates[p][0]] = weights
+
+    def _apply_exc_weight_scale(self):
+        """
+        Multiplies the excitatory weights with the normalization factor
+
+        Afterwards the weights are the actual weights and the sums that
+        are updated incrementally in the sparse normalization are
+        computed anew, so that round off errors do not accumulate.
+        """
+        weights = self.synapses['exc'].weights
+        scale = getattr(self, '_exc_weight_scale', None)
+        if scale is not None:
+            weights *= scale[:, np.newaxis]
+        self._exc_weight_scale = np.ones(weights.shape[0], dtype=weights.dtype)
+        self._exc_weight_sum = np.sum(weights, axis=1)
+        self._exc_squared_weight_sum = np.einsum('...j,...j->...',
+                                                 weights, weights)
+
+    def normalize_exc_weights_sparse_quadratic_multiplicative(self):
+        """
+        Like `normalize_exc_weights_quadratic_multiplicative` for sparse inputs
+
+        Only the active weights changed, so the quadratic sum is updated
+        from their previous and current values. Instead of multiplying
+        all weights, the normalization factor is kept in
+        `_exc_weight_scale`, see `_apply_exc_weight_scale`.
+        """
+        previous = self._previous_active_exc_weights
+        current = self.active_weights['exc']
+        self._exc_squared_weight_sum += (
+            np.einsum('...j,...j->...', current, current)
+            - np.einsum('...j,...j->...', previous, previous))
+        self._exc_weight_scale = np.sqrt(
+            self.synapses['exc'].initial_squared_weight_sum
+            / self._exc_squared_weight_sum)
+
+    def normalize_exc_weights_sparse_linear_multiplicative(self):
+        """
+        Like `normalize_exc_weights_linear_multiplicative` for sparse inputs
+
+        See `normalize_exc_weights_sparse_quadratic_multiplicative`.
+        """
+        previous = self._previous_active_exc_weights
+        current = self.active_weights['exc']
+        self._exc_weight_sum += (np.sum(current, axis=1)
+                                 - np.sum(previous, axis=1))
+        self._exc_weight_scale = (self.synapses['exc'].initial_weight_sum
+                                  / self._exc_weight_sum)
+
+    def normalize_exc_weights_sparse_inactive(self):
+        """
+        No normalization
+        """
+        pass
+
+    def _add_to_rawdata_sparse(self, rawdata, step):
+        """
+        Like `_add_to_rawdata`, the weights are scaled before they are stored
+        """
+        if step % self.every_nth_step_weights == 0:
+            self._apply_exc_weight_scale()
+        self._add_to_rawdata(rawdata, step)
+
+    def _check_mini_batch_learning(self):
+        """
+        Exit if learning in mini batches is not possible
+        """
+        if not self.discretize_space:
+            sys.exit('ERROR: Learning in mini batches requires '
+                     'discretize_space')
+        if self.lateral_inhibition:
+            sys.exit('ERROR: Learning in mini batches is not implemented '
+                     'for lateral inhibition')
+        if self.normalization == 'linear_substractive':
+            sys.exit('ERROR: Learning in mini batches is not implemented '
+                     'for linear_substractive normalization')
+
+    def _get_mini_batches(self, steps):
+        """
+        Splits the steps of a block into mini batches
+
+        Each batch has at most 'learning_batch_size' steps. Batches end
+        at each step at which the weights are stored, so that the stored
+        weights are the weights after the update of this step.
+
+        Parameters
+        ----------
+        steps : ndarray
+
+        Returns
+        -------
+        batches : list of slices
+        """
+        batch_size = int(self.learning_batch_size)
+        ends = np.flatnonzero(steps % self.every_nth_step_weights == 0) + 1
+        boundaries = [0] + list(ends[ends < len(steps)]) + [len(steps)]
+        batches = []
+        for a, b in zip(boundaries[:-1], boundaries[1:]):
+            for start in range(a, b, batch_size):
+                batches.append(np.s_[start:min(start + batch_size, b)])
+        return batches
+
+    def _learn_in_mini_batches(self, steps, block, rows, flat_input_rates,
+                               normalize_exc_weights, rawdata):
+        """
+        Learning with the summed weight change of many time steps
+
+        The output rates of all B steps in a batch are computed with the
+        weights at the beginning of the batch. The weight changes of all
+        steps are summed and applied as a single matrix product, followed
+        by rectification and normalization. For small learning rates
+        this approximates the learning step by step.
+
+        As a measure of the deviation from the dynamics step by step, the
+        relative difference between the output rates in a batch computed
+        with the weights before and after the batch update is stored in
+        rawdata['mini_batch_deviation']. It is averaged over all batches
+        between two stored weights. This is a heuristic estimate of the
+        error of the output rates, not a bound: the inhibitory updates
+        change their sign with the output rate, rectification and
+        normalization act in every step, and the error accumulates over
+        the batches.
+
+        If 'mini_batch_reference' is True, each batch is also replayed
+        step by step from the same weights. The relative difference of
+        the weights after the batch and after the replay is stored in
+        rawdata['mini_batch_weight_deviation'], as maximum over all
+        batches between two stored weights. This measures the error of
+        a single batch exactly, but takes as long as learning step by
+        step.
+
+        Only the steps that store rawdata are iterated over in Python.
+
+        Parameters
+        ----------
+        steps : ndarray
+            The steps of a trajectory block
+        block : ndarray of shape (len(steps), 5)
+            See `trajectories.Trajectory.get_block`
+        rows : ndarray of shape (len(steps), )
+            See `get_input_rates_flat_index`
+        flat_input_rates : dict
+            See `get_flat_input_rates`
+        normalize_exc_weights : function
+        rawdata : dict
+        """
+        w_exc = self.synapses['exc'].weights
+        w_inh = self.synapses['inh'].weights
+        reference = getattr(self, 'mini_batch_reference', False)
+        stored = ((steps % self.every_nth_step == 0)
+                  | (steps % self.every_nth_step_weights == 0))
+        for batch in self._get_mini_batches(steps):
+            rates_exc = np.take(flat_input_rates['exc'], rows[batch], axis=0)
+            rates_inh = np.take(flat_input_rates['inh'], rows[batch], axis=0)
+            if reference:
+                weights_reference = self._replay_mini_batch(
+                    rates_exc, rates_inh, normalize_exc_weights)
+            # Output rates of shape (B, output_neurons)
+            output_rates = (np.dot(rates_exc, w_exc.T)
+                            - np.dot(rates_inh, w_inh.T))
+            output_rates[output_rates < 0] = 0
+            w_exc += self.synapses['exc'].eta_dt * np.dot(
+                output_rates.T, rates_exc)
+            w_inh += self.synapses['inh'].eta_dt * np.dot(
+                (output_rates - self.target_rate).T, rates_inh)
+            w_exc[w_exc < 0] = 0.
+            w_inh[w_inh < 0] = 0.
+            normalize_exc_weights()
+
+            output_rates_after = (np.dot(rates_exc, w_exc.T)
+                                  - np.dot(rates_inh, w_inh.T))
+            output_rates_after[output_rates_after < 0] = 0
+            norm = np.linalg.norm(output_rates)
+            index = int(np.ceil(steps[batch][-1]
+                                / self.every_nth_step_weights))
+            # Steps after the last stored weights are not monitored
+            if norm > 0 and index < len(self._mini_batch_counts):
+                rawdata['mini_batch_deviation'][index] += (
+                    np.linalg.norm(output_rates_after - output_rates) / norm)
+                self._mini_batch_counts[index] += 1
+            if reference and index < len(self._mini_batch_counts):
+                deviation = np.sqrt(
+                    (np.sum(np.square(w_exc - weights_reference['exc']))
+                     + np.sum(np.square(w_inh - weights_reference['inh'])))
+                    / (np.sum(np.square(weights_reference['exc']))
+                       + np.sum(np.square(weights_reference['inh']))))
+                rawdata['mini_batch_weight_deviation'][index] = max(
+                    rawdata['mini_batch_weight_deviation'][index], deviation)
+
+            for n in batch.start + np.flatnonzero(stored[batch]):
+                self.step = steps[n]
+                self.x, self.y, self.z, self.phi, self.theta = block[n]
+                self.output_rate = output_rates[n - batch.start]
+                self._add_to_rawdata(rawdata, self.step)
+                if self.stop_step:
+                    return
+            self.step = steps[batch.stop - 1]
+            self.x, self.y, self.z, self.phi, self.theta = \
+                block[batch.stop - 1]
+            self.output_rate = output_rates[-1]
+
+    def _replay_mini_batch(self, rates_exc, rates_inh, normalize_exc_weights):
+        """
+        Learns step by step with the input rates of a mini batch
+
+        The weights are restored afterwards.
+
+        Parameters
+        ----------
+        rates_exc, rates_inh : ndarray of shape (B, N)
+            The input rates of the steps of the batch
+        normalize_exc_weights : function
+
+        Returns
+        -------
+        weights : dict
+            The weights after the last step
+        """
+        w_exc = self.synapses['exc'].weights
+        w_inh = self.synapses['inh'].weights
+        initial = {'exc': w_exc.copy(), 'inh': w_inh.copy()}
+        for rate_exc, rate_inh in zip(rates_exc, rates_inh):
+            output_rate = np.dot(w_exc, rate_exc) - np.dot(w_inh, rate_inh)
+            output_rate[output_rate < 0] = 0
+            w_exc += self.synapses['exc'].eta_dt * np.outer(
+                output_rate, rate_exc)
+            w_inh += self.synapses['inh'].eta_dt * np.outer(
+                output_rate - self.target_rate, rate_inh)
+            w_exc[w_exc < 0] = 0.
+            w_inh[w_inh < 0] = 0.
+            normalize_exc_weights()
+        weights = {'exc': w_exc.copy(), 'inh': w_inh.copy()}
+        w_exc[...] = initial['exc']
+        w_inh[...] = initial['inh']
+        return weights
 
     def run(self, rawdata_table=False, configuration_table=False):
         """
@@ -2285,92 +3956,183 @@ class Rat(utils.Utilities):
         move = self.get_move_function()
         self.set_boundary_conditions()
 
-        # Choose the normalization scheme
-        normalize_exc_weights = getattr(self,'normalize_exc_weights_'+self.normalization)
-
-        # Choose the update functions and the output_rate functions
-        set_output_rate = self._get_output_rate_function()
-
-        rawdata = self._prepare_rawdata()
+        run_start = time.perf_counter()
+        sparse_input_rates = getattr(self, 'sparse_input_rates', False)
+        if sparse_input_rates:
+            # Only the inputs that are active at the current position
+            normalize_exc_weights = self._timed(
+                getattr(self,
+                        'normalize_exc_weights_sparse_' + self.normalization),
+                'normalize_exc_weights')
+            set_output_rate = self._timed(self.set_current_output_rate_sparse,
+                                          'output_rate')
+            update_weights = self._timed(self.update_weights_sparse,
+                                         'update_weights')
+            clip_weights = self._timed(self.clip_weights_sparse,
+                                       'clip_weights')
+            add_to_rawdata = self._timed(self._add_to_rawdata_sparse,
+                                         'add_to_rawdata')
+            set_current_input_rates = self._timed(
+                self.set_current_input_rates_sparse, 'input_rates')
+        else:
+            # Choose the normalization scheme
+            normalize_exc_weights = self._timed(
+                getattr(self,'normalize_exc_weights_'+self.normalization),
+                'normalize_exc_weights')
+
+            # Choose the update functions and the output_rate functions
+            set_output_rate = self._timed(self._get_output_rate_function(),
+                                          'output_rate')
+            update_weights = self._timed(self.update_weights,
+                                         'update_weights')
+            clip_weights = self._timed(self.clip_weights, 'clip_weights')
+            add_to_rawdata = self._timed(self._add_to_rawdata,
+                                         'add_to_rawdata')
+            if self.discretize_space:
+                set_current_input_rates = self._timed(
+                    self.set_current_input_rates_from_row, 'input_rates')
+            else:
+                set_current_input_rates = self._timed(
+                    self.set_current_input_rates, 'input_rates')
+        incremental_normalization = (
+            getattr(self, 'incremental_normalization', False)
+            and not sparse_input_rates)
+        if incremental_normalization:
+            # Norms of the weights from the rank-1 update
+            self._check_incremental_normalization()
+            self._exc_weight_segments = self._get_exc_weight_segments()
+            normalize_exc_weights = self._timed(
+                getattr(self, 'normalize_exc_weights_incremental_'
+                        + self.normalization), 'normalize_exc_weights')
+            set_output_rate = self._timed(
+                self.set_current_output_rate_incremental, 'output_rate')
+            update_weights = self._timed(self.update_weights_incremental,
+                                         'update_weights')
+            clip_weights = self._timed(self.clip_weights_incremental,
+                                       'clip_weights')
+            add_to_rawdata = self._timed(self._add_to_rawdata_incremental,
+                                         'add_to_rawdata')
+            set_current_input_rates = self._timed(
+                self.set_current_input_rates_incremental, 'input_rates')
+
+        rawdata = self._timed(self._prepare_rawdata, 'prepare_rawdata')()
 
         if self.lateral_inhibition:
             self.output_rate = 0.
+
+        n_workers = int(getattr(self, 'output_rate_grid_workers', 0))
+        if n_workers:
+            self._output_rate_grid_executor = ThreadPoolExecutor(n_workers)
+            self._output_rate_grid_futures = []
+
+        learning_batch_size = int(getattr(self, 'learning_batch_size', 1))
+        if learning_batch_size > 1:
+            self._check_mini_batch_learning()
+            rawdata['mini_batch_deviation'] = np.zeros(
+                len(rawdata['exc']['weights']))
+            self._mini_batch_counts = np.zeros(
+                len(rawdata['exc']['weights']))
+            if getattr(self, 'mini_batch_reference', False):
+                rawdata['mini_batch_weight_deviation'] = np.zeros(
+                    len(rawdata['exc']['weights']))
         ########################################################################
         ############################ The simulation ############################
         ########################################################################
         # self.eta_factor_inh = self.params['inh']['eta_factor']
-        room_switch_time = self.params['sim']['room_switch_time']
-        boxside_switch_time = self.params['sim']['boxside_switch_time']
-        explore_all_time = self.params['sim']['explore_all_time']
-
-        np.random.seed(self.params['sim']['seed_motion'])
+        self.rng_motion = random_streams.get_rng(
+            self.params['sim']['seed_motion'], 'motion', self.rng_mode)
         self.boxside = self.boxside_initial_side
-        for self.step in self.steps:
-            ###############################################
-            ############### Room switching ###############
-            ###############################################
-            if room_switch_time:
-                if self.step == room_switch_time + 1:
-                    print(('Room switch at step: {0}'.format(self.step)))
-                    self._room_switch()
-
-            if boxside_switch_time:
-                if self.step == boxside_switch_time + 1:
-                    print(('Switch to right side at step: {0}'.format(self.step)))
-                    if self.boxside_initial_side == 'left':
-                        new_side = 'right'
-                        # Place rat in right side of the arena
-                        self.x = self.radius / 2.
-                        self.y = self.radius / 2.
+        trajectory = trajectories.Trajectory(
+            self, move, mode=getattr(self, 'trajectory_mode', 'reproducible'))
+        get_block = self._timed(trajectory.get_block, 'motion')
+        get_input_rates_flat_index = self._timed(
+            self.get_input_rates_flat_index, 'input_rates_index')
+        learn_in_mini_batches = self._timed(self._learn_in_mini_batches,
+                                            'mini_batches')
+        checkpoint_interval = int(getattr(self, 'checkpoint_interval', 0))
+        self.stop_step = None
+        self._n_converged_snapshots = 0
+        last_step = 0
+        if checkpoint_interval and os.path.exists(
+                self._get_checkpoint_path()):
+            last_step = self._load_checkpoint(rawdata, trajectory)
+        for steps in self._get_step_blocks():
+            if steps[-1] <= last_step:
+                continue
+            self._switch_rooms_and_boxsides(steps[0], trajectory)
+            ### Move the rat for the entire block ###
+            block = get_block(steps)
+            if self.discretize_space:
+                rows = get_input_rates_flat_index(block[:, :self.dimensions])
+            if sparse_input_rates:
+                flat_input_rates = self.input_rates_sparse
+                self._apply_exc_weight_scale()
+            elif self.discretize_space:
+                flat_input_rates = self.get_flat_input_rates()
+            if incremental_normalization:
+                self._set_input_rates_norms(flat_input_rates)
+                self._resync_exc_weight_norms()
+            if learning_batch_size > 1:
+                learn_in_mini_batches(steps, block, rows, flat_input_rates,
+                                      normalize_exc_weights, rawdata)
+            else:
+                for n, self.step in enumerate(steps):
+                    self.x, self.y, self.z, self.phi, self.theta = block[n]
+                    if self.discretize_space:
+                        set_current_input_rates(flat_input_rates, rows[n])
                     else:
-                        new_side = 'left'
-                        # Place rat in left side of arena
-                        self.x = - self.radius / 2.
-                        self.y = - self.radius / 2.
-                    self.boxside = new_side
-
-                    # Constrain motion to new side
-                    move = functools.partial(
-                        self.move_persistently_in_half_of_arena,
-                        side=new_side)
-                    # Set input from the other side to 0
-                    for p in self.populations:
-                        # self._cut_off_in_boxside_experiments(p,
-                        # 							current_side=new_side)
-                        if self.boxside_independent_centers:
-                            self._set_inputs_from_other_boxside_to_zero(p,
-                                                        current_side=new_side)
-
-            if explore_all_time:
-                if self.step == explore_all_time + 1:
-                    print(('Switch to full room at step: {0}'.format(self.step)))
-                    move = self.move_persistently
-                    self.input_rates_low_resolution =\
-                        self.input_rates_low_resolution_without_cutoff
-                    self.input_rates = self.input_rates_without_cutoff
-                    self.boxside = 'both'
-
-            ### Move the rat ###
-            move()
-            try:
-                self.apply_boundary_conditions()
-            except AttributeError:
-                pass
-            self.set_current_input_rates()
-            # if self.step > 2e5:
-            # 	inh_eta_factor = self.eta_factor_inh
-            # else:
-            # 	inh_eta_factor = 1
-            set_output_rate(inh_rates_factor=1)
-            # self.update_weights(inh_eta_factor=inh_eta_factor)
-            self.update_weights()
-            self.synapses['exc'].weights[self.synapses['exc'].weights<0] = 0.
-            self.synapses['inh'].weights[self.synapses['inh'].weights<0] = 0.
-
-            normalize_exc_weights()
-
-            self._add_to_rawdata(rawdata, self.step)
-
+                        set_current_input_rates()
+                    # if self.step > 2e5:
+                    # 	inh_eta_factor = self.eta_factor_inh
+                    # else:
+                    # 	inh_eta_factor = 1
+                    set_output_rate(inh_rates_factor=1)
+                    # self.update_weights(inh_eta_factor=inh_eta_factor)
+                    update_weights()
+                    clip_weights()
+
+                    normalize_exc_weights()
+
+                    add_to_rawdata(rawdata, self.step)
+                    if self.stop_step:
+                        break
+
+            if sparse_input_rates:
+                self._apply_exc_weight_scale()
+            if incremental_normalization:
+                self._resync_exc_weight_norms()
+            if self.stop_step:
+                break
+            if checkpoint_interval and steps[-1] % checkpoint_interval == 0:
+                self._collect_output_rate_grids(rawdata)
+                self._timed(self._save_checkpoint, 'checkpoint')(
+                    rawdata, steps[-1])
+
+        if n_workers:
+            self._timed(self._collect_output_rate_grids,
+                        'collect_output_rate_grids')(rawdata)
+            self._output_rate_grid_executor.shutdown()
+            del self._output_rate_grid_executor
+        if learning_batch_size > 1:
+            rawdata['mini_batch_deviation'][1:] /= np.maximum(
+                self._mini_batch_counts[1:], 1)
+            print('Maximal mini batch deviation: {0}'.format(
+                np.amax(rawdata['mini_batch_deviation'])))
+            if 'mini_batch_weight_deviation' in rawdata:
+                print('Maximal mini batch weight deviation: {0}'.format(
+                    np.amax(rawdata['mini_batch_weight_deviation'])))
+        if checkpoint_interval and os.path.exists(
+                self._get_checkpoint_path()):
+            # The simulation is complete, so there is nothing to resume
+            os.remove(self._get_checkpoint_path())
+            self._remove_resumed_rawdata()
         print('Simulation finished')
+        rawdata = self._finish_rawdata(rawdata)
+        if getattr(self, 'early_stopping', ''):
+            self._truncate_rawdata(rawdata, self.stop_step or self.steps[-1])
+        if getattr(self, 'profiler', None):
+            self.profiler.add('run', time.perf_counter() - run_start)
+            self.profiler.print_report()
+            rawdata['profile'] = self.profiler.get_rawdata()
         return rawdata
 
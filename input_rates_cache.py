@@ -0,0 +1,278 @@
+import os
+import errno
+import shutil
+import getpass
+import hashlib
+import tempfile
+import contextlib
+import numpy as np
+try:
+    import fcntl
+except ImportError:
+    # Without file locks concurrent workers might create the same
+    # entry twice, but only one of them is kept.
+    fcntl = None
+
+# Increase if the content of the entries changes
+VERSION = 1
+
+
+def get_shared_memory_directory():
+    """
+    Returns a cache directory in shared memory
+
+    On Linux /dev/shm is a file system in memory, so the entries are
+    shared memory segments of all processes on a node. Elsewhere the
+    temporary directory of the system is used.
+    """
+    directory = '/dev/shm' if os.path.isdir('/dev/shm') \
+        else tempfile.gettempdir()
+    return os.path.join(directory,
+                        'input_rates_cache_{0}'.format(getpass.getuser()))
+
+
+def get_key(*objects):
+    """
+    Returns a hash of nested dictionaries, lists, arrays and scalars
+
+    Dictionaries are hashed in the order of their sorted keys and arrays
+    with their dtype and shape, so that equal parameters always give the
+    same key.
+
+    Returns
+    -------
+    key : str
+        Hexadecimal SHA-256 hash
+    """
+    h = hashlib.sha256()
+
+    def update(obj):
+        if isinstance(obj, dict):
+            h.update(b'{')
+            for k in sorted(obj, key=str):
+                update(k)
+                update(obj[k])
+            h.update(b'}')
+        elif isinstance(obj, (list, tuple)):
+            h.update(b'[')
+            for item in obj:
+                update(item)
+            h.update(b']')
+        elif isinstance(obj, np.ndarray):
+            h.update('array{0}{1}'.format(obj.dtype.str, obj.shape).encode())
+            h.update(np.ascontiguousarray(obj).tobytes())
+        else:
+            h.update('{0}:{1!r}'.format(type(obj).__name__, obj).encode())
+        h.update(b';')
+
+    update(VERSION)
+    for obj in objects:
+        update(obj)
+    return h.hexdigest()
+
+
+class InputRatesCache:
+    """
+    Content addressed cache of input rates tables on disk
+
+    Each entry is a directory with one .npy file per array. Entries are
+    written to a temporary directory and renamed when they are complete,
+    so that an entry that exists is always complete. Entries are opened
+    as read only memory maps, so workers that use the same entry share
+    its memory through the page cache of the operating system.
+
+    If the entries are larger than `max_size` in total, the least
+    recently used entries are removed. Arrays of removed entries that
+    are still open remain valid.
+
+    Processes that use an entry `attach` to it. The number of attached
+    processes is counted by the operating system with shared file
+    locks, which are also released if a process crashes. Entries in
+    use are not evicted and `remove_unused` removes all others, e.g.
+    after a parameter sweep.
+
+    Parameters
+    ----------
+    directory : str
+    max_size : float
+        Maximal size of all entries in bytes
+    """
+    def __init__(self, directory, max_size=1e10):
+        if not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_size = max_size
+
+    def _get_path(self, key):
+        return os.path.join(self.directory, key)
+
+    @contextlib.contextmanager
+    def lock(self, key):
+        """
+        Context manager that holds an exclusive lock on the entry `key`
+
+        Workers that need the same entry wait until the first one has
+        created it, instead of creating it again.
+        """
+        if fcntl is None:
+            yield
+            return
+        with open(self._get_path(key) + '.lock', 'w') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    @contextlib.contextmanager
+    def try_lock(self, key):
+        """
+        Like `lock`, but yields False instead of waiting if it is held
+        """
+        if fcntl is None:
+            yield True
+            return
+        with open(self._get_path(key) + '.lock', 'w') as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EACCES):
+                    yield False
+                    return
+                raise
+            try:
+                yield True
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def attach(self, key):
+        """
+        Marks the entry `key` as used until the returned file is closed
+
+        Returns
+        -------
+        f : file or None
+            Keep it open as long as the arrays of the entry are used
+        """
+        if fcntl is None:
+            return None
+        f = open(self._get_path(key) + '.users', 'w')
+        fcntl.flock(f, fcntl.LOCK_SH)
+        return f
+
+    def is_used(self, key):
+        """
+        True if any process is attached to the entry `key`
+        """
+        if fcntl is None:
+            return False
+        with open(self._get_path(key) + '.users', 'w') as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EACCES):
+                    return True
+                raise
+            fcntl.flock(f, fcntl.LOCK_UN)
+        return False
+
+    def load(self, key):
+        """
+        Returns the arrays of an entry or None if it does not exist
+
+        Returns
+        -------
+        arrays : dict or None
+            Read only memory mapped arrays by name
+        """
+        path = self._get_path(key)
+        if not os.path.isdir(path):
+            return None
+        # The modification time marks the last use
+        os.utime(path)
+        return {name[:-len('.npy')]: np.load(os.path.join(path, name),
+                                             mmap_mode='r')
+                for name in os.listdir(path) if name.endswith('.npy')}
+
+    def store(self, key, arrays):
+        """
+        Stores arrays as entry `key` and removes old entries if necessary
+
+        Parameters
+        ----------
+        key : str
+        arrays : dict
+            Arrays by name
+        """
+        path = self._get_path(key)
+        tmp_path = tempfile.mkdtemp(prefix=key + '.tmp', dir=self.directory)
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_path, name + '.npy'), array)
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # Another worker has stored the same entry
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        self.evict(keep=key)
+
+    def get_entries(self):
+        """
+        Returns the entries as list of (last use, size in bytes, key)
+        """
+        entries = []
+        for key in os.listdir(self.directory):
+            path = self._get_path(key)
+            if '.' in key or not os.path.isdir(path):
+                continue
+            size = sum(os.path.getsize(os.path.join(path, name))
+                       for name in os.listdir(path))
+            entries.append((os.path.getmtime(path), size, key))
+        return entries
+
+    def evict(self, keep=None):
+        """
+        Removes the least recently used entries until they fit `max_size`
+
+        Entries that are locked, e.g. because another worker is loading
+        them, are skipped instead of waiting for them.
+
+        Parameters
+        ----------
+        keep : str or None
+            Key of an entry that is never removed, e.g. the one in use
+        """
+        entries = sorted(self.get_entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total <= self.max_size:
+                break
+            if key == keep:
+                continue
+            with self.try_lock(key) as locked:
+                if not locked or self.is_used(key):
+                    continue
+                shutil.rmtree(self._get_path(key), ignore_errors=True)
+            total -= size
+
+    def remove_unused(self):
+        """
+        Removes all entries that no process is attached to
+
+        Returns
+        -------
+        n : int
+            Number of removed entries
+        """
+        n = 0
+        for _, _, key in self.get_entries():
+            with self.lock(key):
+                if self.is_used(key):
+                    continue
+                shutil.rmtree(self._get_path(key), ignore_errors=True)
+                for suffix in ['.users', '.lock']:
+                    try:
+                        os.remove(self._get_path(key) + suffix)
+                    except OSError:
+                        pass
+            n += 1
+        return n
@@ -77,10 +77,121 @@ params_1d_place2grid = {
             'persistence_length': 1,
             # Type of motion
             'motion': 'persistent',
+            # 'reproducible': Move step by step, such that the trajectory
+            # is determined by 'seed_motion'
+            # 'vectorized': Draw the trajectory for many steps at once.
+            # Statistically equivalent, but not the identical trajectory.
+            'trajectory_mode': 'reproducible',
+            # Number of steps for which the trajectory is created at once
+            'trajectory_block_size': 1e5,
+            # Number of time steps whose weight changes are summed and
+            # applied at once. 1 corresponds to learning in every step.
+            # See rawdata['mini_batch_deviation'] for an estimate of the
+            # resulting error.
+            'learning_batch_size': 1,
+            # If True, each mini batch is replayed step by step to store
+            # the deviation of the weights in
+            # rawdata['mini_batch_weight_deviation']. As slow as
+            # learning step by step.
+            'mini_batch_reference': False,
+            # 'stochastic': Simulation of the moving rat (Rat.run)
+            # 'averaged': Integrate the weight dynamics averaged over the
+            # occupancy (averaged_dynamics.AveragedRat)
+            'engine': 'stochastic',
+            # Occupancy for the averaged dynamics: 'uniform' or
+            # 'sargolini_data'
+            'averaged_occupancy': 'uniform',
+            # 'rectified' or 'linear' output rates in the averaged dynamics
+            'averaged_mode': 'rectified',
+            # Integration time step of the averaged dynamics in units of
+            # simulation steps
+            'averaged_time_step': 100,
+            # Write the large rawdata arrays to disk during the simulation,
+            # instead of keeping them in memory. See rawdata_store.py
+            'stream_rawdata': False,
+            # Directory for the streamed rawdata. Empty string: the
+            # temporary directory of the system.
+            'rawdata_directory': '',
+            # Store a checkpoint every n steps (0: no checkpoints). If a
+            # checkpoint of the same parameters exists in
+            # 'checkpoint_directory', the simulation resumes from it. It
+            # is deleted after the simulation.
+            'checkpoint_interval': 0,
+            # Empty string: the current working directory
+            'checkpoint_directory': '',
+            # Number of threads that compute the output_rate_grid in the
+            # background (0: computed in the simulation loop)
+            'output_rate_grid_workers': 0,
+            # Stop the simulation if the weights don't change anymore
+            # '': No early stopping
+            # 'weight_change': Relative squared change of the exc. weights
+            # 'rate_map_correlation': 1 - correlation of the rate maps
+            # The measure is evaluated at each weight snapshot and compared
+            # with the previous one. The rawdata is truncated at the stop
+            # and the stop step is stored in rawdata['stop_step'].
+            'early_stopping': '',
+            'early_stopping_threshold': 1e-2,
+            # Number of consecutive snapshots below the threshold
+            'early_stopping_patience': 3,
+            # Measure the time spent in each phase of the simulation. The
+            # result is stored in rawdata['profile']. See profiling.py
+            'profile': False,
             # Whether or not input tuning is gaussian random field
             'gaussian_process': False,
             # How to rescale the Gaussian random fields
             'gaussian_process_rescale': 'fixed_mean',
+            # 'batched': All Gaussian random fields in few FFTs
+            # 'loop': One field after the other (same random numbers)
+            'gaussian_process_mode': 'batched',
+            # Number of Gaussian random fields per FFT in 'batched' mode
+            'gaussian_process_batch_size': 32,
+            # Floating point type of the input rates, weights and rates,
+            # 'float64' or 'float32'. Use tests/precision.py to validate
+            # single precision against double precision.
+            'dtype': 'float64',
+            # 'legacy': All random numbers from the global random state of
+            # numpy, seeded as in older versions, i.e. identical results.
+            # 'streams': An independent numpy.random.Generator for each
+            # component (centers, sigmas, weights, motion, ...), derived
+            # from its seed. See random_streams.py.
+            'rng_mode': 'legacy',
+            # Store only the input rates above the tolerance, as sparse
+            # matrix. Output rate, weight update and normalization then
+            # only use the inputs that are active at the current position.
+            'sparse_input_rates': False,
+            # Rates below this value are set to zero in the sparse tables
+            'sparse_input_rates_tolerance': 1e-6,
+            # Keep the sum and squared sum of the excitatory weights up to
+            # date from the rank-1 weight update, instead of computing them
+            # from all weights in each normalization step. The weights are
+            # multiplied with the normalization factor only when they are
+            # stored. Faster for many inputs (~1e5), slower for few.
+            'incremental_normalization': False,
+            # Steps after which these sums are computed anew from the weights
+            'normalization_resync_interval': 1000,
+            # Directory of the cache of input rates tables, shared by all
+            # simulations that only differ in parameters that do not
+            # change the input rates, e.g. 'seed_motion' or 'eta'. See
+            # input_rates_cache.py. Empty string: no cache
+            'input_rates_cache': '',
+            # Maximal size of the cache in bytes
+            'input_rates_cache_size': 1e10,
+            # If True and no 'input_rates_cache' is given, the cache is in
+            # shared memory (/dev/shm), so that all simulations on a node
+            # use a single copy of each input rates table
+            'input_rates_shared_memory': False,
+            # Directory of the consolidated trajectories of the
+            # 'sargolini_data' motion, see trajectory_store.py.
+            # Empty string: data/trajectory_store
+            'trajectory_store': '',
+            # Duration of one recorded frame of the 'sargolini_data' motion
+            # in the units of 'dt'. The recording has 50 frames per second,
+            # i.e. 0.02 if the time is measured in seconds. The trajectory
+            # is resampled to 'dt' by decimation or linear interpolation.
+            # 0: One recorded frame per time step, whatever 'dt' is.
+            'trajectory_frame_dt': 0,
+            # The recorded trajectory is traversed this many times faster
+            'trajectory_speed_factor': 1.0,
             # Resolution of space discretization
             'input_space_resolution': input_space_resolution,
             #################################################
@@ -155,6 +266,10 @@ params_1d_place2grid = {
             'weight_lateral': 0.0,
             # Neural time constant (for the recurrent system only)
             'tau': 10.,
+            # How the output_rate_grid is obtained with lateral inhibition
+            # 'vectorized': Integrate all positions simultaneously
+            # 'walk': Integrate position by position (slow)
+            'lateral_inhibition_solver': 'vectorized',
         },
     'out':
         {
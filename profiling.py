@@ -0,0 +1,65 @@
+import time
+import numpy as np
+
+
+class Profile:
+    """
+    Cumulative wall time and number of calls of the phases of a simulation
+
+    Functions are timed by wrapping them with `wrap`, so that there is
+    no overhead if the profiling is switched off.
+
+    Example
+    -------
+    profile = Profile()
+    update_weights = profile.wrap(rat.update_weights, 'update_weights')
+    """
+    def __init__(self):
+        self.time = {}
+        self.calls = {}
+
+    def add(self, phase, duration, calls=1):
+        """
+        Add the duration of `calls` calls to a phase
+        """
+        self.time[phase] = self.time.get(phase, 0.) + duration
+        self.calls[phase] = self.calls.get(phase, 0) + calls
+
+    def wrap(self, function, phase):
+        """
+        Returns the function, such that each call is added to `phase`
+        """
+        def timed_function(*args, **kwargs):
+            start = time.perf_counter()
+            ret = function(*args, **kwargs)
+            self.add(phase, time.perf_counter() - start)
+            return ret
+        return timed_function
+
+    def get_rawdata(self):
+        """
+        Returns the profile as nested dictionary with arrays as leaves
+
+        For each phase the total time in seconds and the number of calls.
+        """
+        return {phase: {'time': np.array([self.time[phase]]),
+                        'calls': np.array([self.calls[phase]])}
+                for phase in self.time}
+
+    def print_report(self):
+        """
+        Prints the phases sorted by time
+
+        The percentages are relative to the sum of the phases 'init' and
+        'run', if they exist.
+        """
+        total = self.time.get('init', 0.) + self.time.get('run', 0.)
+        if not total:
+            total = sum(self.time.values())
+        print('{0:<25}{1:>12}{2:>12}{3:>14}{4:>8}'.format(
+            'Phase', 'Time [s]', 'Calls', 'Per call [s]', '%'))
+        for phase in sorted(self.time, key=self.time.get, reverse=True):
+            print('{0:<25}{1:>12.3f}{2:>12d}{3:>14.2e}{4:>8.1f}'.format(
+                phase, self.time[phase], self.calls[phase],
+                self.time[phase] / max(self.calls[phase], 1),
+                100 * self.time[phase] / max(total, 1e-300)))
@@ -0,0 +1,94 @@
+"""
+Random number streams of the simulation components
+
+Each component that draws random numbers (centers, sigmas, initial
+weights, motion, ...) gets its generator from `get_rng`.
+
+In mode 'legacy' all components share the global random state of
+numpy, which is seeded at the same points as in older versions, so the
+results are identical to those versions. Running several simulations
+in one process, e.g. in RatEnsemble, then requires exchanging the
+global state between them.
+
+In mode 'streams' each component has its own numpy.random.Generator.
+Its seed sequence is made of the seed of the component, e.g.
+'seed_motion', and the identifier of the component, so that streams
+are independent of each other and of the order in which they are
+used. Different replicas are distinguished by their seeds.
+"""
+import sys
+import numpy as np
+
+# Identifiers of the components in the seed sequences. Never change
+# them, because this would change the random numbers.
+COMPONENTS = {
+    'centers': 0,
+    'gaussian_process': 1,
+    'sigmas': 2,
+    'init_weights': 3,
+    'initial_direction': 4,
+    'trajectory_order': 5,
+    'motion': 6,
+}
+
+
+def get_rng(seed, component, mode='legacy', legacy_seed=True):
+    """
+    Returns the random number generator of a component
+
+    The generators of both modes provide the methods `random`,
+    `standard_normal`, `uniform`, `normal`, `gamma`, `permutation` and
+    `choice`. For integers use `get_integers`.
+
+    Parameters
+    ----------
+    seed : int
+    component : str
+        Key of COMPONENTS
+    mode : str
+        'legacy' or 'streams'
+    legacy_seed : bool
+        In mode 'legacy' the global state is only seeded if True. False
+        for components that continued the stream of the previous
+        component in older versions.
+
+    Returns
+    -------
+    rng : numpy.random module or numpy.random.Generator
+    """
+    if mode == 'legacy':
+        if legacy_seed:
+            np.random.seed(int(seed))
+        return np.random
+    elif mode == 'streams':
+        return np.random.default_rng(np.random.SeedSequence(
+            int(seed), spawn_key=(COMPONENTS[component],)))
+    sys.exit('ERROR: Random number mode {0} is not defined'.format(mode))
+
+
+def get_integers(rng, low, high, size=None):
+    """
+    Random integers in [low, high) from either kind of generator
+    """
+    if isinstance(rng, np.random.Generator):
+        return rng.integers(low, high, size)
+    return rng.randint(low, high, size)
+
+
+def get_state(rng):
+    """
+    Returns the state of a generator, e.g. for checkpoints
+    """
+    if isinstance(rng, np.random.Generator):
+        return rng.bit_generator.state
+    return rng.get_state()
+
+
+def set_state(rng, state):
+    """
+    Sets the state of a generator, see `get_state`
+    """
+    if isinstance(rng, np.random.Generator):
+        rng.bit_generator.state = state
+    else:
+        rng.set_state(state)
@@ -0,0 +1,80 @@
+import os
+import tempfile
+import numpy as np
+
+
+def get_path(directory, name):
+    """
+    Returns the path of the array `name` in the store `directory`
+    """
+    return os.path.join(directory, name.replace('/', '__') + '.npy')
+
+
+class RawdataStore:
+    """
+    Stores the large rawdata arrays on disk while they are written
+
+    Each array is a memory mapped .npy file. Snapshots that are written
+    into it are flushed to disk by the operating system, so the memory
+    of a simulation does not grow with the number of snapshots.
+    After `finish` the arrays are opened read only, so that the rawdata
+    can be used like the in memory rawdata. The data is only read from
+    disk when it is accessed.
+
+    The files are not deleted automatically.
+
+    Parameters
+    ----------
+    directory : str or None
+        The files are stored in a new unique subdirectory of `directory`.
+        If None, the temporary directory of the system is used.
+    """
+    def __init__(self, directory=None):
+        if directory is not None and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.directory = tempfile.mkdtemp(prefix='rawdata_', dir=directory)
+        self.arrays = {}
+
+    def empty(self, shape, name, dtype=np.float64):
+        """
+        Returns an uninitialized array on disk, like np.empty
+
+        Parameters
+        ----------
+        shape : tuple
+        name : str
+            Unique name of the array, e.g. 'exc/weights'
+        dtype : numpy dtype
+
+        Returns
+        -------
+        array : np.memmap
+        """
+        path = get_path(self.directory, name)
+        array = np.lib.format.open_memmap(path, mode='w+',
+                                          dtype=dtype, shape=shape)
+        self.arrays[name] = path
+        return array
+
+    def finish(self, rawdata):
+        """
+        Flushes all arrays and replaces them by read only arrays
+
+        Parameters
+        ----------
+        rawdata : dict
+            Nested rawdata dictionary that contains the arrays of this
+            store at the location given by their name
+
+        Returns
+        -------
+        rawdata : dict
+        """
+        for name, path in self.arrays.items():
+            keys = name.split('/')
+            d = rawdata
+            for key in keys[:-1]:
+                d = d[key]
+            d[keys[-1]].flush()
+            d[keys[-1]] = np.load(path, mmap_mode='r')
+        return rawdata
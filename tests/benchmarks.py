@@ -0,0 +1,373 @@
+"""
+Benchmarks of the simulation, input generation and analysis hot paths
+
+The results are stored as JSON together with information about the
+machine and the git commit, so that the timings of different commits
+can be compared.
+
+Usage
+-----
+python -m learning_grids.tests.benchmarks --output benchmarks.json
+python -m learning_grids.tests.benchmarks --compare old.json new.json
+"""
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import subprocess
+import traceback
+import numpy as np
+import scipy
+from learning_grids import initialization
+from learning_grids import parameters
+from learning_grids import trajectories
+
+PARAMETER_SETS = ['params_test', 'params_test_2d',
+                  'params_1d_non_localized2grid', 'params_2d_place2grid']
+
+
+def get_machine_info():
+    """
+    Returns information on the machine, the software and the git commit
+    """
+    directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        commit = subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=directory,
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'node': platform.node(),
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'scipy': scipy.__version__,
+    }
+
+
+def time_function(function, repeat=3):
+    """
+    Returns the wall times of `repeat` calls of `function`
+
+    Parameters
+    ----------
+    function : callable
+        Function without arguments. It should return its own timing
+        information as dictionary or None. If the dictionary contains
+        'duration', this time is used instead of the wall time of the
+        call, so that a setup in the function is not timed.
+    repeat : int
+
+    Returns
+    -------
+    result : dict
+        'min', 'median' and 'times' in seconds. If `function`
+        returns a dictionary, the entries of its last call are added.
+    """
+    times = []
+    extra = None
+    for _ in np.arange(repeat):
+        start = time.perf_counter()
+        extra = function()
+        duration = time.perf_counter() - start
+        if extra and 'duration' in extra:
+            duration = extra.pop('duration')
+        times.append(duration)
+    result = {'min': min(times), 'median': float(np.median(times)),
+              'times': times}
+    if extra:
+        result.update(extra)
+    return result
+
+
+def get_params(name, simulation_time):
+    """
+    Returns the parameter set `name` for a run of `simulation_time` steps
+
+    Only a single snapshot is stored at the end.
+    """
+    return parameters.modify_parameters(
+        getattr(parameters, name),
+        [
+            ('sim', 'simulation_time', simulation_time),
+            ('sim', 'every_nth_step', simulation_time),
+            ('sim', 'every_nth_step_weights', simulation_time),
+        ])
+
+
+def benchmark_rat_init(name):
+    """
+    Construction of the Rat, dominated by the input rates tables
+    """
+    params = get_params(name, 1)
+
+    def init():
+        np.random.seed(0)
+        initialization.Rat(params)
+    return init
+
+
+def benchmark_rat_run(name, steps):
+    """
+    Steps per second of Rat.run, without the construction
+    """
+    params = get_params(name, steps)
+
+    def run():
+        np.random.seed(0)
+        rat = initialization.Rat(params)
+        start = time.perf_counter()
+        rat.run()
+        duration = time.perf_counter() - start
+        # Only the run is timed, see `time_function`
+        return {'duration': duration, 'steps_per_second': steps / duration}
+    return run
+
+
+def benchmark_sargolini_trajectory(steps, step_by_step=False):
+    """
+    Trajectory of recorded positions, looked up in blocks or every step
+
+    The lookup in every step is used for the head direction in 3D.
+    """
+    params = get_params('params_test_2d', steps)
+    np.random.seed(0)
+    rat = initialization.Rat(params)
+    move = rat.get_move_function()
+    trajectory = trajectories.Trajectory(rat, move)
+
+    def sargolini_trajectory():
+        if step_by_step:
+            for rat.step in rat.steps:
+                move()
+        else:
+            trajectory.get_block(rat.steps)
+    return sargolini_trajectory
+
+
+def get_gaussian_process_arguments(dimensions):
+    """
+    Returns radius, sigma and linspace of the 1D or 2D parameters
+    """
+    name = ('params_1d_non_localized2grid' if dimensions == 1
+            else 'params_2d_place2grid')
+    params = getattr(parameters, name)
+    radius = params['sim']['radius']
+    sigma = params['exc']['sigma'][:dimensions]
+    resolution = params['sim']['input_space_resolution'][0]
+    linspace = np.arange(-1.1 * radius, 1.1 * radius + resolution,
+                         resolution)
+    if dimensions == 1:
+        sigma = sigma[0]
+    return radius, sigma, linspace
+
+
+def benchmark_gaussian_process(dimensions):
+    """
+    A single Gaussian random field input of the 1D or 2D parameters
+    """
+    radius, sigma, linspace = get_gaussian_process_arguments(dimensions)
+
+    def gaussian_process():
+        np.random.seed(0)
+        initialization.get_gaussian_process(radius, sigma, linspace,
+                                            dimensions=dimensions)
+    return gaussian_process
+
+
+def benchmark_gaussian_processes(dimensions, n=64):
+    """
+    `n` Gaussian random field inputs created at once
+    """
+    radius, sigma, linspace = get_gaussian_process_arguments(dimensions)
+
+    def gaussian_processes():
+        np.random.seed(0)
+        initialization.get_gaussian_processes(radius, sigma, linspace, n,
+                                              dimensions=dimensions)
+    return gaussian_processes
+
+
+def benchmark_rates_function(name):
+    """
+    Input rates of all excitatory synapses on the output rate grid
+    """
+    np.random.seed(0)
+    rat = initialization.Rat(get_params(name, 1))
+    synapses = rat.synapses['exc']
+    positions = rat.positions_grid
+
+    def rates_function():
+        synapses.get_rates_function(positions, data=False)(positions)
+    return rates_function
+
+
+def get_plot(name, steps):
+    """
+    Plot instance with the rawdata of a short 2D simulation
+    """
+    from learning_grids import plotting
+    params = get_params(name, steps)
+    np.random.seed(0)
+    rawdata = initialization.Rat(params).run()
+    return plotting.Plot(params=params, rawdata=rawdata)
+
+
+def benchmark_correlogram(plot, time):
+    def correlogram():
+        plot.get_correlogram(time, mode='same', from_file=True,
+                             n_cumulative=1)
+    return correlogram
+
+
+def benchmark_grid_score(plot, time):
+    def grid_score():
+        plot.get_grid_score(time, method='langston', from_file=True)
+    return grid_score
+
+
+def get_benchmarks(steps):
+    """
+    Returns the benchmarks as list of (name, setup)
+
+    The setup returns the function that is timed. Setups are only called
+    when the benchmark is run, so that expensive preparations are not
+    timed and errors are attributed to a single benchmark.
+    """
+    benchmarks = []
+    for name in PARAMETER_SETS:
+        benchmarks.append(('rat_init/' + name,
+                           lambda name=name: benchmark_rat_init(name)))
+    for name in PARAMETER_SETS:
+        benchmarks.append(('rat_run/' + name,
+                           lambda name=name: benchmark_rat_run(name, steps)))
+    benchmarks.append(('sargolini_trajectory/block',
+                       lambda: benchmark_sargolini_trajectory(steps)))
+    benchmarks.append(('sargolini_trajectory/step_by_step',
+                       lambda: benchmark_sargolini_trajectory(steps, True)))
+    for dimensions in [1, 2]:
+        benchmarks.append(
+            ('gaussian_process/{0}d'.format(dimensions),
+             lambda d=dimensions: benchmark_gaussian_process(d)))
+        benchmarks.append(
+            ('gaussian_processes_64/{0}d'.format(dimensions),
+             lambda d=dimensions: benchmark_gaussian_processes(d)))
+    for name in ['params_test_2d', 'params_2d_place2grid']:
+        benchmarks.append(('rates_function/' + name,
+                           lambda name=name: benchmark_rates_function(name)))
+    plot = {}
+
+    def analysis(benchmark):
+        if 'plot' not in plot:
+            plot['plot'] = get_plot('params_2d_place2grid', steps)
+        return benchmark(plot['plot'], steps)
+    benchmarks.append(('correlogram/params_2d_place2grid',
+                       lambda: analysis(benchmark_correlogram)))
+    benchmarks.append(('grid_score/params_2d_place2grid',
+                       lambda: analysis(benchmark_grid_score)))
+    return benchmarks
+
+
+def run_benchmarks(steps=2000, repeat=3, select=None):
+    """
+    Runs all benchmarks
+
+    A benchmark that fails, e.g. because an optional dependency is
+    missing, is stored with its error message instead of its timing.
+
+    Parameters
+    ----------
+    steps : int
+        Number of simulation steps of the runs
+    repeat : int
+        Number of timed calls of each benchmark
+    select : str or None
+        If given, only the benchmarks whose name contains `select` are run
+
+    Returns
+    -------
+    results : dict
+        'machine', 'settings' and 'benchmarks'
+    """
+    results = {'machine': get_machine_info(),
+               'settings': {'steps': steps, 'repeat': repeat},
+               'benchmarks': {}}
+    for name, setup in get_benchmarks(steps):
+        if select and select not in name:
+            continue
+        print('Benchmark: {0}'.format(name))
+        try:
+            result = time_function(setup(), repeat=repeat)
+        except Exception as e:
+            traceback.print_exc()
+            result = {'error': '{0}: {1}'.format(type(e).__name__, e)}
+        results['benchmarks'][name] = result
+    return results
+
+
+def compare(old, new, tolerance=0.1):
+    """
+    Prints the relative change of the minimal time of each benchmark
+
+    Changes larger than `tolerance` are marked.
+
+    Parameters
+    ----------
+    old, new : dict
+        Results as returned by `run_benchmarks`
+    tolerance : float
+        Relative change of the time that is flagged as regression or
+        improvement
+
+    Returns
+    -------
+    regressions : list of str
+        Names of the benchmarks that got slower by more than `tolerance`
+    """
+    regressions = []
+    print('{0:<45}{1:>12}{2:>12}{3:>10}'.format(
+        'Benchmark', 'Old [s]', 'New [s]', 'Change'))
+    for name in sorted(set(old['benchmarks']) | set(new['benchmarks'])):
+        old_time = old['benchmarks'].get(name, {}).get('min')
+        new_time = new['benchmarks'].get(name, {}).get('min')
+        if old_time is None or new_time is None:
+            print('{0:<45}{1:>12}{2:>12}'.format(
+                name, str(old_time), str(new_time)))
+            continue
+        change = new_time / old_time - 1
+        flag = ''
+        if change > tolerance:
+            flag = ' slower'
+            regressions.append(name)
+        elif change < -tolerance:
+            flag = ' faster'
+        print('{0:<45}{1:>12.4f}{2:>12.4f}{3:>+10.1%}{4}'.format(
+            name, old_time, new_time, change, flag))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--output', default='benchmarks.json')
+    parser.add_argument('--steps', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--select', default=None)
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'))
+    args = parser.parse_args()
+    if args.compare:
+        with open(args.compare[0]) as f:
+            old = json.load(f)
+        with open(args.compare[1]) as f:
+            new = json.load(f)
+        sys.exit(1 if compare(old, new) else 0)
+    results = run_benchmarks(args.steps, args.repeat, args.select)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print('Benchmarks stored in {0}'.format(args.output))
@@ -0,0 +1,139 @@
+"""
+Validation of reduced precision simulations against double precision
+
+Each parameter set is simulated with 'dtype' float64 and with the
+reduced precision. The final rate maps, weights and grid scores are
+compared. The results are stored as JSON.
+
+Usage
+-----
+python -m learning_grids.tests.precision --dtype float32
+"""
+import sys
+import json
+import argparse
+import traceback
+import numpy as np
+from learning_grids import initialization
+from learning_grids import parameters
+from learning_grids.tests import benchmarks
+
+PARAMETER_SETS = ['params_1d_place2grid', 'params_1d_non_localized2grid',
+                  'params_2d_place2grid']
+# Maximal deviations that are accepted
+TOLERANCES = {
+    'rate_map_decorrelation': 1e-3,
+    'rate_map_relative_difference': 1e-2,
+    'grid_score_difference': 5e-2,
+}
+
+
+def run(name, steps, dtype, seed=0):
+    """
+    Returns params and rawdata of a simulation with the given dtype
+    """
+    params = parameters.modify_parameters(
+        benchmarks.get_params(name, steps),
+        [('sim', 'dtype', dtype)])
+    np.random.seed(seed)
+    return params, initialization.Rat(params).run()
+
+
+def get_grid_score(params, rawdata, steps):
+    """
+    Returns the grid score of the final rate map of a 2D simulation
+    """
+    from learning_grids import plotting
+    plot = plotting.Plot(params=params, rawdata=rawdata)
+    return float(plot.get_grid_score(steps, method='langston',
+                                     from_file=True))
+
+
+def compare(name, steps, dtype):
+    """
+    Compares the final state of a simulation in `dtype` and in float64
+
+    Returns
+    -------
+    result : dict
+        'rate_map_decorrelation': 1 - correlation of the rate maps
+        'rate_map_relative_difference': maximal difference of the rate
+            maps relative to the maximal rate
+        'weights_relative_difference': same for the excitatory weights
+        'grid_score_float64', 'grid_score', 'grid_score_difference': in 2D
+    """
+    params, rawdata_64 = run(name, steps, 'float64')
+    _, rawdata = run(name, steps, dtype)
+    rate_map_64 = rawdata_64['output_rate_grid'][-1].astype(np.float64)
+    rate_map = rawdata['output_rate_grid'][-1].astype(np.float64)
+    weights_64 = rawdata_64['exc']['weights'][-1]
+    weights = rawdata['exc']['weights'][-1].astype(np.float64)
+    result = {
+        'rate_map_decorrelation': float(
+            1 - np.corrcoef(rate_map_64.ravel(), rate_map.ravel())[0, 1]),
+        'rate_map_relative_difference': float(
+            np.amax(np.abs(rate_map - rate_map_64))
+            / np.amax(np.abs(rate_map_64))),
+        'weights_relative_difference': float(
+            np.amax(np.abs(weights - weights_64))
+            / np.amax(np.abs(weights_64))),
+    }
+    if params['sim']['dimensions'] == 2:
+        try:
+            result['grid_score_float64'] = get_grid_score(params, rawdata_64,
+                                                          steps)
+            result['grid_score'] = get_grid_score(params, rawdata, steps)
+            result['grid_score_difference'] = abs(
+                result['grid_score'] - result['grid_score_float64'])
+        except Exception as e:
+            traceback.print_exc()
+            result['grid_score_error'] = '{0}: {1}'.format(
+                type(e).__name__, e)
+    return result
+
+
+def validate(steps=20000, dtype='float32', select=None):
+    """
+    Compares all parameter sets and checks the tolerances
+
+    Returns
+    -------
+    results : dict
+        'machine', 'settings' and the comparison of each parameter set
+    failures : list of str
+        Parameter sets and measures that exceed `TOLERANCES`
+    """
+    results = {'machine': benchmarks.get_machine_info(),
+               'settings': {'steps': steps, 'dtype': dtype},
+               'comparisons': {}}
+    failures = []
+    for name in PARAMETER_SETS:
+        if select and select not in name:
+            continue
+        print('Validation: {0}'.format(name))
+        result = compare(name, steps, dtype)
+        results['comparisons'][name] = result
+        for measure, tolerance in TOLERANCES.items():
+            if result.get(measure, 0) > tolerance:
+                failures.append('{0}/{1}'.format(name, measure))
+    return results, failures
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--output', default='precision.json')
+    parser.add_argument('--steps', type=int, default=20000)
+    parser.add_argument('--dtype', default='float32')
+    parser.add_argument('--select', default=None)
+    args = parser.parse_args()
+    results, failures = validate(args.steps, args.dtype, args.select)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    for name, result in results['comparisons'].items():
+        print(name)
+        for measure, value in sorted(result.items()):
+            print('    {0:<32}{1}'.format(measure, value))
+    if failures:
+        print('Exceeded tolerances: ' + ', '.join(failures))
+    print('Results stored in {0}'.format(args.output))
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,53 @@
+import unittest
+import numpy as np
+from learning_grids import initialization
+from learning_grids import averaged_dynamics
+from learning_grids import parameters
+
+
+class TestAveragedDynamics(unittest.TestCase):
+
+    def setUp(self):
+        self.params = parameters.modify_parameters(
+            parameters.params_1d_place2grid,
+            [
+                ('sim', 'simulation_time', 4000),
+                ('sim', 'every_nth_step', 1000),
+                ('sim', 'every_nth_step_weights', 1000),
+                ('sim', 'spacing', 11),
+            ])
+
+    def test_rawdata_layout(self):
+        rawdata = initialization.Rat(self.params).run()
+        rawdata_averaged = averaged_dynamics.AveragedRat(self.params).run()
+        for key in ['positions', 'output_rates', 'output_rate_grid']:
+            self.assertEqual(rawdata[key].shape,
+                             rawdata_averaged[key].shape)
+        for p in ['exc', 'inh']:
+            self.assertEqual(rawdata[p]['weights'].shape,
+                             rawdata_averaged[p]['weights'].shape)
+            # Same initial weights
+            np.testing.assert_array_equal(rawdata[p]['weights'][0],
+                                          rawdata_averaged[p]['weights'][0])
+        self.assertAlmostEqual(np.sum(rawdata_averaged['occupancy']), 1.)
+
+    def test_time_step_convergence(self):
+        weights = []
+        for time_step in [10, 100]:
+            params = parameters.modify_parameters(
+                self.params, [('sim', 'averaged_time_step', time_step)])
+            rawdata = averaged_dynamics.AveragedRat(params).run()
+            weights.append(rawdata['exc']['weights'][-1])
+        np.testing.assert_allclose(weights[0], weights[1], rtol=1e-2)
+
+    def test_linear_mode_equals_rectified_mode_for_positive_rates(self):
+        rawdata = {}
+        for mode in ['linear', 'rectified']:
+            params = parameters.modify_parameters(
+                self.params, [('sim', 'averaged_mode', mode)])
+            averaged_rat = averaged_dynamics.AveragedRat(params)
+            rawdata[mode] = averaged_rat.run()
+        # Initially the output rates are positive everywhere
+        np.testing.assert_allclose(rawdata['linear']['exc']['weights'][1],
+                                   rawdata['rectified']['exc']['weights'][1],
+                                   rtol=1e-6)
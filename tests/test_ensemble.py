@@ -0,0 +1,71 @@
+import unittest
+import numpy as np
+from learning_grids import initialization
+from learning_grids import ensemble
+from learning_grids import parameters
+
+
+class TestEnsemble(unittest.TestCase):
+
+    def test_ensemble_equals_single_simulations(self):
+        """
+        Each replica of an ensemble must give the same rawdata as a
+        single simulation with the same seeds.
+        """
+        params = parameters.modify_parameters(
+            parameters.params_1d_place2grid,
+            [
+                ('sim', 'simulation_time', 400),
+                ('sim', 'every_nth_step', 100),
+                ('sim', 'every_nth_step_weights', 100),
+                ('sim', 'spacing', 11),
+            ])
+        params_list = ensemble.get_params_for_seeds(params, [0, 1, 2])
+        rawdata_list = ensemble.RatEnsemble(params_list).run()
+        for params, ensemble_rawdata in zip(params_list, rawdata_list):
+            rawdata = initialization.Rat(params).run()
+            for key in ['positions', 'output_rates', 'output_rate_grid']:
+                np.testing.assert_allclose(
+                    rawdata[key], ensemble_rawdata[key], rtol=1e-9)
+            for p in ['exc', 'inh']:
+                np.testing.assert_allclose(
+                    rawdata[p]['weights'], ensemble_rawdata[p]['weights'],
+                    rtol=1e-9)
+
+    def test_learning_rate_sweep_equals_single_simulations(self):
+        """
+        Each variant of a learning rate sweep must give the same rawdata
+        as a single simulation with the same learning rates.
+        """
+        params = parameters.modify_parameters(
+            parameters.params_1d_place2grid,
+            [
+                ('sim', 'simulation_time', 400),
+                ('sim', 'every_nth_step', 100),
+                ('sim', 'every_nth_step_weights', 100),
+                ('sim', 'spacing', 11),
+            ])
+        factors = np.array([0.5, 1., 4.])
+        params_list = ensemble.get_params_for_learning_rates(
+            params, params['exc']['eta'] * factors,
+            params['inh']['eta'] * factors)
+        rawdata_list = ensemble.LearningRateSweep(params_list).run()
+        for params, sweep_rawdata in zip(params_list, rawdata_list):
+            rawdata = initialization.Rat(params).run()
+            for key in ['positions', 'output_rates', 'output_rate_grid']:
+                np.testing.assert_allclose(
+                    rawdata[key], sweep_rawdata[key], rtol=1e-9)
+            for p in ['exc', 'inh']:
+                np.testing.assert_allclose(
+                    rawdata[p]['weights'], sweep_rawdata[p]['weights'],
+                    rtol=1e-9)
+
+    def test_learning_rate_sweep_needs_equal_parameters(self):
+        """
+        The variants must not differ in other parameters than 'eta'
+        """
+        params_list = ensemble.get_params_for_learning_rates(
+            parameters.params_test, [1e-3, 2e-3], [1e-3, 2e-3])
+        params_list[1]['sim']['seed_centers'] += 1
+        with self.assertRaises(SystemExit):
+            ensemble.LearningRateSweep(params_list)
@@ -1,7 +1,13 @@
 __author__ = 'simonweber'
+import os
 import unittest
+import shutil
+import pickle
+import tempfile
 import numpy as np
 from learning_grids import initialization
+from learning_grids import input_rates_cache
+from learning_grids import parameters
 
 class TestSynapses(initialization.Synapses):
     def __init__(self):
@@ -269,6 +275,42 @@ class TestInitialization(unittest.TestCase):
             self.assertAlmostEqual(
                 np.std(auto_corr_lengths)/n, 0., delta=sigma/10.)
 
+    def test_get_gaussian_processes_equals_single_gaussian_processes(self):
+        n = 5
+        for dimensions, sigma in [(1, np.array([0.1])),
+                                  (2, np.array([0.1, 0.2]))]:
+            linspace = np.linspace(-0.55, 0.55, 45)
+            np.random.seed(1)
+            expected = [initialization.get_gaussian_process(
+                0.5, sigma, linspace, dimensions=dimensions,
+                rescale='fixed_mean') for i in np.arange(n)]
+            if dimensions == 1:
+                expected = [gp for gp, gp_min, gp_max in expected]
+            np.random.seed(1)
+            gps, gp_min, gp_max = initialization.get_gaussian_processes(
+                0.5, sigma, linspace, n, dimensions=dimensions,
+                rescale='fixed_mean', batch_size=2)
+            np.testing.assert_allclose(gps, np.stack(expected, axis=-1),
+                                       atol=1e-10)
+
+    def test_set_input_rates_low_resolution(self):
+        rat = TestRat()
+        rat.spacing = 5
+        linspace = np.linspace(-0.55, 0.55, 12)
+        X, Y = np.meshgrid(linspace, linspace)
+        positions = np.stack([X, Y], axis=-1)[:, :, np.newaxis, :]
+        # Bilinear interpolation is exact for linear functions
+        n = np.arange(3)
+        rat.input_rates = {'exc': (n + 2 * linspace[:, np.newaxis, np.newaxis]
+                                   - linspace[np.newaxis, :, np.newaxis])}
+        rat.input_rates_low_resolution = {}
+        rat.set_input_rates_low_resolution('exc', positions)
+        linspace_low_resolution = np.linspace(-0.5, 0.5, 5)
+        expected = (n + 2 * linspace_low_resolution[:, np.newaxis, np.newaxis]
+                    - linspace_low_resolution[np.newaxis, :, np.newaxis])
+        np.testing.assert_allclose(rat.input_rates_low_resolution['exc'],
+                                   expected, atol=1e-12)
+
     def get_auto_corr_lengths_from_n_grf(self, radius, sigma, linspace, n=100):
         """
         Returns lists of auto-correlation lengths of many GRFs.
@@ -373,3 +415,391 @@ class TestInitialization(unittest.TestCase):
                                                    distribution,
                                                    selected_weight=2)
         np.testing.assert_array_equal(expected, result)
+
+    def test_learning_in_mini_batches(self):
+        """
+        Mini batches must approximate learning step by step
+        """
+        params = parameters.modify_parameters(
+            parameters.params_1d_place2grid,
+            [
+                ('sim', 'simulation_time', 2000),
+                ('sim', 'every_nth_step', 100),
+                ('sim', 'every_nth_step_weights', 500),
+                ('sim', 'spacing', 11),
+            ])
+        rawdata = initialization.Rat(params).run()
+        params['sim']['learning_batch_size'] = 20
+        rawdata_batch = initialization.Rat(params).run()
+        # The trajectory is the same
+        np.testing.assert_array_equal(rawdata['positions'],
+                                      rawdata_batch['positions'])
+        for p in ['exc', 'inh']:
+            w, w_batch = rawdata[p]['weights'], rawdata_batch[p]['weights']
+            self.assertLess(np.linalg.norm(w - w_batch) / np.linalg.norm(w),
+                            1e-2)
+        self.assertEqual(len(rawdata_batch['mini_batch_deviation']),
+                         len(rawdata_batch['exc']['weights']))
+        self.assertTrue(np.all(rawdata_batch['mini_batch_deviation'][1:] > 0))
+        # The replay step by step does not change the learning
+        params['sim']['mini_batch_reference'] = True
+        rawdata_reference = initialization.Rat(params).run()
+        for p in ['exc', 'inh']:
+            np.testing.assert_array_equal(rawdata_batch[p]['weights'],
+                                          rawdata_reference[p]['weights'])
+        deviation = rawdata_reference['mini_batch_weight_deviation']
+        self.assertTrue(np.all(deviation[1:] > 0))
+        self.assertTrue(np.all(deviation < 1e-2))
+
+    def test_sparse_input_rates(self):
+        """
+        Learning with the active inputs only must agree with all inputs
+        """
+        for normalization in ['quadratic_multiplicative',
+                              'linear_multiplicative']:
+            params = parameters.modify_parameters(
+                parameters.params_1d_place2grid,
+                [
+                    ('sim', 'simulation_time', 1000),
+                    ('sim', 'every_nth_step', 100),
+                    ('sim', 'every_nth_step_weights', 500),
+                    ('sim', 'spacing', 11),
+                    ('out', 'normalization', normalization),
+                ])
+            rawdata = initialization.Rat(params).run()
+            params['sim']['sparse_input_rates'] = True
+            rat = initialization.Rat(params)
+            # Most inputs are not active at a given position
+            input_rates = rat.input_rates_sparse['exc']
+            self.assertLess(input_rates.nnz, 0.5 * np.prod(input_rates.shape))
+            rawdata_sparse = rat.run()
+            for p in ['exc', 'inh']:
+                np.testing.assert_allclose(rawdata_sparse[p]['weights'],
+                                           rawdata[p]['weights'],
+                                           rtol=1e-5, atol=1e-8)
+            np.testing.assert_allclose(rawdata_sparse['output_rate_grid'],
+                                       rawdata['output_rate_grid'],
+                                       rtol=1e-5, atol=1e-8)
+
+    def test_incremental_normalization(self):
+        """
+        Incrementally maintained norms must agree with computed norms
+        """
+        for normalization in ['quadratic_multiplicative',
+                              'linear_multiplicative']:
+            params = parameters.modify_parameters(
+                parameters.params_1d_place2grid,
+                [
+                    ('sim', 'simulation_time', 1000),
+                    ('sim', 'every_nth_step', 100),
+                    ('sim', 'every_nth_step_weights', 500),
+                    ('sim', 'spacing', 11),
+                    ('out', 'normalization', normalization),
+                ])
+            rawdata = initialization.Rat(params).run()
+            params['sim']['incremental_normalization'] = True
+            params['sim']['normalization_resync_interval'] = 300
+            rawdata_incremental = initialization.Rat(params).run()
+            for p in ['exc', 'inh']:
+                np.testing.assert_allclose(rawdata_incremental[p]['weights'],
+                                           rawdata[p]['weights'],
+                                           rtol=1e-10, atol=1e-12)
+            np.testing.assert_allclose(rawdata_incremental['output_rate_grid'],
+                                       rawdata['output_rate_grid'],
+                                       rtol=1e-10, atol=1e-12)
+
+    def test_single_precision(self):
+        """
+        Single precision must be close to double precision
+        """
+        params = parameters.modify_parameters(
+            parameters.params_1d_place2grid,
+            [
+                ('sim', 'simulation_time', 1000),
+                ('sim', 'every_nth_step', 100),
+                ('sim', 'every_nth_step_weights', 500),
+                ('sim', 'spacing', 11),
+            ])
+        rawdata = initialization.Rat(params).run()
+        params['sim']['dtype'] = 'float32'
+        rat = initialization.Rat(params)
+        rawdata_32 = rat.run()
+        for p in ['exc', 'inh']:
+            self.assertEqual(rat.input_rates[p].dtype, np.float32)
+            self.assertEqual(rat.synapses[p].weights.dtype, np.float32)
+            self.assertEqual(rawdata_32[p]['weights'].dtype, np.float32)
+            np.testing.assert_allclose(rawdata_32[p]['weights'],
+                                       rawdata[p]['weights'], rtol=1e-3)
+        self.assertEqual(rawdata_32['output_rate_grid'].dtype, np.float32)
+        np.testing.assert_allclose(rawdata_32['output_rate_grid'],
+                                   rawdata['output_rate_grid'],
+                                   rtol=1e-3, atol=1e-3)
+
+    def test_rng_streams(self):
+        """
+        Independent random number streams of the components
+
+        The results must not depend on the global random state and a
+        different motion seed must only change the motion.
+        """
+        params = parameters.modify_parameters(
+            parameters.params_1d_place2grid,
+            [
+                ('sim', 'simulation_time', 400),
+                ('sim', 'every_nth_step', 100),
+                ('sim', 'every_nth_step_weights', 100),
+                ('sim', 'spacing', 11),
+                ('sim', 'rng_mode', 'streams'),
+            ])
+        rawdata = []
+        for global_seed, seed_motion in [(1, 1), (2, 1), (1, 2)]:
+            np.random.seed(global_seed)
+            rawdata.append(initialization.Rat(parameters.modify_parameters(
+                params, [('sim', 'seed_motion', seed_motion)])).run())
+        for p in ['exc', 'inh']:
+            np.testing.assert_array_equal(rawdata[0][p]['centers'],
+                                          rawdata[1][p]['centers'])
+            np.testing.assert_array_equal(rawdata[0][p]['weights'],
+                                          rawdata[1][p]['weights'])
+            np.testing.assert_array_equal(rawdata[0][p]['centers'],
+                                          rawdata[2][p]['centers'])
+            np.testing.assert_array_equal(rawdata[0][p]['weights'][0],
+                                          rawdata[2][p]['weights'][0])
+        np.testing.assert_array_equal(rawdata[0]['positions'],
+                                      rawdata[1]['positions'])
+        self.assertFalse(np.array_equal(rawdata[0]['positions'],
+                                        rawdata[2]['positions']))
+
+    def test_stream_rawdata(self):
+        """
+        Streamed rawdata must equal the rawdata in memory
+        """
+        params = parameters.modify_parameters(
+            parameters.params_1d_place2grid,
+            [
+                ('sim', 'simulation_time', 400),
+                ('sim', 'every_nth_step', 100),
+                ('sim', 'every_nth_step_weights', 100),
+                ('sim', 'spacing', 11),
+            ])
+        rawdata = initialization.Rat(params).run()
+        directory = tempfile.mkdtemp()
+        try:
+            params['sim']['stream_rawdata'] = True
+            params['sim']['rawdata_directory'] = directory
+            rawdata_streamed = initialization.Rat(params).run()
+            self.assertIsInstance(rawdata_streamed['exc']['weights'],
+                                  np.memmap)
+            for key in ['positions', 'output_rates', 'output_rate_grid']:
+                np.testing.assert_array_equal(rawdata[key],
+                                              rawdata_streamed[key])
+            for p in ['exc', 'inh']:
+                np.testing.assert_array_equal(
+                    rawdata[p]['weights'], rawdata_streamed[p]['weights'])
+        finally:
+            shutil.rmtree(directory)
+
+    def assert_rawdata_equal(self, rawdata, other):
+        """
+        Compares all entries of two rawdata dictionaries
+        """
+        self.assertEqual(set(rawdata), set(other))
+        for key, value in rawdata.items():
+            if isinstance(value, dict):
+                self.assert_rawdata_equal(value, other[key])
+            elif value is None:
+                self.assertIsNone(other[key], key)
+            else:
+                np.testing.assert_array_equal(value, other[key], err_msg=key)
+
+    def test_input_rates_cache(self):
+        """
+        Input rates from the cache must equal newly computed input rates
+        """
+        params = parameters.modify_parameters(
+            parameters.params_1d_place2grid,
+            [
+                ('sim', 'simulation_time', 400),
+                ('sim', 'every_nth_step', 100),
+                ('sim', 'every_nth_step_weights', 100),
+                ('sim', 'spacing', 11),
+                # In mode 'legacy' the initial direction depends on the
+                # random numbers drawn before, e.g. by the previous rat
+                ('sim', 'rng_mode', 'streams'),
+            ])
+        rawdata = initialization.Rat(params).run()
+        directory = tempfile.mkdtemp()
+        try:
+            params['sim']['input_rates_cache'] = directory
+            # The first rat fills the cache, the second one reads from it
+            for n in np.arange(2):
+                rat = initialization.Rat(params)
+                rawdata_cached = rat.run()
+                self.assert_rawdata_equal(rawdata, rawdata_cached)
+            self.assertIsInstance(rat.input_rates['exc'], np.memmap)
+            # The motion does not change the input rates
+            params['sim']['seed_motion'] += 1
+            initialization.Rat(params)
+            self.assertEqual(
+                len(input_rates_cache.InputRatesCache(directory).get_entries()),
+                2)
+            # The centers do
+            params['sim']['seed_centers'] += 1
+            initialization.Rat(params)
+            self.assertEqual(
+                len(input_rates_cache.InputRatesCache(directory).get_entries()),
+                4)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_input_rates_cache_gaussian_process(self):
+        """
+        A cache hit must restore the extrema of Gaussian random fields
+        """
+        params = parameters.modify_parameters(
+            parameters.params_1d_non_localized2grid,
+            [
+                ('sim', 'simulation_time', 400),
+                ('sim', 'every_nth_step', 100),
+                ('sim', 'every_nth_step_weights', 100),
+                ('sim', 'spacing', 11),
+                ('exc', 'number_per_dimension', np.array([40])),
+                ('inh', 'number_per_dimension', np.array([10])),
+                ('sim', 'rng_mode', 'streams'),
+            ])
+        directory = tempfile.mkdtemp()
+        try:
+            params['sim']['input_rates_cache'] = directory
+            rawdata_miss = initialization.Rat(params).run()
+            rawdata_hit = initialization.Rat(params).run()
+            self.assertIsNotNone(rawdata_hit['exc']['gp_min'])
+            self.assert_rawdata_equal(rawdata_miss, rawdata_hit)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_resume_from_checkpoint(self):
+        """
+        An interrupted simulation must continue as if uninterrupted
+        """
+        class Interrupt(Exception):
+            pass
+
+        class InterruptedRat(initialization.Rat):
+            def _save_checkpoint(self, rawdata, step):
+                initialization.Rat._save_checkpoint(self, rawdata, step)
+                if step == 300:
+                    raise Interrupt
+
+        directory = tempfile.mkdtemp()
+        rawdata_directory = tempfile.mkdtemp()
+        try:
+            params = parameters.modify_parameters(
+                parameters.params_1d_place2grid,
+                [
+                    ('sim', 'simulation_time', 500),
+                    ('sim', 'every_nth_step', 50),
+                    ('sim', 'every_nth_step_weights', 100),
+                    ('sim', 'spacing', 11),
+                    ('sim', 'checkpoint_interval', 150),
+                    ('sim', 'checkpoint_directory', directory),
+                    ('sim', 'rawdata_directory', rawdata_directory),
+                ])
+            rawdata = initialization.Rat(params).run()
+            for stream_rawdata in [False, True]:
+                params['sim']['stream_rawdata'] = stream_rawdata
+                with self.assertRaises(Interrupt):
+                    InterruptedRat(params).run()
+                path = initialization.Rat(params)._get_checkpoint_path()
+                self.assertEqual(os.listdir(directory),
+                                 [os.path.basename(path)])
+                with open(path, 'rb') as f:
+                    stored = pickle.load(f)['rawdata']
+                # Only the snapshots up to step 300 are stored
+                if stream_rawdata:
+                    self.assertEqual(stored['snapshots'], {})
+                else:
+                    self.assertEqual(len(stored['snapshots']['positions']), 7)
+                    self.assertEqual(
+                        len(stored['snapshots']['exc/weights']), 4)
+                rawdata_resumed = initialization.Rat(params).run()
+                for key in ['positions', 'output_rates', 'output_rate_grid']:
+                    np.testing.assert_array_equal(rawdata[key],
+                                                  rawdata_resumed[key])
+                for p in ['exc', 'inh']:
+                    np.testing.assert_array_equal(
+                        rawdata[p]['weights'], rawdata_resumed[p]['weights'])
+                # The checkpoint is deleted after the simulation
+                self.assertEqual(os.listdir(directory), [])
+            # And so is the streamed rawdata of the interrupted simulation
+            self.assertEqual(len(os.listdir(rawdata_directory)), 1)
+            # Checkpoints of other parameters are not loaded
+            with self.assertRaises(Interrupt):
+                InterruptedRat(params).run()
+            params['sim']['seed_motion'] += 1
+            initialization.Rat(params).run()
+            self.assertEqual(os.listdir(directory), [os.path.basename(path)])
+        finally:
+            shutil.rmtree(directory)
+            shutil.rmtree(rawdata_directory)
+
+    def test_output_rate_grid_in_background(self):
+        params = parameters.modify_parameters(
+            parameters.params_1d_place2grid,
+            [
+                ('sim', 'simulation_time', 1000),
+                ('sim', 'every_nth_step', 100),
+                ('sim', 'every_nth_step_weights', 50),
+                ('sim', 'spacing', 11),
+            ])
+        rawdata = initialization.Rat(params).run()
+        params['sim']['output_rate_grid_workers'] = 2
+        rawdata_background = initialization.Rat(params).run()
+        np.testing.assert_array_equal(rawdata['output_rate_grid'],
+                                      rawdata_background['output_rate_grid'])
+
+    def test_early_stopping(self):
+        params = parameters.modify_parameters(
+            parameters.params_1d_place2grid,
+            [
+                ('sim', 'simulation_time', 1000),
+                ('sim', 'every_nth_step', 50),
+                ('sim', 'every_nth_step_weights', 100),
+                ('sim', 'spacing', 11),
+            ])
+        rawdata = initialization.Rat(params).run()
+        params['sim']['early_stopping'] = 'weight_change'
+        # Any change is below the threshold, so it stops after the
+        # 'early_stopping_patience' snapshots that follow the initial one
+        params['sim']['early_stopping_threshold'] = np.inf
+        params['sim']['early_stopping_patience'] = 3
+        rawdata_stopped = initialization.Rat(params).run()
+        self.assertEqual(rawdata_stopped['stop_step'][0], 300)
+        self.assertEqual(len(rawdata_stopped['exc']['weights']), 4)
+        self.assertEqual(len(rawdata_stopped['output_rate_grid']), 4)
+        self.assertEqual(len(rawdata_stopped['positions']), 7)
+        for key in ['positions', 'output_rates', 'output_rate_grid']:
+            n = len(rawdata_stopped[key])
+            np.testing.assert_array_equal(rawdata[key][:n],
+                                          rawdata_stopped[key])
+        # Without threshold and patience the defaults are used
+        del params['sim']['early_stopping_threshold']
+        del params['sim']['early_stopping_patience']
+        initialization.Rat(params).run()
+
+    def test_profile(self):
+        params = parameters.modify_parameters(
+            parameters.params_1d_place2grid,
+            [
+                ('sim', 'simulation_time', 200),
+                ('sim', 'every_nth_step', 50),
+                ('sim', 'every_nth_step_weights', 100),
+                ('sim', 'spacing', 11),
+                ('sim', 'profile', True),
+            ])
+        rawdata = initialization.Rat(params).run()
+        profile = rawdata['profile']
+        for phase in ['init', 'run', 'update_weights', 'output_rate']:
+            self.assertIn(phase, profile)
+        self.assertEqual(profile['update_weights']['calls'][0], 200)
+        self.assertLessEqual(profile['update_weights']['time'][0],
+                             profile['run']['time'][0])
@@ -0,0 +1,91 @@
+import os
+import shutil
+import tempfile
+import unittest
+import subprocess
+import sys
+import numpy as np
+from learning_grids import input_rates_cache
+
+
+class TestInputRatesCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = input_rates_cache.InputRatesCache(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_get_key(self):
+        params = {'sigma': np.array([0.05, 0.05]), 'number': 10}
+        self.assertEqual(input_rates_cache.get_key(params),
+                         input_rates_cache.get_key(dict(params)))
+        self.assertNotEqual(
+            input_rates_cache.get_key(params),
+            input_rates_cache.get_key(dict(params,
+                                           sigma=np.array([0.05, 0.06]))))
+        self.assertNotEqual(input_rates_cache.get_key(params, 'exc'),
+                            input_rates_cache.get_key(params, 'inh'))
+
+    def test_store_and_load(self):
+        self.assertIsNone(self.cache.load('a'))
+        rates = np.random.random_sample((5, 3))
+        self.cache.store('a', {'input_rates': rates})
+        loaded = self.cache.load('a')['input_rates']
+        self.assertIsInstance(loaded, np.memmap)
+        self.assertFalse(loaded.flags.writeable)
+        np.testing.assert_array_equal(loaded, rates)
+
+    def test_evict_least_recently_used(self):
+        for key in ['a', 'b', 'c']:
+            self.cache.store(key, {'input_rates': np.zeros(1000)})
+            # Distinct times of the last use
+            os.utime(os.path.join(self.directory, key), (0, 1e9 + ord(key)))
+        size = self.cache.get_entries()[0][1]
+        self.cache.max_size = 2.5 * size
+        self.cache.evict()
+        keys = sorted(key for _, _, key in self.cache.get_entries())
+        self.assertEqual(keys, ['b', 'c'])
+
+    def test_locked_entries_are_kept(self):
+        if input_rates_cache.fcntl is None:
+            self.skipTest('No file locks on this platform')
+        for key in ['a', 'b']:
+            self.cache.store(key, {'input_rates': np.zeros(1000)})
+        self.cache.max_size = 0
+        # Another worker that is loading 'a' holds its lock
+        with self.cache.lock('a'):
+            self.cache.evict()
+        keys = [key for _, _, key in self.cache.get_entries()]
+        self.assertEqual(keys, ['a'])
+
+    def test_entries_in_use_are_kept(self):
+        for key in ['a', 'b']:
+            self.cache.store(key, {'input_rates': np.zeros(1000)})
+        f = self.cache.attach('a')
+        if f is None:
+            self.skipTest('No file locks on this platform')
+        self.assertTrue(self.cache.is_used('a'))
+        self.assertFalse(self.cache.is_used('b'))
+        # Attached from another process
+        code = ('import time, sys; from learning_grids import '
+                'input_rates_cache as c; f = c.InputRatesCache(sys.argv[1])'
+                '.attach("b"); print(1, flush=True); time.sleep(60)')
+        process = subprocess.Popen(
+            [sys.executable, '-c', code, self.directory],
+            stdout=subprocess.PIPE)
+        try:
+            process.stdout.readline()
+            self.assertTrue(self.cache.is_used('b'))
+            self.cache.max_size = 0
+            self.cache.evict()
+            self.assertEqual(self.cache.remove_unused(), 0)
+            self.assertEqual(len(self.cache.get_entries()), 2)
+        finally:
+            process.kill()
+            process.wait()
+        self.assertEqual(self.cache.remove_unused(), 1)
+        f.close()
+        self.assertEqual(self.cache.remove_unused(), 1)
+        self.assertEqual(self.cache.get_entries(), [])
@@ -0,0 +1,68 @@
+import unittest
+import numpy as np
+from learning_grids import initialization
+from learning_grids import trajectories
+
+
+class TestRat(initialization.Rat):
+    def __init__(self, dimensions=2):
+        self.dimensions = dimensions
+        self.radius = 0.5
+        self.x, self.y, self.z = 0.1, 0.2, 0.15
+        self.phi, self.theta = 0., 0.
+        self.move_right = True
+        self.velocity_dt = 1e-2
+        self.persistence_length = 0.5
+        self.angular_sigma = np.sqrt(
+            2. * self.velocity_dt / self.persistence_length)
+        self.turning_probability = self.velocity_dt / self.persistence_length
+        self.dspace = np.sqrt(2.0 * 0.01)
+        self.boundary_conditions = 'reflective'
+
+
+class TestTrajectories(unittest.TestCase):
+
+    def test_reproducible_mode_equals_moving_step_by_step(self):
+        steps = np.arange(1, 501)
+        rat = TestRat()
+        np.random.seed(1)
+        expected = []
+        for rat.step in steps:
+            rat.move_persistently()
+            expected.append([rat.x, rat.y])
+
+        rat = TestRat()
+        np.random.seed(1)
+        trajectory = trajectories.Trajectory(rat, rat.move_persistently)
+        block = np.concatenate([trajectory.get_block(steps[:123]),
+                                trajectory.get_block(steps[123:])])
+        np.testing.assert_array_equal(block[:, :2], expected)
+
+    def test_vectorized_mode_stays_in_box(self):
+        steps = np.arange(1, 20001)
+        for dimensions in [1, 2]:
+            rat = TestRat(dimensions=dimensions)
+            np.random.seed(2)
+            trajectory = trajectories.Trajectory(
+                rat, rat.move_persistently, mode='vectorized')
+            block = trajectory.get_block(steps)
+            positions = block[:, :dimensions]
+            # Like in the step by step motion, the rat can leave the
+            # box by at most a single step
+            self.assertTrue(
+                np.all(np.abs(positions) <= rat.radius + rat.velocity_dt))
+            # Velocity is constant
+            np.testing.assert_allclose(
+                np.linalg.norm(np.diff(positions, axis=0), axis=1),
+                rat.velocity_dt)
+            # The rat explores the entire box
+            self.assertTrue(np.all(np.amax(positions, axis=0) > 0.45))
+            self.assertTrue(np.all(np.amin(positions, axis=0) < -0.45))
+
+    def test_vectorized_diffusive_motion_stays_in_box(self):
+        rat = TestRat()
+        np.random.seed(3)
+        trajectory = trajectories.Trajectory(
+            rat, rat.move_diffusively, mode='vectorized')
+        block = trajectory.get_block(np.arange(1, 5001))
+        self.assertTrue(np.all(np.abs(block[:, :2]) <= rat.radius))
@@ -0,0 +1,62 @@
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from learning_grids import trajectory_store
+from learning_grids import utils
+
+
+class TestTrajectoryStore(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_concatenated_trajectory(self):
+        """
+        The permuted chunks must equal the concatenated chunk files
+        """
+        positions, offsets = trajectory_store.load(self.directory)
+        self.assertIsInstance(positions, np.memmap)
+        self.assertFalse(positions.flags.writeable)
+        self.assertEqual(positions.shape, (offsets[-1], 2))
+        order = np.random.RandomState(1).permutation(
+            trajectory_store.N_CHUNKS)
+        expected = utils.get_concatenated_10_minute_trajectories(order)
+        trajectory = trajectory_store.ConcatenatedTrajectory(
+            positions, offsets, order)
+        self.assertEqual(len(trajectory), len(expected))
+        steps = np.arange(len(expected))
+        result = trajectory[steps]
+        np.testing.assert_array_equal(result[:, 0], expected['x'])
+        np.testing.assert_array_equal(result[:, 1], expected['y'])
+        x, y = trajectory[12345]
+        self.assertEqual((x, y), tuple(expected[12345]))
+        # The second load opens the consolidated store
+        positions_2, _ = trajectory_store.load(self.directory)
+        self.assertEqual(positions_2.filename, positions.filename)
+
+    def test_resample(self):
+        """
+        Decimation keeps every n-th frame, refinement interpolates
+        """
+        positions = np.arange(20.).reshape(10, 2)
+        offsets = np.array([0, 5, 10])
+        decimated = trajectory_store.resample(positions, offsets, 2)
+        np.testing.assert_array_equal(decimated['offsets'], [0, 3, 6])
+        np.testing.assert_array_equal(decimated['positions'],
+                                      positions[[0, 2, 4, 5, 7, 9]])
+        refined = trajectory_store.resample(positions, offsets, 0.5)
+        np.testing.assert_array_equal(refined['offsets'], [0, 9, 18])
+        np.testing.assert_array_equal(refined['positions'][:9, 0],
+                                      np.arange(0., 9., 1.))
+        # No interpolation between the chunks
+        np.testing.assert_array_equal(refined['positions'][9], positions[5])
+        resampled, resampled_offsets = trajectory_store.load(self.directory,
+                                                             resampling=2.5)
+        _, offsets = trajectory_store.load(self.directory)
+        self.assertEqual(len(resampled_offsets), len(offsets))
+        self.assertAlmostEqual(offsets[-1] / resampled_offsets[-1], 2.5,
+                               places=2)
@@ -73,3 +73,59 @@ class TestObservables(unittest.TestCase):
         result = utils.get_concatenated_10_minute_trajectories(order)
         expected = np.load('../data/sargolini_trajectories_610min.npy')
         np.testing.assert_array_equal(result, expected)
+
+    def test_get_output_rates_lateral_inhibition(self):
+        """
+        The vectorized solver must agree with the walk through positions
+        """
+        class LateralInhibition(utils.Utilities):
+            dimensions = 2
+            lateral_inhibition = True
+            output_neurons = 3
+            dt = 1.
+            tau = 10.
+            weight_lateral = 0.4
+            radius = 0.5
+
+        rng = np.random.RandomState(0)
+        spacing = 7
+        rawdata = {'exc': {'weights': rng.rand(1, 3, 20)},
+                   'inh': {'weights': 0.5 * rng.rand(1, 3, 10)}}
+        input_rates = {'exc': rng.rand(spacing, spacing, 20),
+                       'inh': rng.rand(spacing, spacing, 10)}
+        positions_grid = np.zeros((spacing, spacing, 1, 2))
+        li = LateralInhibition()
+        output_rates = {}
+        for solver in ['walk', 'vectorized']:
+            li.lateral_inhibition_solver = solver
+            output_rates[solver] = li.get_output_rates_from_equation(
+                0, rawdata, spacing, positions_grid=positions_grid,
+                input_rates=input_rates, equilibration_steps=1000)
+        # Some rates are suppressed by lateral inhibition
+        self.assertTrue(np.any(output_rates['walk'] == 0))
+        np.testing.assert_allclose(output_rates['vectorized'],
+                                   output_rates['walk'], atol=1e-4)
+
+    def test_symmetric_gaussian_on_grid(self):
+        """
+        The Gaussian on a grid of positions is computed from its
+        profiles along x and y, it must agree with the full evaluation
+        """
+        rng = np.random.RandomState(1)
+        centers = rng.uniform(-0.5, 0.5, size=(6, 2, 2))
+        twoSigma2 = rng.uniform(10, 100, size=(6, 2, 1)) * np.ones(2)
+        x = np.linspace(-0.5, 0.5, 7)
+        y = np.linspace(-0.4, 0.4, 5)
+        X, Y = np.meshgrid(x, y)
+        positions = np.stack([X, Y], axis=-1)[:, :, np.newaxis, :]
+        self.assertIsNotNone(utils.Utilities._get_grid_axes(positions))
+        for i in [0, 1]:
+            expected = np.exp(
+                -np.sum(np.power(positions - centers[:, i, :], 2), axis=3)
+                * twoSigma2[:, i, 0])
+            result = utils.Utilities._symmetric_gaussian(
+                positions, centers, twoSigma2, i, axis=3)
+            np.testing.assert_allclose(result, expected, rtol=1e-12)
+        # Not a grid
+        positions[0, 0, 0, 0] = 0.3
+        self.assertIsNone(utils.Utilities._get_grid_axes(positions))
@@ -0,0 +1,237 @@
+import numpy as np
+
+
+class Trajectory:
+    """
+    Generates the trajectory of the rat in blocks of many time steps
+
+    Each block is an array of shape (n_steps, 5) that contains
+    x, y, z, phi and theta after each step. The state of the rat
+    (position and heading) is advanced to the end of the block.
+
+    There are two modes:
+
+    'reproducible':
+        The move function of the rat is called in every step. The
+        resulting trajectory is identical to the trajectory of a rat that
+        moves step by step with the same 'seed_motion'.
+    'vectorized':
+        The random numbers for many steps are drawn at once and the
+        trajectory is obtained with cumulative sums. Steps at which the
+        rat is outside of the box are done with the move function of
+        the rat, so that the reflection and periodic boundary conditions
+        are the same as for a rat that moves step by step. The resulting
+        trajectories are statistically equivalent to the trajectories in
+        the 'reproducible' mode, but not identical.
+
+    Parameters
+    ----------
+    rat : Rat
+    move : function
+        The move function of the rat, see `Rat.get_move_function`
+    mode : str
+        'reproducible' or 'vectorized'
+    window : int
+        Number of steps that are drawn at once in the 'vectorized' mode
+        before the boundaries are checked. Should be of the order of
+        the typical number of steps between two wall contacts.
+    """
+    def __init__(self, rat, move, mode='reproducible', window=128):
+        self.rat = rat
+        self.move = move
+        self.mode = mode
+        self.window = window
+
+    def get_block(self, steps):
+        """
+        Returns the trajectory for the given steps
+
+        Parameters
+        ----------
+        steps : ndarray
+            The simulation steps, see `Rat.steps`
+
+        Returns
+        -------
+        block : ndarray of shape (len(steps), 5)
+            x, y, z, phi and theta after each step
+        """
+        name = self._get_move_name()
+        if name == 'move_sargolini_data' and (
+                self.mode == 'vectorized' or self.rat.dimensions != 3):
+            # Without head direction noise the recorded positions are
+            # looked up for all steps at once, with identical results
+            return self._get_block_sargolini_data(steps)
+        if self.mode == 'vectorized':
+            if name == 'move_diffusively':
+                return self._get_block_diffusive(steps)
+            elif name in self._get_out_of_bounds_functions():
+                return self._get_block_persistent(steps, name)
+        return self._get_block_step_by_step(steps)
+
+    def _get_move_name(self):
+        # Boxside experiments use functools.partial of the move function
+        return getattr(self.move, 'func', self.move).__name__
+
+    def _set_state(self, row):
+        rat = self.rat
+        rat.x, rat.y, rat.z, rat.phi, rat.theta = row
+
+    def _get_block_step_by_step(self, steps):
+        rat = self.rat
+        apply_boundary_conditions = getattr(
+            rat, 'apply_boundary_conditions', None)
+        block = np.empty((len(steps), 5))
+        for n, rat.step in enumerate(steps):
+            self.move()
+            if apply_boundary_conditions:
+                apply_boundary_conditions()
+            block[n] = rat.x, rat.y, rat.z, rat.phi, rat.theta
+        return block
+
+    def _get_block_sargolini_data(self, steps):
+        rat = self.rat
+        block = np.empty((len(steps), 5))
+        block[:, 3:] = rat.phi, rat.theta
+        # See `Rat.move_sargolini_data`
+        idx = (steps % (len(rat.sargolini_data) - 1)).astype(np.int64)
+        block[:, :2] = rat.sargolini_data[idx]
+        if rat.dimensions == 3:
+            x_future, y_future = rat.sargolini_data[idx + 1].T
+            phi = (np.arctan2(y_future - block[:, 1], x_future - block[:, 0])
+                   + rat.rng_motion.standard_normal(len(steps))
+                   * rat.head_direction_sigma)
+            phi = (phi + np.pi) % (2 * np.pi) - np.pi
+            block[:, 2] = phi * rat.radius / np.pi
+        else:
+            block[:, 2] = np.nan if rat.z is None else rat.z
+        rat.step = steps[-1]
+        self._set_state(block[-1])
+        return block
+
+    def _get_block_diffusive(self, steps):
+        """
+        Diffusive motion with vectorized boundary conditions
+
+        Reflective boundary conditions are obtained by folding the free
+        random walk back into the box, periodic boundary conditions by
+        wrapping it.
+        """
+        rat = self.rat
+        r = rat.radius
+        block = np.empty((len(steps), 5))
+        block[:] = rat.x, rat.y, rat.z, rat.phi, rat.theta
+        d = rat.dimensions
+        free = block[0, :d] + np.cumsum(
+            rat.dspace * rat.rng_motion.standard_normal((len(steps), d)), axis=0)
+        if getattr(rat, 'boundary_conditions', 'reflective') == 'periodic':
+            block[:, :d] = (free + r) % (2 * r) - r
+        else:
+            block[:, :d] = r - np.abs((free + r) % (4 * r) - 2 * r)
+        rat.step = steps[-1]
+        self._set_state(block[-1])
+        return block
+
+    def _get_out_of_bounds_functions(self):
+        """
+        Functions that tell if the rat is outside of the box
+
+        For each persistent motion a function that returns True for each
+        position at which the move function would not just do a normal
+        move (reflection or periodic boundaries).
+        """
+        rat = self.rat
+        r = rat.radius
+        if rat.dimensions == 1:
+            def outside_box(block):
+                return np.abs(block[:, 0]) > r
+        else:
+            def outside_box(block):
+                return np.any(np.abs(block[:, :rat.dimensions]) > r, axis=1)
+
+        def outside_circle(block):
+            return block[:, 0]**2 + block[:, 1]**2 > rat.radius_sq
+
+        def outside_half_of_arena(block):
+            side = self.move.keywords['side']
+            exceed_length = rat.velocity_dt
+            r_ = r - exceed_length
+            x, y = block[:, 0], block[:, 1]
+            if side == 'left':
+                out_of_bounds_horizontal = (x < -r_) | (x > -exceed_length)
+            else:
+                out_of_bounds_horizontal = (x < exceed_length) | (x > r_)
+            return out_of_bounds_horizontal | (y < -r_) | (y > r_)
+
+        return {
+            'move_persistently': outside_box,
+            'move_persistently_circular': outside_circle,
+            'move_persistently_in_half_of_arena': outside_half_of_arena,
+            'move_persistently_periodic': outside_box,
+            'move_persistently_semi_periodic': outside_box,
+        }
+
+    def _get_free_path(self, n):
+        """
+        Returns the next n steps of persistent motion without boundaries
+        """
+        rat = self.rat
+        path = np.empty((n, 5))
+        path[:] = rat.x, rat.y, rat.z, rat.phi, rat.theta
+        if rat.dimensions == 1:
+            turn = rat.rng_motion.random(n) < rat.turning_probability
+            direction = np.where(turn, -1., 1.).cumprod()
+            if not rat.move_right:
+                direction *= -1
+            path[:, 0] += rat.velocity_dt * np.cumsum(direction)
+        elif rat.dimensions == 2:
+            path[:, 3] += np.cumsum(rat.angular_sigma * rat.rng_motion.standard_normal(n))
+            path[:, 0] += np.cumsum(rat.velocity_dt * np.cos(path[:, 3]))
+            path[:, 1] += np.cumsum(rat.velocity_dt * np.sin(path[:, 3]))
+        elif rat.dimensions == 3:
+            angles = np.cumsum(
+                rat.angular_sigma * rat.rng_motion.standard_normal((n, 2)), axis=0)
+            path[:, 3] += angles[:, 0]
+            path[:, 4] += angles[:, 1]
+            phi, theta = path[:, 3], path[:, 4]
+            path[:, 0] += np.cumsum(
+                rat.velocity_dt * np.cos(phi) * np.sin(theta))
+            path[:, 1] += np.cumsum(
+                rat.velocity_dt * np.sin(phi) * np.sin(theta))
+            # See the note on the factor 0.5 in `Rat.move_persistently`
+            path[:, 2] += np.cumsum(0.5 * rat.velocity_dt * np.cos(theta))
+        return path
+
+    def _get_block_persistent(self, steps, name):
+        rat = self.rat
+        out_of_bounds = self._get_out_of_bounds_functions()[name]
+        block = np.empty((len(steps), 5))
+        n = 0
+        while n < len(steps):
+            current = np.array([[rat.x, rat.y, rat.z, rat.phi, rat.theta]],
+                               dtype=np.float64)
+            if out_of_bounds(current)[0]:
+                # Reflection or periodic boundaries, like step by step
+                rat.step = steps[n]
+                self.move()
+                block[n] = rat.x, rat.y, rat.z, rat.phi, rat.theta
+                n += 1
+                continue
+            path = self._get_free_path(min(self.window, len(steps) - n))
+            outside = np.flatnonzero(out_of_bounds(path))
+            # Keep the path until (and including) the first position
+            # outside of the box. From there the rat is moved by the
+            # move function in the next iteration.
+            if len(outside) > 0:
+                n_accepted = outside[0] + 1
+            else:
+                n_accepted = len(path)
+            block[n:n + n_accepted] = path[:n_accepted]
+            if rat.dimensions == 1:
+                direction = np.sign(np.diff(
+                    np.concatenate(([rat.x], path[:n_accepted, 0]))))
+                rat.move_right = direction[-1] > 0
+            self._set_state(path[n_accepted - 1])
+            n += n_accepted
+        rat.step = steps[-1]
+        return block
@@ -0,0 +1,188 @@
+"""
+Consolidated store of the trajectories of Sargolini et al. 2006
+
+The 610 minutes of trajectory data come as 61 chunks of 10 minutes,
+with the x and y positions of each chunk in separate .npy files in
+data/. They are consolidated once into a single contiguous array of
+shape (T, 2), which is opened as read only memory map. All simulations
+on a node then share one copy in the page cache. The order of the
+chunks, which depends on the seed, is only an index into this array,
+see `ConcatenatedTrajectory`. Trajectories resampled to other time
+steps or speeds are kept in the same store, see `resample`.
+"""
+import os
+import numpy as np
+from . import input_rates_cache
+
+DATA_DIRECTORY = os.path.join(os.path.dirname(__file__), 'data')
+N_CHUNKS = 61
+
+
+def get_chunk_paths(data_directory=DATA_DIRECTORY):
+    """
+    Returns the paths of the x and y positions of each chunk
+    """
+    return [tuple(os.path.join(data_directory,
+                               'sargolini_{0}_pos_{1}.npy'.format(c, n))
+                  for c in ['x', 'y'])
+            for n in range(N_CHUNKS)]
+
+
+def get_store(directory=''):
+    """
+    Returns the store in `directory`, by default data/trajectory_store
+
+    The entries are never evicted.
+    """
+    return input_rates_cache.InputRatesCache(
+        directory or os.path.join(DATA_DIRECTORY, 'trajectory_store'),
+        max_size=np.inf)
+
+
+def consolidate(data_directory=DATA_DIRECTORY):
+    """
+    Concatenates all chunks in their original order
+
+    Returns
+    -------
+    arrays : dict
+        'positions': ndarray of shape (T, 2) with the x and y positions
+        'offsets': ndarray of shape (N_CHUNKS + 1,) with the first row
+            of each chunk and T
+    """
+    chunks = [np.stack([np.load(x_path), np.load(y_path)], axis=1)
+              for x_path, y_path in get_chunk_paths(data_directory)]
+    offsets = np.concatenate([[0], np.cumsum([len(c) for c in chunks])])
+    return {'positions': np.concatenate(chunks), 'offsets': offsets}
+
+
+def resample(positions, offsets, factor):
+    """
+    Samples each chunk every `factor` frames
+
+    Positions between two frames are interpolated linearly. For integer
+    factors this is a decimation to every factor-th frame, for factors
+    below 1 the trajectory is refined. Chunks are resampled separately,
+    so that no positions between the end of one chunk and the beginning
+    of the next one are created.
+
+    Parameters
+    ----------
+    positions : ndarray of shape (T, 2)
+    offsets : ndarray
+        See `consolidate`
+    factor : float
+        Number of frames per sample
+
+    Returns
+    -------
+    arrays : dict
+        'positions' and 'offsets' of the resampled chunks
+    """
+    chunks = []
+    for a, b in zip(offsets[:-1], offsets[1:]):
+        frames = np.arange(b - a)
+        n = int(np.floor((b - a - 1) / factor + 1e-9)) + 1
+        times = np.arange(n) * factor
+        chunks.append(np.stack([np.interp(times, frames, positions[a:b, i])
+                                for i in range(2)], axis=1))
+    offsets = np.concatenate([[0], np.cumsum([len(c) for c in chunks])])
+    return {'positions': np.concatenate(chunks), 'offsets': offsets}
+
+
+def load(directory='', resampling=1.):
+    """
+    Returns the consolidated trajectory, which is created if necessary
+
+    Parameters
+    ----------
+    directory : str
+        Directory of the store, see `get_store`
+    resampling : float
+        Number of recorded frames per time step of the returned
+        trajectory, see `resample`. Resampled trajectories are kept in
+        the store as well.
+
+    Returns
+    -------
+    positions : np.memmap
+        Read only array of shape (T, 2)
+    offsets : ndarray
+        See `consolidate`
+    """
+    store = get_store(directory)
+    key = input_rates_cache.get_key(
+        'sargolini', [os.path.getsize(path)
+                      for paths in get_chunk_paths() for path in paths])
+    if resampling != 1:
+        key = input_rates_cache.get_key(key, float(resampling))
+    with store.lock(key):
+        arrays = store.load(key)
+        if arrays is None:
+            if resampling != 1:
+                store.store(key, resample(*load(directory), resampling))
+            else:
+                store.store(key, consolidate())
+            arrays = store.load(key)
+    return arrays['positions'], np.asarray(arrays['offsets'])
+
+
+class ConcatenatedTrajectory:
+    """
+    The chunks of the consolidated trajectory in a given order
+
+    Indexing with a step or an array of steps returns the positions of
+    shape (2,) or (n, 2), like indexing an array with the concatenated
+    chunks, without copying the chunks.
+
+    Parameters
+    ----------
+    positions : ndarray of shape (T, 2)
+    offsets : ndarray
+        See `consolidate`
+    order : ndarray
+        Permutation of the chunks
+    """
+    def __init__(self, positions, offsets, order):
+        # Indexing a plain array is much faster than indexing a memmap,
+        # which creates a new memmap object for each result
+        self.positions = np.asarray(positions)
+        lengths = np.diff(offsets)[order]
+        # First step and first row of each chunk in the given order
+        self.starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+        self.rows = offsets[:-1][order]
+        self.length = int(np.sum(lengths))
+        # First step, last step + 1 and first row of the current chunk
+        self._chunk = (0, 0, 0)
+
+    def __len__(self):
+        return self.length
+
+    def get_rows(self, steps):
+        """
+        Returns the rows of `positions` at the given steps
+        """
+        chunk = np.searchsorted(self.starts, steps, side='right') - 1
+        return self.rows[chunk] + (steps - self.starts[chunk])
+
+    def get_row(self, step):
+        """
+        Returns the row of `positions` at a single step
+
+        Consecutive steps are mostly in the same chunk, so the chunk of
+        the last step is kept and searched only if the step is outside.
+        """
+        start, stop, row = self._chunk
+        if not start <= step < stop:
+            chunk = int(np.searchsorted(self.starts, step, side='right')) - 1
+            start = int(self.starts[chunk])
+            stop = (int(self.starts[chunk + 1])
+                    if chunk + 1 < len(self.starts) else self.length)
+            row = int(self.rows[chunk])
+            self._chunk = (start, stop, row)
+        return row + step - start
+
+    def __getitem__(self, steps):
+        if isinstance(steps, (int, np.integer)):
+            return self.positions[self.get_row(steps)]
+        return self.positions[self.get_rows(steps)]
@@ -69,9 +69,11 @@ class Utilities:
 
         With lateral inhibition the output rate has to be determined via
         integration (but fixed weights).
-        In 1 dimensions we start at one end of the box, integrate for a
-        time specified by equilibration steps and than walk to the
-        other end of the box.
+        By default the rates at all positions are integrated simultaneously,
+        see `get_output_rates_lateral_inhibition`.
+        With lateral_inhibition_solver='walk', in 1 dimensions we start at
+        one end of the box, integrate for a time specified by equilibration
+        steps and than walk to the other end of the box.
 
         Parameters
         ----------
@@ -96,6 +98,12 @@ class Utilities:
         """
 
         # plt.title('output_rates, t = %.1e' % (frame * self.every_nth_step_weights), fontsize=8)
+        if self.lateral_inhibition and getattr(
+                self, 'lateral_inhibition_solver', 'vectorized') == 'vectorized':
+            return self.get_output_rates_lateral_inhibition(
+                self.get_feedforward_drive(frame, rawdata, input_rates),
+                equilibration_steps=equilibration_steps)
+
         if self.dimensions == 1:
             linspace = np.linspace(-self.radius, self.radius, spacing)
 
@@ -221,9 +229,131 @@ class Utilities:
                                     spacing, spacing, spacing, self.output_neurons)
             return output_rates
 
+    def get_feedforward_drive(self, frame, rawdata, input_rates):
+        """
+        Excitatory minus inhibitory input to the output neurons
+
+        Parameters
+        ----------
+        frame : int
+        rawdata : dict
+        input_rates : dict
+            Input rates with the inputs along the last axis
+
+        Returns
+        -------
+        drive : ndarray of shape input_rates['exc'].shape[:-1] +
+                (output_neurons, )
+        """
+        return (
+            np.tensordot(input_rates['exc'], rawdata['exc']['weights'][frame],
+                         axes=([-1], [-1]))
+            - np.tensordot(input_rates['inh'],
+                           rawdata['inh']['weights'][frame],
+                           axes=([-1], [-1]))
+        )
+
+    def get_output_rates_lateral_inhibition(self, drive,
+                                            equilibration_steps=10000,
+                                            tolerance=1e-10):
+        """
+        Stationary output rates with lateral inhibition at many positions
+
+        The rate dynamics of `Rat.set_current_output_rate_lateral_inhibition`
+        is integrated at all positions simultaneously, until the rates
+        change by less than `tolerance` times the largest drive.
+        For weight_lateral < 1 the stationary rates are unique, so the
+        result does not depend on the order in which the positions are
+        visited, like in the walk through the positions of
+        `get_output_rates_from_equation` with
+        lateral_inhibition_solver='walk'.
+
+        Parameters
+        ----------
+        drive : ndarray of shape (..., output_neurons)
+            See `get_feedforward_drive`
+        equilibration_steps : int
+            Maximal number of integration steps
+
+        Returns
+        -------
+        output_rates : ndarray of the same shape as `drive`
+        """
+        dt_tau = self.dt / self.tau
+        atol = tolerance * max(np.amax(np.abs(drive)), 1e-300)
+        r = np.zeros_like(drive)
+        for s in np.arange(equilibration_steps):
+            r_new = (
+                r * (1 - dt_tau)
+                + dt_tau * (drive - self.weight_lateral
+                            * (np.sum(r, axis=-1, keepdims=True) - r))
+            )
+            r_new[r_new < 0] = 0
+            converged = np.amax(np.abs(r_new - r)) < atol
+            r = r_new
+            if converged:
+                break
+        return r
+
+    @staticmethod
+    def _get_grid_axes(position):
+        """
+        Returns the x and y positions of a rectangular grid of positions
+
+        Tuning functions that factorize into a function of x and a
+        function of y can be evaluated on such a grid from their
+        profiles along each axis, see `_outer_product`.
+
+        Parameters
+        ----------
+        position : ndarray
+            Positions of shape (spacing_y, spacing_x, 1, 2) as returned by
+            `Rat.get_positions`
+
+        Returns
+        -------
+        x, y : ndarrays of shape (spacing_x, 1) and (spacing_y, 1)
+            Column vectors, so that they broadcast with the centers.
+            None if `position` is not a rectangular grid.
+        """
+        if position.ndim != 4 or position.shape[2:] != (1, 2):
+            return None
+        x = position[0, :, 0, 0]
+        y = position[:, 0, 0, 1]
+        if not (np.all(position[..., 0, 0] == x)
+                and np.all(position[..., 0, 1] == y[:, np.newaxis])):
+            return None
+        return x[:, np.newaxis], y[:, np.newaxis]
+
+    @staticmethod
+    def _outer_product(profile_x, profile_y):
+        """
+        Returns the rates on a grid from the profiles along each axis
+
+        Parameters
+        ----------
+        profile_x, profile_y : ndarrays of shape (spacing_x, n) and
+            (spacing_y, n)
+
+        Returns
+        -------
+        rates : ndarray of shape (spacing_y, spacing_x, n)
+        """
+        return profile_y[:, np.newaxis, :] * profile_x[np.newaxis, :, :]
+
     @staticmethod
     def _symmetric_gaussian(position, centers, twoSigma2,
                            input_field_number, axis, height=1):
+        grid = Utilities._get_grid_axes(position)
+        if grid is not None:
+            # The Gaussian factorizes, so only 2 * n * spacing
+            # exponentials are needed instead of n * spacing**2
+            x, y = grid
+            c = centers[:, input_field_number, :]
+            ts2 = twoSigma2[:, input_field_number, 0]
+            return height * Utilities._outer_product(
+                np.exp(-np.power(x - c[:, 0], 2) * ts2),
+                np.exp(-np.power(y - c[:, 1], 2) * ts2))
         ret = height * (np.exp(
             -np.sum(
                 np.power(position - centers[:, input_field_number, :], 2),
@@ -430,17 +560,26 @@ class Utilities:
                     def get_rates(position):
                         shape = (position.shape[0], position.shape[1], self.number)
                         rates = np.zeros(shape)
+                        grid = self._get_grid_axes(position)
                         for i in np.arange(self.fields_per_synapse):
-                            rates += (
-                                    np.exp(
-                                        -np.power(
-                                            position[..., 0] - self.centers[:, i, 0], 2)
-                                        *self.twoSigma2[:, i, 0]
-                                        -np.power(
-                                            position[..., 1] - self.centers[:, i, 1], 2)
-                                        *self.twoSigma2[:, i, 1]
+                            if grid is not None:
+                                x, y = grid
+                                rates += self._outer_product(
+                                    np.exp(-np.power(x - self.centers[:, i, 0], 2)
+                                           * self.twoSigma2[:, i, 0]),
+                                    np.exp(-np.power(y - self.centers[:, i, 1], 2)
+                                           * self.twoSigma2[:, i, 1]))
+                            else:
+                                rates += (
+                                        np.exp(
+                                            -np.power(
+                                                position[..., 0] - self.centers[:, i, 0], 2)
+                                            *self.twoSigma2[:, i, 0]
+                                            -np.power(
+                                                position[..., 1] - self.centers[:, i, 1], 2)
+                                            *self.twoSigma2[:, i, 1]
+                                            )
                                         )
-                                    )
                         return rates
 
             elif self.tuning_function == 'lorentzian':
@@ -463,44 +602,68 @@ class Utilities:
                 def get_rates(position):
                     shape = (position.shape[0], position.shape[1], self.number)
                     rates = np.zeros(shape)
+                    grid = self._get_grid_axes(position)
                     for i in np.arange(self.fields_per_synapse):
-                        rates += (
-                                np.exp(
-                                    -np.power(
-                                        position[...,0] - self.centers[:, i, 0], 2)
-                                    *self.twoSigma2[:, i, 0]
-                                    )
-                                * self.norm_von_mises[..., i, 1]
-                                * np.exp(
-                                    self.scaled_kappas[...,i, 1]
-                                    * np.cos(
-                                        self.pi_over_r*(position[...,1]
-                                        - self.centers[:, i, 1]))
-                                    )
-                        )
+                        if grid is not None:
+                            x, y = grid
+                            rates += self._outer_product(
+                                np.exp(-np.power(x - self.centers[:, i, 0], 2)
+                                       * self.twoSigma2[:, i, 0]),
+                                self.norm_von_mises[..., i, 1]
+                                * np.exp(self.scaled_kappas[..., i, 1]
+                                         * np.cos(self.pi_over_r
+                                                  * (y - self.centers[:, i, 1]))))
+                        else:
+                            rates += (
+                                    np.exp(
+                                        -np.power(
+                                            position[...,0] - self.centers[:, i, 0], 2)
+                                        *self.twoSigma2[:, i, 0]
+                                        )
+                                    * self.norm_von_mises[..., i, 1]
+                                    * np.exp(
+                                        self.scaled_kappas[...,i, 1]
+                                        * np.cos(
+                                            self.pi_over_r*(position[...,1]
+                                            - self.centers[:, i, 1]))
+                                        )
+                            )
                     return rates
 
             elif self.tuning_function == 'periodic':
                 def get_rates(position):
                     shape = (position.shape[0], position.shape[1], self.number)
                     rates = np.zeros(shape)
+                    grid = self._get_grid_axes(position)
                     for i in np.arange(self.fields_per_synapse):
-                        rates += (
+                        if grid is not None:
+                            x, y = grid
+                            rates += self._outer_product(
                                 self.norm_von_mises[..., i, 0]
-                                * np.exp(
-                                    self.scaled_kappas[...,i, 0]
-                                    * np.cos(
-                                        self.pi_over_r*(position[...,0]
-                                        - self.centers[:, i, 0]))
-                                    )
-                                * self.norm_von_mises[..., i, 1]
-                                * np.exp(
-                                    self.scaled_kappas[...,i, 1]
-                                    * np.cos(
-                                        self.pi_over_r*(position[...,1]
-                                        - self.centers[:, i, 1]))
-                                    )
-                        )
+                                * np.exp(self.scaled_kappas[..., i, 0]
+                                         * np.cos(self.pi_over_r
+                                                  * (x - self.centers[:, i, 0]))),
+                                self.norm_von_mises[..., i, 1]
+                                * np.exp(self.scaled_kappas[..., i, 1]
+                                         * np.cos(self.pi_over_r
+                                                  * (y - self.centers[:, i, 1]))))
+                        else:
+                            rates += (
+                                    self.norm_von_mises[..., i, 0]
+                                    * np.exp(
+                                        self.scaled_kappas[...,i, 0]
+                                        * np.cos(
+                                            self.pi_over_r*(position[...,0]
+                                            - self.centers[:, i, 0]))
+                                        )
+                                    * self.norm_von_mises[..., i, 1]
+                                    * np.exp(
+                                        self.scaled_kappas[...,i, 1]
+                                        * np.cos(
+                                            self.pi_over_r*(position[...,1]
+                                            - self.centers[:, i, 1]))
+                                        )
+                            )
                     return rates
 
             elif self.tuning_function == 'grid':